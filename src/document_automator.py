@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 import win32com.client as win32
 import os
 import sys
@@ -6,15 +7,54 @@ import traceback
 import json
 import re
 import time
+import zlib
+import heapq
+import csv
+import glob
+import argparse
+import threading
+import tempfile
+import shutil
+import pathlib
+import warnings
+import sqlite3
+import copy
+import io
+import random
+import functools
+import zipfile
+import hashlib
+import queue
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from datetime import datetime
-from collections import defaultdict
+from collections import defaultdict, OrderedDict, deque
 import pythoncom
 import unicodedata
-import getpass
 from docx import Document
-from docx.shared import Pt
+from docx.shared import Cm
 from docx.oxml.ns import qn
-import io
+from docx.text.paragraph import Paragraph
+from docx.image.image import Image as ImagemDocx
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml.shape import CT_Inline
+from lxml import etree
+
+# Pillow (opcional): redimensiona imagens grandes antes de inseri-las
+try:
+    from PIL import Image as ImagemPIL
+except ImportError:
+    ImagemPIL = None
+
+# Ponte UNO do LibreOffice (opcional): permite manter processos persistentes
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+except ImportError:
+    uno = None
 
 # ===============================
 # CONFIGURAÇÕES INICIAIS
@@ -105,6 +145,11 @@ def perguntar_sim_nao(prompt, padrao=None):
             return padrao
         print("⚠ Responda com 's' ou 'n'")
 
+def pausar(mensagem, interativo=True):
+    """Aguarda Enter apenas no modo interativo (menu)"""
+    if interativo:
+        input(mensagem)
+
 def perguntar_path(prompt, deve_existir=True, padrao=None):
     while True:
         try:
@@ -222,7 +267,7 @@ def configurar_sistema():
     
     while True:
         base_dados = corretor.perguntar(
-            "Caminho COMPLETO para o arquivo Excel com dados: ",
+            "Caminho COMPLETO para a base de dados (Excel, CSV, Parquet ou SQLite): ",
             padrao=CONFIG.get('diretorios', {}).get('base_dados', '')
         )
         if base_dados == 'VOLTAR': 
@@ -299,12 +344,17 @@ def configurar_sistema():
         if not coluna:
             print("⚠ Coluna obrigatória!")
             continue
+        
+        # Coluna com caminho de arquivo de imagem (foto, assinatura, logotipo)
+        imagem = perguntar_sim_nao("A coluna contém o caminho de uma IMAGEM (foto, assinatura)?", padrao=False)
             
         # Confirmar antes de salvar
         print(f"\nResumo do placeholder:")
         print(f"  Marcador: [{placeholder}]")
         print(f"  Descrição: {significado}")
         print(f"  Coluna no Excel: '{coluna}'")
+        if imagem:
+            print(f"  Tipo: imagem")
         
         confirmar = perguntar_sim_nao("Confirmar este placeholder?")
         if not confirmar:
@@ -315,6 +365,8 @@ def configurar_sistema():
             "descricao": significado,
             "coluna": coluna
         }
+        if imagem:
+            CONFIG['placeholders'][placeholder].update(tipo='imagem', largura_cm=4)
         print(f"✓ Mapeado: {placeholder} → {significado} ({coluna})")
     
     # Configurações avançadas
@@ -391,6 +443,39 @@ def configurar_sistema():
             CONFIG['organizacao']['limpar_caracteres'] = limpar_chars.lower() == 's'
         break
     
+    # Saída combinada (mala direta)
+    while True:
+        combinar = corretor.perguntar(
+            "Gerar um documento combinado (mala direta) em vez de um arquivo por registro? [s/n] ",
+            tipo=str,
+            padrao='s' if CONFIG.get('saida_combinada', {}).get('modo') else 'n'
+        )
+        if combinar == 'VOLTAR': 
+            corretor.voltar()
+            continue
+            
+        if combinar.lower() != 's':
+            CONFIG['saida_combinada'] = {}
+            break
+            
+        modo = 'unico'
+        if CONFIG['organizacao'].get('ativo', False):
+            por_categoria = corretor.perguntar(
+                "Um documento combinado por pasta de organização? [s/n] ",
+                tipo=str
+            )
+            if por_categoria == 'VOLTAR': 
+                corretor.voltar()
+                continue
+            if por_categoria.lower() == 's':
+                modo = 'por_categoria'
+                
+        CONFIG['saida_combinada'] = {
+            'modo': modo,
+            'nome_arquivo': CONFIG.get('saida_combinada', {}).get('nome_arquivo', 'Documentos_combinados.docx')
+        }
+        break
+    
     # Configuração de modelo por funcionário
     print("\n📄 CONFIGURAÇÃO DE MODELO POR FUNCIONÁRIO")
     while True:
@@ -438,70 +523,302 @@ def configurar_sistema():
 # FUNÇÕES DE PROCESSAMENTO COM python-docx
 # ===============================
 
-def substituir_texto_com_docx(modelo_path, substituicoes, caminho_completo):
-    """Substitui placeholders usando python-docx preservando formatação"""
-    try:
-        # Carregar documento
-        doc = Document(modelo_path)
-        
-        # Ordenar placeholders do maior para o menor para evitar substituições parciais
-        sorted_ph = sorted(substituicoes.keys(), key=len, reverse=True)
-        
-        # Função para substituir em um parágrafo
-        def substituir_no_paragrafo(paragraph):
-            for ph in sorted_ph:
-                if ph in paragraph.text:
-                    valor = substituicoes[ph]
-                    # Preservar formatação original
-                    for run in paragraph.runs:
-                        if ph in run.text:
-                            run.text = run.text.replace(ph, valor)
-        
-        # Função para substituir em tabelas
-        def substituir_em_tabelas():
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        for paragraph in cell.paragraphs:
-                            substituir_no_paragrafo(paragraph)
-        
-        # Função para substituir em cabeçalhos e rodapés
-        def substituir_em_secoes(section):
-            for paragraph in section.header.paragraphs:
-                substituir_no_paragrafo(paragraph)
-            for paragraph in section.footer.paragraphs:
-                substituir_no_paragrafo(paragraph)
-        
-        # Processar todos os parágrafos principais
-        for paragraph in doc.paragraphs:
-            substituir_no_paragrafo(paragraph)
-        
-        # Processar tabelas
-        substituir_em_tabelas()
-        
-        # Processar cabeçalhos e rodapés
-        for section in doc.sections:
-            substituir_em_secoes(section)
-        
-        # Salvar documento
-        doc.save(caminho_completo)
-        return True
-        
-    except Exception as e:
-        print(f"⚠ Erro durante substituição com python-docx: {str(e)}")
-        traceback.print_exc()
-        return False
+class CacheModelos:
+    """Mantém em memória os modelos já lidos e analisados (invalidado pela data de modificação)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conteudos = {}
+        self._documentos = {}  # modelo -> (bytes de origem, Document analisado, nunca alterado)
+        self.acertos = 0
+        self.leituras = 0
+
+    def conteudo(self, modelo_path):
+        """Bytes do modelo, lidos do disco apenas na primeira vez ou após alteração"""
+        mtime = os.path.getmtime(modelo_path)
+        with self._lock:
+            entrada = self._conteudos.get(modelo_path)
+            if entrada and entrada[0] == mtime:
+                self.acertos += 1
+                return entrada[1]
+        origem = modelo_path
+        if modelo_path.lower().endswith('.doc'):
+            # .doc legado: ler a cópia .docx convertida
+            origem = CONVERSOR_MODELOS.converter(modelo_path)
+        with open(origem, 'rb') as f:
+            dados = f.read()
+        with self._lock:
+            self._conteudos[modelo_path] = (mtime, dados)
+            self.leituras += 1
+        return dados
+
+    def abrir(self, modelo_path):
+        """Cópia independente do modelo, analisado uma única vez (copiar é mais rápido que reler o XML)"""
+        dados = self.conteudo(modelo_path)
+        with self._lock:
+            entrada = self._documentos.get(modelo_path)
+        if entrada is None or entrada[0] is not dados:
+            entrada = (dados, Document(io.BytesIO(dados)))
+            with self._lock:
+                self._documentos[modelo_path] = entrada
+        return copy.deepcopy(entrada[1])
+
+    def limpar(self):
+        with self._lock:
+            self._conteudos.clear()
+            self._documentos.clear()
+
+CACHE_MODELOS = CacheModelos()
+
+# Placeholders de imagem: CONFIG['placeholders'][ph] = {"coluna": "Assinatura", "tipo": "imagem",
+#   "largura_cm": 4, "altura_cm": null, "largura_max_px": 800}
+# A coluna traz o caminho do arquivo (relativo a CONFIG['imagens']['pasta'] ou à
+# pasta da base). Cada arquivo é lido, redimensionado (com Pillow) e analisado
+# uma única vez; os documentos reutilizam os mesmos bytes, identificados pelo
+# conteúdo (assinaturas iguais em arquivos diferentes ocupam uma só entrada).
+
+class CacheImagens:
+    """Imagens prontas para inserção, endereçadas pelo conteúdo, com descarte LRU por tamanho"""
+    def __init__(self, limite_bytes=64 * 1024 * 1024, limite_arquivos=10000):
+        self._lock = threading.Lock()
+        self._por_arquivo = OrderedDict()  # (caminho, mtime, tamanho) -> hash do conteúdo
+        self._imagens = OrderedDict()  # (hash do conteúdo, largura máxima) -> Image do python-docx
+        self.limite_bytes = limite_bytes
+        self.limite_arquivos = limite_arquivos
+        self.bytes_em_uso = 0
+        self.acertos = 0
+        self.preparacoes = 0
+        self.descartes = 0
+
+    def _buscar(self, chave):
+        imagem = self._imagens.get(chave)
+        if imagem is not None:
+            self._imagens.move_to_end(chave)
+            self.acertos += 1
+        return imagem
+
+    def obter(self, caminho, largura_max_px=None):
+        estado = os.stat(caminho)
+        chave_arquivo = (caminho, estado.st_mtime, estado.st_size)
+        with self._lock:
+            conteudo = self._por_arquivo.get(chave_arquivo)
+            if conteudo:
+                self._por_arquivo.move_to_end(chave_arquivo)
+            imagem = self._buscar((conteudo, largura_max_px)) if conteudo else None
+        if imagem is not None:
+            return imagem
+
+        with open(caminho, 'rb') as f:
+            dados = f.read()
+        chave = (hashlib.sha256(dados).hexdigest(), largura_max_px)
+        with self._lock:
+            self._por_arquivo[chave_arquivo] = chave[0]
+            # Uma base com uma foto por registro teria uma entrada por linha
+            while len(self._por_arquivo) > self.limite_arquivos:
+                self._por_arquivo.popitem(last=False)
+            imagem = self._buscar(chave)  # Mesmo conteúdo vindo de outro arquivo
+        if imagem is not None:
+            return imagem
+
+        imagem = ImagemDocx.from_blob(preparar_imagem(dados, largura_max_px))
+        with self._lock:
+            if chave not in self._imagens:
+                self._imagens[chave] = imagem
+                self.bytes_em_uso += len(imagem.blob)
+                self.preparacoes += 1
+            while self.bytes_em_uso > self.limite_bytes and len(self._imagens) > 1:
+                _, antiga = self._imagens.popitem(last=False)
+                self.bytes_em_uso -= len(antiga.blob)
+                self.descartes += 1
+        return imagem
 
-def mostrar_barra_progresso(atual, total, largura=50):
-    percentual = atual / total
-    completos = int(largura * percentual)
-    restantes = largura - completos
+    def limpar(self):
+        with self._lock:
+            self._por_arquivo.clear()
+            self._imagens.clear()
+            self.bytes_em_uso = 0
+
+CACHE_IMAGENS = CacheImagens()
+
+def preparar_imagem(dados, largura_max_px=None):
+    """Reduz a imagem à largura máxima (se Pillow estiver instalado); senão, bytes originais"""
+    if ImagemPIL is None or not largura_max_px:
+        return dados
+    with ImagemPIL.open(io.BytesIO(dados)) as imagem:
+        if imagem.width <= largura_max_px:
+            return dados
+        formato = imagem.format or 'PNG'
+        reduzida = imagem.copy()
+        reduzida.thumbnail((largura_max_px, largura_max_px * imagem.height // imagem.width + 1))
+        saida = io.BytesIO()
+        if formato == 'JPEG':
+            reduzida.save(saida, format=formato, quality=90, optimize=True)
+        else:
+            reduzida.save(saida, format=formato)
+        return saida.getvalue()
+
+def caminho_imagem(valor):
+    """Caminho absoluto da imagem informada na planilha"""
+    caminho = limpar_caminho(str(valor))
+    if os.path.isabs(caminho):
+        return caminho
+    pasta = CONFIG.get('imagens', {}).get('pasta') or os.path.dirname(
+        limpar_caminho(CONFIG.get('diretorios', {}).get('base_dados', '')) or '.')
+    return os.path.join(limpar_caminho(pasta), caminho)
+
+def separar_imagens(substituicoes):
+    """Divide as substituições em (textos, imagens) conforme o tipo do placeholder"""
+    placeholders = CONFIG.get('placeholders', {})
+    imagens = {ph: valor for ph, valor in substituicoes.items()
+               if placeholders.get(ph, {}).get('tipo') == 'imagem'}
+    if not imagens:
+        return substituicoes, imagens
+    return {ph: valor for ph, valor in substituicoes.items() if ph not in imagens}, imagens
+
+def inserir_imagem(run, imagem, info):
+    """Acrescenta ao run a imagem já analisada do cache (run.add_picture analisaria os bytes de novo)"""
+    largura = Cm(info['largura_cm']) if info.get('largura_cm') else None
+    altura = Cm(info['altura_cm']) if info.get('altura_cm') else None
+    parte = run.part
+    partes_imagem = parte.package.image_parts
+    # Mesmo caminho de Run.add_picture, sem Image.from_file; mídia de mesmo conteúdo é gravada uma vez
+    parte_imagem = partes_imagem._get_by_sha1(imagem.sha1) or partes_imagem._add_image_part(imagem)
+    rid = parte.relate_to(parte_imagem, RT.IMAGE)
+    cx, cy = imagem.scaled_dimensions(largura, altura)
+    run._r.add_drawing(CT_Inline.new_pic_inline(parte.next_id, rid, imagem.filename, cx, cy))
+
+def substituir_imagens_em_paragrafo(paragraph, imagens):
+    """Troca placeholders de imagem pela figura (o texto ao redor é mantido no mesmo run)"""
+    for ph, valor in imagens.items():
+        if ph not in paragraph.text:
+            continue
+        info = CONFIG['placeholders'][ph]
+        imagem = None
+        if valor:
+            caminho = caminho_imagem(valor)
+            if not os.path.isfile(caminho):
+                raise FileNotFoundError(f"Imagem não encontrada para {ph}: {caminho}")
+            imagem = CACHE_IMAGENS.obter(caminho, info.get('largura_max_px'))
+        for run in paragraph.runs:
+            if ph not in run.text:
+                continue
+            trechos = run.text.split(ph)
+            run.text = trechos[0]
+            for trecho in trechos[1:]:
+                if imagem is not None:
+                    inserir_imagem(run, imagem, info)
+                if trecho:
+                    run._r.add_t(trecho)
+
+def substituir_em_paragrafo(paragraph, sorted_ph, substituicoes):
+    """Substitui placeholders nos runs de um parágrafo (preserva formatação)"""
+    for ph in sorted_ph:
+        if ph in paragraph.text:
+            valor = substituicoes[ph]
+            # Preservar formatação original
+            for run in paragraph.runs:
+                if ph in run.text:
+                    run.text = run.text.replace(ph, valor)
+
+def repetir_linhas_marcadas(raiz, linhas, parte, marcador=None):
+    """Clona as linhas de tabela marcadas (ex: [REPETIR]) uma vez por membro do grupo.
+
+    Cada cópia recebe as substituições de um membro; a linha marcada original
+    é removida (grupo sem membros = nenhuma linha). ``parte`` é a parte do
+    documento que recebe as imagens dos membros.
+    """
+    marcador = marcador or CONFIG.get('agrupamento', {}).get('marcador', '[REPETIR]')
+    for linha in list(raiz.iter(qn('w:tr'))):
+        if not any(marcador in Paragraph(p, None).text for p in linha.iter(qn('w:p'))):
+            continue
+        for membro in linhas:
+            copia = copy.deepcopy(linha)
+            textos, imagens = separar_imagens(membro)
+            sorted_ph = sorted(textos.keys(), key=len, reverse=True)
+            for p in copia.iter(qn('w:p')):
+                paragrafo = Paragraph(p, parte)
+                substituir_em_paragrafo(paragrafo, [marcador], {marcador: ''})
+                substituir_em_paragrafo(paragrafo, sorted_ph, textos)
+                if imagens:
+                    substituir_imagens_em_paragrafo(paragrafo, imagens)
+            linha.addprevious(copia)
+        linha.getparent().remove(linha)
+
+def aplicar_substituicoes(doc, substituicoes, linhas=None):
+    """Substitui os placeholders em um Document já carregado, preservando formatação"""
+    # Documento agrupado: expandir primeiro as linhas repetidas de tabela
+    if linhas is not None:
+        repetir_linhas_marcadas(doc.element.body, linhas, doc.part)
+    substituicoes, imagens = separar_imagens(substituicoes)
     
-    barra = '[' + '=' * completos + ' ' * restantes + ']'
-    percentual_texto = f"{percentual:.1%}"
+    # Ordenar placeholders do maior para o menor para evitar substituições parciais
+    sorted_ph = sorted(substituicoes.keys(), key=len, reverse=True)
     
-    sys.stdout.write(f"\r{barra} {atual}/{total} ({percentual_texto})")
-    sys.stdout.flush()
+    # Função para substituir em um parágrafo
+    def substituir_no_paragrafo(paragraph):
+        substituir_em_paragrafo(paragraph, sorted_ph, substituicoes)
+        if imagens:
+            substituir_imagens_em_paragrafo(paragraph, imagens)
+    
+    # Função para substituir em tabelas
+    def substituir_em_tabelas():
+        for table in doc.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    for paragraph in cell.paragraphs:
+                        substituir_no_paragrafo(paragraph)
+    
+    # Função para substituir em cabeçalhos e rodapés
+    def substituir_em_secoes(section):
+        for paragraph in section.header.paragraphs:
+            substituir_no_paragrafo(paragraph)
+        for paragraph in section.footer.paragraphs:
+            substituir_no_paragrafo(paragraph)
+    
+    # Processar todos os parágrafos principais
+    for paragraph in doc.paragraphs:
+        substituir_no_paragrafo(paragraph)
+    
+    # Processar tabelas
+    substituir_em_tabelas()
+    
+    # Processar cabeçalhos e rodapés
+    for section in doc.sections:
+        substituir_em_secoes(section)
+    
+    return doc
+
+def abrir_modelo(modelo):
+    """Abre um modelo a partir de caminho (via cache), bytes ou arquivo em memória"""
+    if isinstance(modelo, (bytes, bytearray)):
+        return Document(io.BytesIO(modelo))
+    if hasattr(modelo, 'read'):
+        return Document(modelo)
+    return CACHE_MODELOS.abrir(modelo)
+
+def renderizar_documento(modelo, substituicoes, destino=None, linhas=None):
+    """Renderiza o modelo com as substituições sem gravar em disco.
+
+    `modelo` pode ser um caminho, os bytes de um .docx ou um buffer.
+    Sem `destino`, retorna os bytes do .docx gerado; com `destino` (qualquer
+    objeto com write, ex: resposta HTTP, membro de zip, BytesIO), grava
+    nele e o retorna. `linhas` (substituições por membro do grupo) expande as
+    linhas de tabela marcadas como repetíveis.
+    """
+    doc = aplicar_substituicoes(abrir_modelo(modelo), substituicoes, linhas)
+    if destino is not None:
+        doc.save(destino)
+        return destino
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+def substituir_texto_com_docx(modelo_path, substituicoes, caminho_completo, linhas=None):
+    """Substitui placeholders usando python-docx preservando formatação (erros são propagados)"""
+    # Carregar documento (modelo lido do disco uma única vez)
+    doc = aplicar_substituicoes(abrir_modelo(modelo_path), substituicoes, linhas)
+    
+    # Salvar documento
+    doc.save(caminho_completo)
 
 def validar_dados(df):
     """Realiza validação avançada dos dados antes do processamento"""
@@ -562,22 +879,20 @@ def gerar_nome_arquivo(registro, idx, cabecalhos):
     
     return nome_limpo + ext
 
-def processar_documento_individual(modelo_path, caminho_completo, subs):
-    """Função usando python-docx para substituição"""
-    try:
-        # Verificar se existem placeholders para substituir
-        if not subs:
-            print("⚠ Nenhum placeholder para substituir! Verifique o mapeamento.")
-            return False
+def processar_documento_individual(modelo_path, caminho_completo, subs, linhas=None):
+    """Gera um documento com python-docx; retorna None em caso de sucesso ou o texto do erro.
 
-        # Usar python-docx para substituição
-        sucesso = substituir_texto_com_docx(modelo_path, subs, caminho_completo)
-        return sucesso
-        
+    Nada é escrito no console: quem chama registra o erro no diário e decide
+    se o exibe (a telemetria limita a quantidade de avisos).
+    """
+    # Verificar se existem placeholders para substituir
+    if not subs:
+        return "Nenhum placeholder para substituir! Verifique o mapeamento."
+    try:
+        substituir_texto_com_docx(modelo_path, subs, caminho_completo, linhas)
     except Exception as e:
-        print(f"❌ Erro crítico ao processar documento: {str(e)}")
-        traceback.print_exc()
-        return False
+        return str(e) or type(e).__name__
+    return None
 
 def normalizar_nome(nome):
     """Normaliza nomes removendo acentos, espaços e caracteres especiais"""
@@ -635,384 +950,3794 @@ def encontrar_modelo(nome_modelo, modelos_por_nome, modelos_por_base_sem_ext, mo
     
     return None
 
-def processar_documentos():
-    try:
-        print("\n" + "="*60)
-        print("🚀 INICIANDO PROCESSAMENTO DE DOCUMENTOS")
-        print("="*60)
-        
-        # Verificar configuração mínima
-        if not CONFIG['placeholders']:
-            print("❌ Nenhum placeholder configurado! Execute a configuração primeiro.")
-            input("\nPressione Enter para voltar...")
-            return
-            
-        # Carregar base de dados
+def listar_modelos(caminho_modelos):
+    """Lista os modelos Word (.docx/.doc) da pasta de modelos"""
+    modelos = []
+    for root, _, files in os.walk(caminho_modelos):
+        for file in files:
+            if file.lower().endswith(('.docx', '.doc')):
+                modelos.append(os.path.join(root, file))
+    return modelos
+
+def indexar_modelos(modelos):
+    """Cria os índices de busca (nome, nome sem extensão, nome normalizado)"""
+    modelos_por_nome = {}
+    modelos_por_base_sem_ext = {}
+    modelos_por_nome_normalizado = {}
+
+    for modelo_path in modelos:
+        nome_arquivo = os.path.basename(modelo_path)
+        modelos_por_nome[nome_arquivo] = modelo_path
+
+        # Criar entrada sem extensão
+        base_sem_ext = os.path.splitext(nome_arquivo)[0]
+        modelos_por_base_sem_ext[base_sem_ext] = modelo_path
+
+        # Criar versão normalizada (sem acentos, espaços e caracteres especiais)
+        nome_normalizado = normalizar_nome(nome_arquivo)
+        base_normalizado = normalizar_nome(base_sem_ext)
+        modelos_por_nome_normalizado[nome_normalizado] = modelo_path
+        modelos_por_nome_normalizado[base_normalizado] = modelo_path
+
+    return modelos_por_nome, modelos_por_base_sem_ext, modelos_por_nome_normalizado
+
+def selecionar_modelo(registro, modelos, indice_modelos):
+    """Retorna (caminho do modelo, nome pedido); caminho é None se não encontrado"""
+    if not CONFIG.get('modelo_especifico', {}).get('ativo', False):
+        return modelos[0], os.path.basename(modelos[0])  # Usar primeiro modelo
+
+    coluna_modelo = CONFIG['modelo_especifico']['coluna']
+    nome_modelo = str(registro[coluna_modelo])
+    # Usar sistema inteligente de busca
+    return encontrar_modelo(nome_modelo, *indice_modelos), nome_modelo
+
+def obter_nome_funcionario(registro):
+    """Nome do funcionário usado nos logs (placeholder_log)"""
+    if 'placeholder_log' in CONFIG and CONFIG['placeholder_log'] in CONFIG['placeholders']:
+        coluna_log = CONFIG['placeholders'][CONFIG['placeholder_log']]['coluna']
+        if coluna_log in registro:
+            return str(registro[coluna_log])
+    return "Desconhecido"
+
+def formatar_valor(valor):
+    """Converte um valor da planilha no texto usado na substituição"""
+    # Tratamento para valores ausentes/inválidos
+    if valor is None or pd.isna(valor):
+        return ""
+    # Verificar se é uma data e formatar corretamente
+    if isinstance(valor, (pd.Timestamp, datetime)):
         try:
-            # Obter e limpar caminho
-            caminho_base = limpar_caminho(CONFIG['diretorios']['base_dados'])
-            
-            # Verificar se arquivo existe
-            if not os.path.exists(caminho_base):
-                print(f"❌ Arquivo não encontrado: {caminho_base}")
-                input("\nPressione Enter para voltar...")
-                return
-                
-            # Ler apenas os cabeçalhos para validação
-            df_cabecalhos = pd.read_excel(caminho_base, nrows=0)
-            cabecalhos = list(df_cabecalhos.columns)
-            print(f"✓ Cabeçalhos encontrados na planilha: {', '.join(cabecalhos)}")
-            
-            # Verificar colunas necessárias
-            colunas_faltantes = []
-            for ph, info in CONFIG['placeholders'].items():
-                coluna = info['coluna']
-                if coluna not in cabecalhos:
-                    colunas_faltantes.append(f"'{coluna}' (para placeholder {ph})")
-            
-            if colunas_faltantes:
-                print("❌ Colunas faltando na base de dados:")
-                for col in colunas_faltantes:
-                    print(f"  - {col}")
-                input("\nPressione Enter para voltar...")
-                return
-                
-            # Carregar dados completos se todas colunas existirem
-            df = pd.read_excel(caminho_base)
-            total_registros = len(df)
-            print(f"✓ Base de dados carregada: {total_registros} registros encontrados")
-            
-        except Exception as e:
-            print(f"❌ Erro ao carregar base de dados: {str(e)}")
-            traceback.print_exc()
-            input("\nPressione Enter para voltar...")
-            return
-            
-        # Verificar modelos
-        caminho_modelos = limpar_caminho(CONFIG['diretorios']['modelos'])
-        print(f"🔍 Verificando acesso ao diretório de modelos: {caminho_modelos}")
-        
-        # Verificar permissões
-        if not os.access(caminho_modelos, os.R_OK):
-            print(f"❌ Sem permissão de leitura no diretório: {caminho_modelos}")
-            input("\nPressione Enter para voltar...")
-            return
-            
-        modelos = []
-        print(f"\n🔍 Procurando modelos em: {caminho_modelos}")
-        for root, _, files in os.walk(caminho_modelos):
-            for file in files:
-                if file.lower().endswith(('.docx', '.doc')):
-                    full_path = os.path.join(root, file)
-                    modelos.append(full_path)
-                    print(f"  ✅ Encontrado: {file}")
-        
-        if not modelos:
-            print("❌ Nenhum modelo Word encontrado!")
-            input("\nPressione Enter para voltar...")
-            return
-            
-        print(f"✓ {len(modelos)} modelos encontrados")
-        
-        # Criar estruturas para busca eficiente de modelos
-        modelos_por_nome = {}
-        modelos_por_base_sem_ext = {}
-        modelos_por_nome_normalizado = {}
-        
-        for modelo_path in modelos:
-            nome_arquivo = os.path.basename(modelo_path)
-            modelos_por_nome[nome_arquivo] = modelo_path
-            
-            # Criar entrada sem extensão
-            base_sem_ext = os.path.splitext(nome_arquivo)[0]
-            modelos_por_base_sem_ext[base_sem_ext] = modelo_path
-            
-            # Criar versão normalizada (sem acentos, espaços e caracteres especiais)
-            nome_normalizado = normalizar_nome(nome_arquivo)
-            base_normalizado = normalizar_nome(base_sem_ext)
-            modelos_por_nome_normalizado[nome_normalizado] = modelo_path
-            modelos_por_nome_normalizado[base_normalizado] = modelo_path
-        
-        # Se for caminho de rede, tentar mapear unidade (apenas para Windows)
-        if caminho_modelos.startswith('\\\\'):
-            print("ⓘ Caminho de rede detectado, ativando compatibilidade...")
-            # Tenta mapear a unidade de rede (apenas Windows)
-            try:
-                drive_letter = 'Z:'  # Pode ser necessário escolher uma letra livre
-                os.system(f'net use {drive_letter} {caminho_modelos} /persistent:yes > nul 2>&1')
-                caminho_modelos = drive_letter + '\\'
-                print(f"✓ Caminho de rede mapeado para {drive_letter}")
-            except:
-                print("⚠ Não foi possível mapear o caminho de rede. Continuando...")
-        
-        # Sistema de checkpoint
-        saida_path = limpar_caminho(CONFIG['diretorios']['saida'])
-        checkpoint_file = os.path.join(saida_path, 'checkpoint.json')
-        checkpoint = {}
-        
-        # Carregar checkpoint se existir
-        if os.path.exists(checkpoint_file):
-            try:
-                with open(checkpoint_file, 'r') as f:
-                    checkpoint = json.load(f)
-                print(f"✓ Checkpoint encontrado: Continuando do registro {checkpoint.get('ultimo_registro', 0)}")
-            except:
-                print("⚠ Erro ao carregar checkpoint, iniciando do zero")
-        
-        # Processar cada registro
-        total_processados = 0
-        erros = []  # Lista de dicionários com detalhes de erros
-        categorias = set()
-        modelos_faltantes = {}  # Dicionário para rastrear modelos faltantes
-        
-        print("\n⏳ Gerando documentos...")
-        inicio = time.time()
-        
-        # Mostrar barra de progresso inicial
-        mostrar_barra_progresso(0, total_registros)
-        
-        # Índice inicial
-        start_idx = checkpoint.get('ultimo_registro', 0)
-        
-        for idx, (index, registro) in enumerate(df.iterrows(), 1):
-            # Pular registros já processados
-            if idx <= start_idx:
-                mostrar_barra_progresso(idx, total_registros)
-                continue
-            
-            try:
-                # Obter nome do funcionário para logs
-                nome_funcionario = "Desconhecido"
-                if 'placeholder_log' in CONFIG and CONFIG['placeholder_log'] in CONFIG['placeholders']:
-                    coluna_log = CONFIG['placeholders'][CONFIG['placeholder_log']]['coluna']
-                    if coluna_log in registro:
-                        nome_funcionario = str(registro[coluna_log])
-                
-                # CORREÇÃO: Tratamento robusto para valores nulos/vazios
-                subs = {}
-                for ph, info in CONFIG['placeholders'].items():
-                    coluna = info['coluna']
-                    valor = registro[coluna]
-                    
-                    # Tratamento para valores ausentes/inválidos
-                    if pd.isna(valor) or valor is None:
-                        valor_formatado = ""  # Valor vazio para campos ausentes
-                    else:
-                        # Verificar se é uma data e formatar corretamente
-                        if isinstance(valor, (pd.Timestamp, datetime)):
-                            try:
-                                valor_formatado = valor.strftime('%d/%m/%Y')
-                            except (ValueError, AttributeError):
-                                valor_formatado = ""  # Fallback para datas inválidas
-                        else:
-                            valor_formatado = str(valor)
-                    
-                    subs[ph] = valor_formatado
-                
-                # Selecionar modelo apropriado
-                modelo_path = None
-                if CONFIG.get('modelo_especifico', {}).get('ativo', False):
-                    coluna_modelo = CONFIG['modelo_especifico']['coluna']
-                    nome_modelo = str(registro[coluna_modelo])
-                    
-                    # Usar sistema inteligente de busca
-                    modelo_path = encontrar_modelo(
-                        nome_modelo, 
-                        modelos_por_nome, 
-                        modelos_por_base_sem_ext,
-                        modelos_por_nome_normalizado
-                    )
-                    
-                    if not modelo_path:
-                        # Registrar modelo faltante com contagem
-                        if nome_modelo in modelos_faltantes:
-                            modelos_faltantes[nome_modelo]['contagem'] += 1
-                        else:
-                            modelos_faltantes[nome_modelo] = {
-                                'contagem': 1,
-                                'funcionarios': set()
-                            }
-                        modelos_faltantes[nome_modelo]['funcionarios'].add(nome_funcionario)
-                        
-                        erros.append({
-                            'indice': idx,
-                            'nome': nome_funcionario,
-                            'erro': f"Modelo '{nome_modelo}' não encontrado",
-                            'modelo': nome_modelo
-                        })
-                        print(f"\n❌ Modelo não encontrado: '{nome_modelo}' para {nome_funcionario}")
-                        continue
-                else:
-                    modelo_path = modelos[0]  # Usar primeiro modelo
-                
-                # Organizar por categoria se necessário
-                saida_path_atual = saida_path
-                if CONFIG['organizacao'].get('ativo', False):
-                    categoria = str(registro[CONFIG['organizacao']['coluna']])
-                    
-                    if CONFIG['organizacao'].get('limpar_caracteres', False):
-                        categoria = limpar_nome_arquivo(categoria)
-                    
-                    categoria_path = os.path.join(saida_path_atual, categoria)
-                    
-                    if categoria not in categorias:
-                        try:
-                            os.makedirs(categoria_path, exist_ok=True)
-                            categorias.add(categoria)
-                        except Exception as e:
-                            print(f"⚠ Erro ao criar pasta {categoria}: {str(e)}")
-                            # Usar diretório principal em caso de erro
-                            continue
-                    
-                    saida_path_atual = categoria_path
-                
-                # Gerar nome de arquivo personalizado usando dados da planilha
-                nome_arquivo = gerar_nome_arquivo(registro, idx, cabecalhos)
-                caminho_completo = os.path.join(saida_path_atual, nome_arquivo)
-                
-                # Processar documento individual
-                sucesso = processar_documento_individual(modelo_path, caminho_completo, subs)
-                
-                if sucesso:
-                    total_processados += 1
-                    print(f"\n✓ Documento gerado para {nome_funcionario}: {nome_arquivo}")
-                
-                    # Salvar checkpoint após cada documento processado com sucesso
-                    checkpoint = {'ultimo_registro': idx}
-                    try:
-                        with open(checkpoint_file, 'w') as f:
-                            json.dump(checkpoint, f)
-                    except Exception as e:
-                        print(f"⚠ Erro ao salvar checkpoint: {str(e)}")
-                else:
-                    erros.append({
-                        'indice': idx,
-                        'nome': nome_funcionario,
-                        'erro': "Falha ao gerar documento",
-                        'modelo': modelo_path
-                    })
-                    print(f"\n❌ Falha ao gerar documento para {nome_funcionario}")
-                
-            except Exception as e:
-                # Registrar erro com detalhes
-                nome_funcionario = "Desconhecido"
-                if 'placeholder_log' in CONFIG and CONFIG['placeholder_log'] in CONFIG['placeholders']:
-                    coluna_log = CONFIG['placeholders'][CONFIG['placeholder_log']]['coluna']
-                    if coluna_log in registro:
-                        nome_funcionario = str(registro[coluna_log])
-                
-                erros.append({
-                    'indice': idx,
-                    'nome': nome_funcionario,
-                    'erro': str(e),
-                    'modelo': modelo_path if 'modelo_path' in locals() else "Não definido"
-                })
-                print(f"\n❌ Erro no registro {idx} ({nome_funcionario}): {str(e)}")
-                traceback.print_exc()
-                
-                # Pausa para evitar sobrecarga
-                time.sleep(2)
-            
-            # Atualizar barra de progresso
-            mostrar_barra_progresso(idx, total_registros)
-        
-        # Remover checkpoint após conclusão
-        if os.path.exists(checkpoint_file):
-            try:
-                os.remove(checkpoint_file)
-            except:
-                pass
-        
-        tempo_total = time.time() - inicio
-        print(f"\n\n✅ Processamento concluído em {tempo_total:.1f} segundos")
-        
-        # Relatório final
-        print("\n" + "="*50)
-        print(f"📊 RESUMO DO PROCESSAMENTO")
-        print("="*50)
-        print(f"• Documentos gerados: {total_processados}/{total_registros}")
-        print(f"• Erros encontrados: {len(erros)}")
-        if tempo_total > 0:
-            print(f"• Velocidade: {total_processados/tempo_total:.1f} docs/segundo")
-        
-        # Salvar relatório detalhado
-        log_path = os.path.join(saida_path, "relatorio_geracao.txt")
+            return valor.strftime('%d/%m/%Y')
+        except (ValueError, AttributeError):
+            return ""  # Fallback para datas inválidas
+    return str(valor)
+
+def montar_substituicoes(registro):
+    """Monta o dicionário placeholder -> texto para um registro"""
+    return {ph: formatar_valor(registro[info['coluna']]) for ph, info in CONFIG['placeholders'].items()}
+
+def dentro_da_pasta(caminho, pasta):
+    """True se o caminho (já resolvido) fica dentro da pasta"""
+    pasta = os.path.realpath(pasta)
+    return os.path.commonpath([pasta, os.path.realpath(caminho)]) == pasta
+
+def resolver_pasta_saida(registro, saida_path, categorias, restrito=False):
+    """Pasta de saída do registro (subpasta da organização, criada sob demanda).
+
+    Com categorias=None o caminho é apenas calculado, sem criar a pasta (simulação).
+    Com restrito=True (dados vindos de clientes do servidor) a categoria é sempre
+    limpa e uma pasta fora de saida_path gera ValueError.
+    """
+    if not CONFIG['organizacao'].get('ativo', False):
+        return saida_path
+
+    categoria = str(registro[CONFIG['organizacao']['coluna']])
+    if restrito or CONFIG['organizacao'].get('limpar_caracteres', False):
+        categoria = limpar_nome_arquivo(categoria)
+
+    categoria_path = os.path.join(saida_path, categoria)
+    if restrito and (categoria in ('', '.', '..') or not dentro_da_pasta(categoria_path, saida_path)):
+        raise ValueError(f"Categoria inválida para a pasta de saída: {categoria!r}")
+    if categorias is not None and categoria not in categorias:
         try:
-            with open(log_path, 'w', encoding='utf-8') as f:
-                f.write("RELATÓRIO DE GERAÇÃO DE DOCUMENTOS\n")
-                f.write("="*50 + "\n\n")
-                f.write(f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
-                f.write(f"Total de registros: {total_registros}\n")
-                f.write(f"Documentos gerados: {total_processados}\n")
-                f.write(f"Documentos com erro: {len(erros)}\n")
-                f.write(f"Tempo total: {tempo_total:.1f} segundos\n")
-                if tempo_total > 0:
-                    f.write(f"Velocidade média: {total_processados/tempo_total:.1f} docs/segundo\n\n")
-                
-                f.write("CONFIGURAÇÃO UTILIZADA:\n")
-                f.write(f"• Pasta de modelos: {CONFIG['diretorios']['modelos']}\n")
-                f.write(f"• Arquivo de dados: {CONFIG['diretorios']['base_dados']}\n")
-                f.write(f"• Pasta de saída: {CONFIG['diretorios']['saida']}\n")
-                f.write(f"• Padrão de nome: {CONFIG['config_geral']['padrao_nome_arquivo']}\n\n")
-                
-                f.write("PLACEHOLDERS UTILIZADOS:\n")
-                for ph, info in CONFIG['placeholders'].items():
-                    f.write(f"- {ph}: {info['descricao']} ({info['coluna']})\n")
-                
-                if erros:
-                    f.write("\n\nERROS DETALHADOS:\n")
-                    f.write("="*50 + "\n")
-                    for erro in erros:
-                        f.write(f"\n• REGISTRO #{erro['indice']}\n")
-                        f.write(f"  Nome: {erro['nome']}\n")
-                        f.write(f"  Modelo: {erro.get('modelo', 'Não especificado')}\n")
-                        f.write(f"  Erro: {erro['erro']}\n")
-                        f.write("-"*50 + "\n")
-                else:
-                    f.write("\n\nNENHUM ERRO ENCONTRADO DURANTE O PROCESSAMENTO\n")
-                
-                # Seção detalhada de modelos faltantes
-                if modelos_faltantes:
-                    f.write("\n\n🔍 MODELOS FALTANTES DETECTADOS:\n")
-                    f.write("="*50 + "\n")
-                    f.write(f"Total de modelos faltantes: {len(modelos_faltantes)}\n")
-                    f.write(f"Total de ocorrências: {sum(info['contagem'] for info in modelos_faltantes.values())}\n\n")
-                    
-                    for modelo, info in modelos_faltantes.items():
-                        f.write(f"\n• MODELO: {modelo}\n")
-                        f.write(f"  Ocorrências: {info['contagem']}\n")
-                        f.write(f"  Funcionários afetados ({min(5, len(info['funcionarios']))} de {len(info['funcionarios'])}):\n")
-                        
-                        # Listar até 5 funcionários afetados
-                        for i, func in enumerate(list(info['funcionarios'])[:5]):
-                            f.write(f"    - {func}\n")
-                        
-                        if len(info['funcionarios']) > 5:
-                            f.write(f"    ... e mais {len(info['funcionarios']) - 5}\n")
-                        
-                        f.write("-"*50 + "\n")
-                    
-                    f.write("\nMODELOS DISPONÍVEIS NA PASTA:\n")
-                    f.write("="*50 + "\n")
-                    for modelo in modelos_por_nome.keys():
-                        f.write(f"- {modelo}\n")
-            
-            print(f"\n📝 Relatório completo salvo em: {log_path}")
+            os.makedirs(categoria_path, exist_ok=True)
+            categorias.add(categoria)
         except Exception as e:
-            print(f"⚠ Não foi possível salvar relatório: {str(e)}")
-            
-    except Exception as e:
-        print(f"\n❌ ERRO GRAVE: {str(e)}")
-        traceback.print_exc()
-    finally:
-        input("\nPressione Enter para voltar ao menu...")
+            print(f"⚠ Erro ao criar pasta {categoria}: {str(e)}")
+            return None
+    return categoria_path
 
 # ===============================
-# MENU PRINCIPAL
+# PRÉ E PÓS-PROCESSAMENTO
 # ===============================
+# CONFIG['pre_pos_processamento'] = {
+#     "pre": [{"tipo": "maiusculas", "colunas": ["Nome"]},
+#             {"tipo": "mascara_cpf", "colunas": ["CPF"]},
+#             {"tipo": "formato_data", "colunas": ["Admissao"], "formato": "%d/%m/%Y"},
+#             {"tipo": "busca", "coluna": "Cod Depto", "aba": "Departamentos",
+#              "chave": "Codigo", "valor": "Nome", "destino": "Departamento"}],
+#     "pos": [{"tipo": "copiar", "destino": "C:\\Backup"},
+#             {"tipo": "comando", "comando": ["assinar.exe", "{arquivo}"]}]
+# }
+# As etapas "pre" operam sobre colunas inteiras (vetorizadas) já carregadas;
+# as etapas "pos" rodam para cada documento gerado com sucesso.
 
-def menu_principal():
-    try:
+def como_texto(serie):
+    """Converte uma coluna para texto sem o '.0' de números lidos como float"""
+    if pd.api.types.is_float_dtype(serie):
+        inteiros = serie.dropna()
+        if (inteiros == inteiros.round()).all():
+            return serie.astype('Int64').astype('string')
+    return serie.astype('string')
+
+def mascarar_digitos(serie, mascaras):
+    """Aplica máscaras por quantidade de dígitos; valores fora do padrão ficam como estão"""
+    texto = como_texto(serie)
+    digitos = texto.str.replace(r'\D', '', regex=True)
+    resultado = texto.copy()
+    for tamanho, (padrao, formato) in mascaras.items():
+        selecionados = (digitos.str.len() == tamanho).fillna(False)
+        resultado[selecionados] = digitos[selecionados].str.replace(padrao, formato, regex=True)
+    return resultado
+
+def converter_datas(serie, formato_entrada=None):
+    """Converte texto em datas (ISO aaaa-mm-dd ou dd/mm/aaaa); inválidas viram NaT"""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    if formato_entrada is None:
+        # ISO não pode ser lido com dayfirst (2024-01-04 viraria 1º de abril)
+        # Só valores que começam com dígito (textos como "a definir" não decidem o formato)
+        amostra = serie.dropna().astype(str)
+        amostra = amostra[amostra.str.match(r'^\s*\d')].head(20)
+        dia_primeiro = not amostra.str.match(r'^\s*\d{4}-\d{2}-\d{2}').all() if len(amostra) else True
+    else:
+        dia_primeiro = False
+    with warnings.catch_warnings():
+        # Colunas com formatos mistos geram avisos a cada leitura
+        warnings.simplefilter('ignore')
+        return pd.to_datetime(serie, errors='coerce', dayfirst=dia_primeiro, format=formato_entrada)
+
+def etapa_maiusculas(df, etapa, contexto):
+    for coluna in etapa['colunas']:
+        df[coluna] = como_texto(df[coluna]).str.upper()
+    return df
+
+def etapa_minusculas(df, etapa, contexto):
+    for coluna in etapa['colunas']:
+        df[coluna] = como_texto(df[coluna]).str.lower()
+    return df
+
+def etapa_aparar(df, etapa, contexto):
+    for coluna in etapa['colunas']:
+        df[coluna] = como_texto(df[coluna]).str.strip().str.replace(r'\s+', ' ', regex=True)
+    return df
+
+def etapa_mascara_cpf(df, etapa, contexto):
+    for coluna in etapa['colunas']:
+        texto = como_texto(df[coluna])
+        # CPF lido como número perde zeros à esquerda
+        digitos = texto.str.replace(r'\D', '', regex=True)
+        completos = digitos.str.len().between(1, 11).fillna(False)
+        texto[completos] = digitos[completos].str.zfill(11)
+        df[coluna] = mascarar_digitos(texto, {11: (r'^(\d{3})(\d{3})(\d{3})(\d{2})$', r'\1.\2.\3-\4')})
+    return df
+
+def etapa_mascara_telefone(df, etapa, contexto):
+    mascaras = {
+        11: (r'^(\d{2})(\d{5})(\d{4})$', r'(\1) \2-\3'),
+        10: (r'^(\d{2})(\d{4})(\d{4})$', r'(\1) \2-\3'),
+    }
+    for coluna in etapa['colunas']:
+        df[coluna] = mascarar_digitos(df[coluna], mascaras)
+    return df
+
+def etapa_formato_data(df, etapa, contexto):
+    formato = etapa.get('formato', '%d/%m/%Y')
+    for coluna in etapa['colunas']:
+        datas = converter_datas(df[coluna], etapa.get('formato_entrada'))
+        formatadas = datas.dt.strftime(formato)
+        # Valores que não são datas permanecem como estão
+        df[coluna] = formatadas.where(datas.notna(), df[coluna])
+    return df
+
+def fonte_busca(etapa, caminho_base):
+    """Fonte da tabela de busca: "arquivo" da etapa ou outra aba/tabela da própria base"""
+    arquivo = limpar_caminho(etapa.get('arquivo'))
+    if arquivo:
+        opcoes = {}
+    else:
+        arquivo = caminho_base
+        opcoes = {chave: valor for chave, valor in CONFIG.get('fonte_dados', {}).items()
+                  if chave not in ('aba', 'tabela', 'consulta')}
+    opcoes.update({chave: etapa[chave] for chave in ('formato', 'separador', 'encoding', 'tabela', 'consulta')
+                   if chave in etapa})
+    fonte = abrir_fonte_dados(arquivo, opcoes)
+    if isinstance(fonte, FonteExcel):
+        fonte.opcoes['aba'] = etapa.get('aba', 0)
+    elif isinstance(fonte, FonteSQLite):
+        if not fonte.opcoes.get('tabela') and not fonte.opcoes.get('consulta'):
+            fonte.opcoes['tabela'] = etapa.get('aba')
+    elif not etapa.get('arquivo'):
+        # CSV e Parquet têm uma única tabela: a busca precisa de outro arquivo
+        raise ValueError("Etapa 'busca': informe \"arquivo\" (bases CSV e Parquet não têm outras abas)")
+    return fonte
+
+def etapa_busca(df, etapa, contexto):
+    """Preenche uma coluna buscando valores em outra aba (ou arquivo) pela chave"""
+    fonte = fonte_busca(etapa, contexto['caminho_base'])
+    chave_cache = (fonte.caminho, repr(sorted(fonte.opcoes.items())), etapa['chave'], etapa['valor'])
+    tabela = contexto['buscas'].get(chave_cache)
+    if tabela is None:
+        # Cada tabela de busca é lida uma única vez, apenas com as colunas usadas
+        colunas = list(dict.fromkeys([etapa['chave'], etapa['valor']]))
+        blocos = list(fonte.ler_blocos(colunas))
+        aba = pd.concat(blocos, ignore_index=True) if blocos else pd.DataFrame(columns=colunas)
+        aba = aba.drop_duplicates(subset=etapa['chave'])
+        tabela = pd.Series(aba[etapa['valor']].values, index=como_texto(aba[etapa['chave']]))
+        contexto['buscas'][chave_cache] = tabela
+    encontrados = como_texto(df[etapa['coluna']]).map(tabela)
+    df[etapa.get('destino', etapa['coluna'])] = encontrados.fillna(etapa.get('padrao', ''))
+    return df
+
+ETAPAS_PRE = {
+    'maiusculas': etapa_maiusculas,
+    'minusculas': etapa_minusculas,
+    'aparar': etapa_aparar,
+    'mascara_cpf': etapa_mascara_cpf,
+    'mascara_telefone': etapa_mascara_telefone,
+    'formato_data': etapa_formato_data,
+    'busca': etapa_busca,
+}
+
+def etapa_pos_copiar(caminho, registro, etapa):
+    destino = limpar_caminho(etapa['destino'])
+    os.makedirs(destino, exist_ok=True)
+    shutil.copy2(caminho, destino)
+
+def etapa_pos_comando(caminho, registro, etapa):
+    # Lista de argumentos (sem shell); {arquivo} é trocado pelo documento gerado
+    comando = [str(parte).replace('{arquivo}', caminho) for parte in etapa['comando']]
+    subprocess.run(comando, check=True, timeout=etapa.get('tempo_limite', 120),
+                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+ETAPAS_POS = {
+    'copiar': etapa_pos_copiar,
+    'comando': etapa_pos_comando,
+}
+
+def criar_contexto_etapas(caminho_base=None):
+    """Estado compartilhado entre etapas (tabelas de busca já lidas)"""
+    return {'caminho_base': caminho_base, 'buscas': {}}
+
+def colunas_criadas_pre_processamento():
+    """Colunas que passam a existir após as etapas de pré-processamento"""
+    return {etapa['destino'] for etapa in CONFIG.get('pre_pos_processamento', {}).get('pre', [])
+            if etapa.get('tipo') == 'busca' and etapa.get('destino')}
+
+def verificar_etapas_pre(cabecalhos, caminho_base=None):
+    """Lista problemas das etapas "pre" (tipo desconhecido, colunas inexistentes, busca sem arquivo)"""
+    problemas = []
+    disponiveis = set(cabecalhos)
+    for etapa in CONFIG.get('pre_pos_processamento', {}).get('pre', []):
+        if etapa.get('tipo') not in ETAPAS_PRE:
+            problemas.append(f"Etapa de pré-processamento desconhecida: '{etapa.get('tipo')}'")
+            continue
+        colunas = list(etapa.get('colunas', [])) + ([etapa['coluna']] if 'coluna' in etapa else [])
+        faltantes = [col for col in colunas if col not in disponiveis]
+        if faltantes:
+            problemas.append(f"Etapa '{etapa['tipo']}': colunas não encontradas: {', '.join(faltantes)}")
+        if etapa.get('tipo') == 'busca' and (etapa.get('arquivo') or caminho_base):
+            try:
+                fonte_busca(etapa, caminho_base)
+            except ValueError as e:
+                problemas.append(str(e))
+            if etapa.get('destino'):
+                disponiveis.add(etapa['destino'])
+    return problemas
+
+def aplicar_pre_processamento(df, contexto):
+    """Executa as etapas "pre" configuradas sobre as colunas do DataFrame"""
+    for etapa in CONFIG.get('pre_pos_processamento', {}).get('pre', []):
+        funcao = ETAPAS_PRE.get(etapa.get('tipo'))
+        if funcao is None:
+            raise ValueError(f"Etapa de pré-processamento desconhecida: '{etapa.get('tipo')}'")
+        colunas = list(etapa.get('colunas', [])) + ([etapa['coluna']] if 'coluna' in etapa else [])
+        faltantes = [col for col in colunas if col not in df.columns]
+        if faltantes:
+            raise ValueError(f"Etapa '{etapa['tipo']}': colunas não encontradas: {', '.join(faltantes)}")
+        df = funcao(df, etapa, contexto)
+    return df
+
+def aplicar_pos_processamento(caminho, registro):
+    """Executa as etapas "pos" para um documento gerado; retorna a lista de falhas"""
+    falhas = []
+    for etapa in CONFIG.get('pre_pos_processamento', {}).get('pos', []):
+        funcao = ETAPAS_POS.get(etapa.get('tipo'))
+        try:
+            if funcao is None:
+                raise ValueError(f"Etapa de pós-processamento desconhecida: '{etapa.get('tipo')}'")
+            funcao(caminho, registro, etapa)
+        except Exception as e:
+            falhas.append(f"{etapa.get('tipo')}: {str(e)}")
+    return falhas
+
+# ===============================
+# FONTES DE DADOS (EXCEL, CSV, PARQUET, SQLITE)
+# ===============================
+# CONFIG['fonte_dados'] (opcional):
+#   formato: "auto" | "excel" | "csv" | "parquet" | "sqlite"
+#   tamanho_bloco: registros lidos por vez (padrão 5000)
+#   colunas_data: colunas de texto convertidas em data (CSV/SQLite guardam texto)
+#   csv: "separador" (detectado se ausente), "encoding"
+#   excel: "aba"; sqlite: "tabela" ou "consulta"
+
+EXTENSOES_FONTE = {
+    '.xlsx': 'excel', '.xlsm': 'excel', '.xls': 'excel',
+    '.csv': 'csv', '.txt': 'csv',
+    '.parquet': 'parquet', '.pq': 'parquet',
+    '.db': 'sqlite', '.sqlite': 'sqlite', '.sqlite3': 'sqlite',
+}
+
+class FonteDados(ABC):
+    """Leitura de uma base de dados em blocos, apenas com as colunas pedidas"""
+    def __init__(self, caminho, opcoes=None):
+        self.caminho = caminho
+        self.opcoes = opcoes or {}
+        self.tamanho_bloco = int(self.opcoes.get('tamanho_bloco', 5000))
+
+    def preparar(self, colunas):
+        """Informa as colunas que serão lidas (antes de contar_registros/ler_blocos)"""
+        self.colunas = colunas
+
+    @abstractmethod
+    def cabecalhos(self):
+        """Nomes das colunas, na ordem da base"""
+
+    @abstractmethod
+    def contar_registros(self):
+        """Número de registros da base"""
+
+    @abstractmethod
+    def ler_blocos(self, colunas=None):
+        """Gera DataFrames de até tamanho_bloco linhas"""
+
+class FonteExcel(FonteDados):
+    def cabecalhos(self):
+        return list(pd.read_excel(self.caminho, sheet_name=self.opcoes.get('aba', 0), nrows=0).columns)
+
+    def _carregar(self, colunas):
+        # O leitor de Excel não lê por partes: carga única, só com as colunas usadas
+        chave = tuple(colunas) if colunas else None
+        if getattr(self, '_cache', (None, None))[0] != chave:
+            df = pd.read_excel(self.caminho, sheet_name=self.opcoes.get('aba', 0), usecols=colunas)
+            self._cache = (chave, df)
+        return self._cache[1]
+
+    def contar_registros(self):
+        return len(self._carregar(getattr(self, 'colunas', None)))
+
+    def ler_blocos(self, colunas=None):
+        df = self._carregar(colunas)
+        self._cache = (None, None)  # Liberar após a leitura
+        for inicio in range(0, len(df), self.tamanho_bloco):
+            yield df.iloc[inicio:inicio + self.tamanho_bloco]
+
+class FonteCSV(FonteDados):
+    def _encoding(self):
+        return self.opcoes.get('encoding', 'utf-8-sig')
+
+    def _separador(self):
+        if self.opcoes.get('separador'):
+            return self.opcoes['separador']
+        with open(self.caminho, 'r', encoding=self._encoding(), newline='') as f:
+            amostra = f.read(64 * 1024)
+        try:
+            return csv.Sniffer().sniff(amostra, delimiters=';,\t|').delimiter
+        except csv.Error:
+            return ';' if amostra.count(';') > amostra.count(',') else ','
+
+    def cabecalhos(self):
+        return list(pd.read_csv(self.caminho, sep=self._separador(), encoding=self._encoding(), nrows=0).columns)
+
+    def contar_registros(self):
+        # Quebras de linha contadas em bytes, por blocos; as que ficam entre aspas
+        # (campos com várias linhas) não contam
+        linhas = 0
+        entre_aspas = False
+        ultimo = b'\n'
+        with open(self.caminho, 'rb') as f:
+            for parte in iter(functools.partial(f.read, 1024 * 1024), b''):
+                if b'"' in parte:
+                    trechos = parte.split(b'"')
+                    linhas += sum(trecho.count(b'\n') for trecho in trechos[entre_aspas::2])
+                    entre_aspas = entre_aspas != (len(trechos) % 2 == 0)
+                else:
+                    linhas += 0 if entre_aspas else parte.count(b'\n')
+                ultimo = parte[-1:]
+        if ultimo != b'\n':
+            linhas += 1  # Última linha sem quebra
+        return max(linhas - 1, 0)
+
+    def ler_blocos(self, colunas=None):
+        # Tudo como texto: o tipo inferido mudaria de um bloco para outro
+        # ("123" num bloco, "123.0" no seguinte se aparecer um decimal)
+        leitor = pd.read_csv(
+            self.caminho,
+            sep=self._separador(),
+            encoding=self._encoding(),
+            usecols=colunas,
+            dtype=str,
+            chunksize=self.tamanho_bloco,
+        )
+        with leitor:
+            for bloco in leitor:
+                yield bloco
+
+class FonteParquet(FonteDados):
+    def _arquivo(self):
+        """(motor, arquivo) pelo pyarrow ou, na falta dele, pelo fastparquet"""
+        try:
+            import pyarrow.parquet as pq
+            return 'pyarrow', pq.ParquetFile(self.caminho)
+        except ImportError:
+            pass
+        try:
+            import fastparquet
+        except ImportError:
+            raise ImportError("Leitura de Parquet requer pyarrow ou fastparquet (pip install pyarrow)")
+        return 'fastparquet', fastparquet.ParquetFile(self.caminho)
+
+    def cabecalhos(self):
+        # Apenas os metadados do arquivo, sem ler os dados
+        motor, arquivo = self._arquivo()
+        if motor == 'pyarrow':
+            return list(arquivo.schema_arrow.names)
+        return list(arquivo.columns)
+
+    def contar_registros(self):
+        motor, arquivo = self._arquivo()
+        if motor == 'pyarrow':
+            return arquivo.metadata.num_rows
+        return arquivo.count()
+
+    def ler_blocos(self, colunas=None):
+        motor, arquivo = self._arquivo()
+        if motor == 'pyarrow':
+            for lote in arquivo.iter_batches(batch_size=self.tamanho_bloco, columns=colunas):
+                yield lote.to_pandas()
+            return
+        # fastparquet lê por grupo de linhas (row group)
+        for grupo in arquivo.iter_row_groups(columns=colunas):
+            for inicio in range(0, len(grupo), self.tamanho_bloco):
+                yield grupo.iloc[inicio:inicio + self.tamanho_bloco]
+
+class FonteSQLite(FonteDados):
+    @staticmethod
+    def _citar(nome):
+        return '"' + str(nome).replace('"', '""') + '"'
+
+    def _conectar(self):
+        return sqlite3.connect(f"file:{self.caminho}?mode=ro", uri=True)
+
+    def _consulta(self):
+        if self.opcoes.get('consulta'):
+            return self.opcoes['consulta']
+        tabela = self.opcoes.get('tabela')
+        if not tabela:
+            with self._conectar() as conexao:
+                tabelas = [linha[0] for linha in conexao.execute(
+                    "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")]
+            if len(tabelas) != 1:
+                raise ValueError(f"Informe 'tabela' ou 'consulta' em fonte_dados (tabelas: {', '.join(tabelas)})")
+            tabela = tabelas[0]
+        return f"SELECT * FROM {self._citar(tabela)}"
+
+    def cabecalhos(self):
+        with self._conectar() as conexao:
+            cursor = conexao.execute(f"SELECT * FROM ({self._consulta()}) LIMIT 0")
+            return [descricao[0] for descricao in cursor.description]
+
+    def contar_registros(self):
+        with self._conectar() as conexao:
+            return conexao.execute(f"SELECT COUNT(*) FROM ({self._consulta()})").fetchone()[0]
+
+    def ler_blocos(self, colunas=None):
+        selecao = ', '.join(self._citar(c) for c in colunas) if colunas else '*'
+        conexao = self._conectar()
+        try:
+            for bloco in pd.read_sql_query(f"SELECT {selecao} FROM ({self._consulta()})",
+                                           conexao, chunksize=self.tamanho_bloco):
+                yield bloco
+        finally:
+            conexao.close()
+
+class FonteMapeada(FonteDados):
+    """Expõe as colunas de outra fonte com os nomes canônicos (mapeamento_colunas.json)"""
+    def __init__(self, fonte, mapeamento):
+        super().__init__(fonte.caminho, fonte.opcoes)
+        self.fonte = fonte
+        # mapeamento: nome canônico -> nome da coluna na planilha
+        self.para_original = {canonico: original for canonico, original in mapeamento.items() if original}
+        self.para_canonico = {original: canonico for canonico, original in self.para_original.items()}
+
+    def _originais(self, colunas):
+        return [self.para_original.get(c, c) for c in colunas] if colunas else colunas
+
+    def preparar(self, colunas):
+        self.colunas = colunas
+        self.fonte.preparar(self._originais(colunas))
+
+    def cabecalhos(self):
+        return [self.para_canonico.get(c, c) for c in self.fonte.cabecalhos()]
+
+    def contar_registros(self):
+        return self.fonte.contar_registros()
+
+    def ler_blocos(self, colunas=None):
+        for bloco in self.fonte.ler_blocos(self._originais(colunas)):
+            yield bloco.rename(columns=self.para_canonico)
+
+FONTES_DADOS = {
+    'excel': FonteExcel,
+    'csv': FonteCSV,
+    'parquet': FonteParquet,
+    'sqlite': FonteSQLite,
+}
+
+def abrir_fonte_dados(caminho, opcoes=None, mapeamento=None):
+    """Escolhe o leitor pelo formato configurado ou pela extensão do arquivo"""
+    opcoes = dict(CONFIG.get('fonte_dados', {}) if opcoes is None else opcoes)
+    formato = opcoes.get('formato', 'auto')
+    if formato == 'auto':
+        formato = EXTENSOES_FONTE.get(os.path.splitext(caminho)[1].lower(), 'excel')
+    if formato not in FONTES_DADOS:
+        raise ValueError(f"Formato de base de dados não suportado: '{formato}'")
+    fonte = FONTES_DADOS[formato](caminho, opcoes)
+    if mapeamento:
+        fonte = FonteMapeada(fonte, mapeamento)
+    return fonte
+
+def colunas_utilizadas(cabecalhos, coluna_fragmento=None):
+    """Colunas da base realmente usadas (placeholders, nomes, pastas, modelos, etapas)"""
+    colunas = {info['coluna'] for info in CONFIG['placeholders'].values()}
+    if CONFIG['organizacao'].get('ativo', False):
+        colunas.add(CONFIG['organizacao']['coluna'])
+    if CONFIG.get('modelo_especifico', {}).get('ativo', False):
+        colunas.add(CONFIG['modelo_especifico']['coluna'])
+    if coluna_fragmento:
+        colunas.add(coluna_fragmento)
+    agrupamento = CONFIG.get('agrupamento', {})
+    if agrupamento.get('ativo', False):
+        colunas.update(c for c in (agrupamento.get('coluna'), agrupamento.get('coluna_tipo')) if c)
+    padrao = CONFIG['config_geral'].get('padrao_nome_arquivo', '')
+    colunas.update(c for c in cabecalhos if f'[{c}]' in padrao)
+    for etapa in CONFIG.get('pre_pos_processamento', {}).get('pre', []):
+        colunas.update(etapa.get('colunas', []))
+        if 'coluna' in etapa:
+            colunas.add(etapa['coluna'])
+    # Manter a ordem original da planilha
+    return [c for c in cabecalhos if c in colunas]
+
+def formatar_coluna(serie):
+    """Versão vetorizada de formatar_valor para uma coluna inteira"""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.dt.strftime('%d/%m/%Y').where(serie.notna(), '').astype(object)
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.astype(object).where(serie.notna(), '').map(str)
+    return serie.map(formatar_valor)
+
+def iterar_blocos(fonte, colunas, total_fonte, fragmento=None, modo_fragmento='hash',
+                  coluna_fragmento=None, contexto_etapas=None):
+    """Gera (índices globais, bloco, substituições formatadas por placeholder) lendo a fonte bloco a bloco"""
+    inicio = 0
+    etapas_pre = CONFIG.get('pre_pos_processamento', {}).get('pre')
+    for bloco in fonte.ler_blocos(colunas):
+        tamanho = len(bloco)
+        indices = range(inicio + 1, inicio + tamanho + 1)
+        if fragmento:
+            mascara = mascara_fragmento(bloco, fragmento, modo_fragmento, coluna_fragmento,
+                                        inicio=inicio, total=total_fonte)
+            indices = [i for i, incluir in zip(indices, mascara) if incluir]
+            bloco = bloco[mascara.values]
+        inicio += tamanho
+
+        if bloco.empty:
+            continue
+        colunas_data = [c for c in fonte.opcoes.get('colunas_data', []) if c in bloco.columns]
+        if colunas_data:
+            bloco = bloco.copy()
+            for coluna in colunas_data:
+                bloco[coluna] = converter_datas(bloco[coluna])
+        if etapas_pre:
+            bloco = aplicar_pre_processamento(bloco.copy(), contexto_etapas)
+
+        # Substituições formatadas coluna a coluna, não registro a registro
+        formatados = {ph: formatar_coluna(bloco[info['coluna']]).tolist()
+                      for ph, info in CONFIG['placeholders'].items()}
+        yield list(indices), bloco, formatados
+
+def iterar_registros(fonte, colunas, total_fonte, fragmento=None, modo_fragmento='hash',
+                     coluna_fragmento=None, contexto_etapas=None):
+    """Gera (índice global, registro, substituições) lendo a fonte bloco a bloco"""
+    for indices, bloco, formatados in iterar_blocos(fonte, colunas, total_fonte, fragmento, modo_fragmento,
+                                                     coluna_fragmento, contexto_etapas):
+        yield from registros_do_bloco(indices, bloco, formatados)
+
+# ===============================
+# AGRUPAMENTO (TITULAR E DEPENDENTES)
+# ===============================
+# CONFIG['agrupamento'] = {"ativo": true, "coluna": "CPF TITULAR",
+#                          "coluna_tipo": "TIT/DEP", "valor_titular": "T",
+#                          "marcador": "[REPETIR]", "incluir_titular": false}
+# Um documento por grupo (valor de "coluna"). Os dados do documento vêm do
+# titular (linha cujo "coluna_tipo" começa com "valor_titular"; sem
+# coluna_tipo, a primeira linha do grupo). Linhas de tabela do modelo que
+# contêm o marcador são repetidas para cada dependente (ou para todos os
+# membros, com incluir_titular ou sem coluna_tipo).
+
+def configurar_agrupamento(coluna_grupo=None):
+    """Aplica --agrupar em CONFIG['agrupamento']; retorna o agrupamento ativo (ou None)"""
+    agrupamento = dict(CONFIG.get('agrupamento', {}))
+    if coluna_grupo:
+        agrupamento.update(ativo=True, coluna=coluna_grupo)
+        CONFIG['agrupamento'] = agrupamento
+    if not agrupamento.get('ativo', False) or not agrupamento.get('coluna'):
+        return None
+    return agrupamento
+
+def agrupar_registros(blocos, agrupamento):
+    """Agrupa a base em uma única passada; retorna (total de grupos, total de linhas, gerador).
+
+    O gerador produz (índice, registro do titular, substituições, substituições dos membros)
+    na ordem em que cada grupo aparece pela primeira vez na base.
+    """
+    partes, indices = [], []
+    formatados = defaultdict(list)
+    for indices_bloco, bloco, formatados_bloco in blocos:
+        partes.append(bloco)
+        indices.extend(indices_bloco)
+        for ph, valores in formatados_bloco.items():
+            formatados[ph].extend(valores)
+    if not partes:
+        return 0, 0, iter(())
+
+    df = pd.concat(partes, ignore_index=True)
+    chave = df[agrupamento['coluna']].map(formatar_valor).str.strip()
+    grupos = sorted(df.groupby(chave, sort=False).indices.values(), key=lambda posicoes: posicoes[0])
+
+    coluna_tipo = agrupamento.get('coluna_tipo')
+    if coluna_tipo:
+        valor_titular = str(agrupamento.get('valor_titular', 'T')).strip().upper()
+        titulares = df[coluna_tipo].map(formatar_valor).str.strip().str.upper().str.startswith(valor_titular).tolist()
+    incluir_titular = agrupamento.get('incluir_titular', False) or not coluna_tipo
+    registros = df.to_dict('records')
+
+    def gerar():
+        for posicoes in grupos:
+            posicoes = posicoes.tolist()
+            titular = next((p for p in posicoes if titulares[p]), posicoes[0]) if coluna_tipo else posicoes[0]
+            membros = posicoes if incluir_titular else [p for p in posicoes if p != titular]
+            subs = {ph: valores[titular] for ph, valores in formatados.items()}
+            linhas = [{ph: valores[p] for ph, valores in formatados.items()} for p in membros]
+            yield indices[posicoes[0]], registros[titular], subs, linhas
+
+    return len(grupos), len(df), gerar()
+
+# ===============================
+# RENDERIZAÇÃO EM PROCESSOS (MEMÓRIA COMPARTILHADA)
+# ===============================
+# CONFIG['config_geral']['processos'] > 1 (ou --processos N): os documentos são
+# renderizados em processos separados. As substituições já formatadas de cada
+# bloco vão uma única vez para a memória compartilhada, como tabelas de texto
+# (offsets int64 + buffer UTF-8 por coluna); cada processo recebe apenas as
+# posições a renderizar e o destino de cada documento.
+
+class TabelaTextos:
+    """Colunas de texto em memória compartilhada: offsets (int64) + buffer UTF-8"""
+    def __init__(self, memoria, colunas, linhas, dono=False):
+        self.memoria = memoria
+        self.colunas = colunas
+        self.linhas = linhas
+        self.dono = dono
+        self._offsets = np.ndarray((len(colunas), linhas + 1), dtype=np.int64, buffer=memoria.buf)
+
+    @classmethod
+    def criar(cls, formatados):
+        """Copia {coluna: [textos]} para um novo bloco de memória compartilhada"""
+        colunas = list(formatados)
+        linhas = len(formatados[colunas[0]]) if colunas else 0
+        offsets = np.zeros((len(colunas), linhas + 1), dtype=np.int64)
+        codificados = []
+        posicao = offsets.nbytes
+        for c, coluna in enumerate(colunas):
+            valores = [str(valor).encode('utf-8') for valor in formatados[coluna]]
+            tamanhos = np.fromiter(map(len, valores), dtype=np.int64, count=linhas)
+            offsets[c, 0] = posicao
+            offsets[c, 1:] = posicao + np.cumsum(tamanhos)
+            posicao = int(offsets[c, -1])
+            codificados.append(b''.join(valores))
+
+        memoria = shared_memory.SharedMemory(create=True, size=max(posicao, 1))
+        memoria.buf[:offsets.nbytes] = offsets.tobytes()
+        for c, dados in enumerate(codificados):
+            inicio = int(offsets[c, 0])
+            memoria.buf[inicio:inicio + len(dados)] = dados
+        return cls(memoria, colunas, linhas, dono=True)
+
+    @classmethod
+    def anexar(cls, descritor):
+        nome, colunas, linhas = descritor
+        return cls(shared_memory.SharedMemory(name=nome), colunas, linhas)
+
+    def descritor(self):
+        """O que é enviado aos processos: nome do bloco e formato da tabela"""
+        return self.memoria.name, self.colunas, self.linhas
+
+    def linha(self, posicao):
+        """Substituições de uma linha, lidas direto do buffer compartilhado"""
+        buffer = self.memoria.buf
+        return {coluna: bytes(buffer[self._offsets[c, posicao]:self._offsets[c, posicao + 1]]).decode('utf-8')
+                for c, coluna in enumerate(self.colunas)}
+
+    def fechar(self):
+        self._offsets = None  # Liberar a visão do buffer antes de fechar
+        self.memoria.close()
+        if self.dono:
+            self.memoria.unlink()
+
+def inicializar_processo(configuracao, arquivo_configuracao):
+    """Inicialização de cada processo trabalhador (mesma configuração do principal)"""
+    global CONFIG_FILE
+    CONFIG_FILE = arquivo_configuracao
+    CONFIG.clear()
+    CONFIG.update(configuracao)
+    CACHE_IMAGENS.limite_bytes = int(CONFIG.get('imagens', {}).get('limite_cache_mb', 64)) * 1024 * 1024
+
+def renderizar_faixa(descritor, modelos, tarefas):
+    """Executado no processo trabalhador: tarefas = [(posição na tabela, índice do modelo, caminho)]
+
+    Sem caminho, o documento volta em bytes para ser gravado pelo processo principal.
+    """
+    tabela = TabelaTextos.anexar(descritor)
+    resultados = []
+    try:
+        for posicao, indice_modelo, caminho in tarefas:
+            try:
+                doc = aplicar_substituicoes(abrir_modelo(modelos[indice_modelo]), tabela.linha(posicao))
+                if caminho is None:
+                    buffer = io.BytesIO()
+                    doc.save(buffer)
+                    resultados.append(buffer.getvalue())
+                else:
+                    doc.save(caminho)
+                    resultados.append(None)
+            except Exception as e:
+                resultados.append(str(e))
+    finally:
+        tabela.fechar()
+    return resultados
+
+class RenderizadorProcessos:
+    """Distribui a renderização entre processos, bloco a bloco, sem serializar os registros.
+
+    ao_concluir(contexto, erro) é chamado no processo principal, na ordem de envio,
+    quando o bloco termina (erro é None em caso de sucesso). Com `gravacao`
+    (PoolGravacao), os processos só renderizam e os bytes vão para a gravação.
+    `limite` (ajustado pelo ControladorConcorrencia, até `processos`) restringe os
+    lotes em execução na hora; entre blocos, sem lotes pendentes, o pool é recriado
+    com `limite` processos, liberando os que sobram ou iniciando os que faltam.
+    """
+    def __init__(self, processos, modelos, ao_concluir, gravacao=None):
+        self.processos = processos
+        self.modelos = list(modelos)
+        self.indice_modelo = {modelo: i for i, modelo in enumerate(self.modelos)}
+        self.ao_concluir = ao_concluir
+        self.gravacao = gravacao
+        self.executor = self._criar_executor(processos)
+        self.tabela = None
+        self.posicoes = {}
+        self.lote = []
+        self.enviados = deque()
+        self.tamanho_lote = 1
+        self.limite = None
+        self.controlador = None
+        self.espera = 0.0  # Tempo que o principal aguardou por uma vaga (renderização saturada)
+        self.recriacoes = 0
+
+    def vincular(self, ao_concluir, gravacao=None):
+        """Reaproveita o pool em uma nova execução (próxima base do plano), com novos destinos"""
+        self.ao_concluir = ao_concluir
+        self.gravacao = gravacao
+        self.limite = None
+        self.controlador = None
+        self.espera = 0.0
+        self.recriacoes = 0
+
+    def _criar_executor(self, trabalhadores):
+        self.trabalhadores = trabalhadores
+        return ProcessPoolExecutor(max_workers=trabalhadores, initializer=inicializar_processo,
+                                   initargs=(dict(CONFIG), CONFIG_FILE))
+
+    def _redimensionar(self):
+        """Recria o pool com `limite` processos (chamado entre blocos, sem lotes em execução)"""
+        if not self.limite or self.limite == self.trabalhadores:
+            return
+        self.executor.shutdown(wait=True)
+        self.executor = self._criar_executor(self.limite)
+        self.recriacoes += 1
+
+    def novo_bloco(self, indices, formatados):
+        """Conclui o bloco anterior e publica as substituições do próximo"""
+        self.concluir_bloco()
+        self._redimensionar()
+        self.tabela = TabelaTextos.criar(formatados)
+        self.posicoes = {idx: posicao for posicao, idx in enumerate(indices)}
+        # Lotes menores que o bloco: processos trabalham enquanto o principal prepara as próximas linhas
+        self.tamanho_lote = max(1, -(-len(indices) // (self.trabalhadores * 2)))
+        if self.gravacao:
+            # Lotes curtos: a gravação recebe um fluxo contínuo, não rajadas no fim de cada lote
+            self.tamanho_lote = min(self.tamanho_lote, TAMANHO_LOTE_GRAVACAO)
+
+    def enviar(self, idx, modelo_path, caminho, contexto):
+        self.lote.append(((self.posicoes[idx], self.indice_modelo[modelo_path], caminho), contexto))
+        if len(self.lote) >= self.tamanho_lote:
+            self._enviar_lote()
+
+    def _enviar_lote(self):
+        if not self.lote:
+            return
+        if self.limite:
+            self._aguardar_vaga()
+        # Com gravação separada, o processo devolve os bytes em vez de gravar
+        tarefas = [(posicao, modelo, None if self.gravacao else caminho)
+                   for (posicao, modelo, caminho), _ in self.lote]
+        destinos = [(caminho, contexto) for (_, _, caminho), contexto in self.lote]
+        futuro = self.executor.submit(renderizar_faixa, self.tabela.descritor(), self.modelos, tarefas)
+        self.enviados.append((futuro, destinos))
+        self.lote = []
+
+    def _aguardar_vaga(self):
+        """Mantém no máximo `limite` lotes em execução, entregando os já concluídos"""
+        self._entregar_prontos()
+        em_execucao = [futuro for futuro, _ in self.enviados if not futuro.done()]
+        if len(em_execucao) < self.limite:
+            return
+        inicio = time.perf_counter()
+        while len(em_execucao) >= self.limite:
+            wait(em_execucao, timeout=0.2, return_when=FIRST_COMPLETED)
+            em_execucao = [futuro for futuro in em_execucao if not futuro.done()]
+            if self.controlador:
+                self.controlador.verificar()
+        self.espera += time.perf_counter() - inicio
+        self._entregar_prontos()
+
+    def _entregar_prontos(self):
+        while self.enviados and self.enviados[0][0].done():
+            self._entregar(*self.enviados.popleft())
+
+    def _entregar(self, futuro, destinos):
+        try:
+            resultados = futuro.result()
+        except Exception as e:
+            resultados = [f"Falha no processo de renderização: {str(e)}"] * len(destinos)
+        for (caminho, contexto), resultado in zip(destinos, resultados):
+            if isinstance(resultado, bytes):
+                self.gravacao.enviar(caminho, resultado, contexto)
+            elif self.gravacao:
+                self.gravacao.registrar_falha(contexto, resultado)
+            else:
+                self.ao_concluir(contexto, resultado)
+
+    def concluir_bloco(self):
+        """Aguarda os lotes do bloco atual, entrega os resultados e libera a memória"""
+        if self.tabela is None:
+            return
+        self._enviar_lote()
+        try:
+            while self.enviados:
+                self._entregar(*self.enviados.popleft())
+                if self.controlador:
+                    self.controlador.verificar()
+        finally:
+            self.enviados.clear()
+            self.tabela.fechar()
+            self.tabela = None
+
+    def descartar(self):
+        """Execução interrompida: cancela os lotes pendentes sem entregar resultados"""
+        for futuro, _ in self.enviados:
+            futuro.cancel()
+        self.enviados.clear()
+        self.lote = []
+        if self.tabela:
+            self.tabela.fechar()
+            self.tabela = None
+
+    def finalizar(self):
+        try:
+            self.concluir_bloco()
+        finally:
+            self.executor.shutdown(wait=True)
+
+def registros_do_bloco(indices, bloco, formatados, com_substituicoes=True):
+    """(índice global, registro, substituições) das linhas de um bloco"""
+    for posicao, (idx, registro) in enumerate(zip(indices, bloco.to_dict('records'))):
+        subs = {ph: valores[posicao] for ph, valores in formatados.items()} if com_substituicoes else None
+        yield idx, registro, subs
+
+def iterar_registros_processos(blocos, renderizador):
+    """Como iterar_registros, publicando cada bloco na memória compartilhada do renderizador"""
+    for indices, bloco, formatados in blocos:
+        renderizador.novo_bloco(indices, formatados)
+        # Substituições ficam na tabela compartilhada: nada de dicionários por linha aqui
+        for idx, registro, _ in registros_do_bloco(indices, bloco, formatados, com_substituicoes=False):
+            yield idx, registro, None, None
+
+# ===============================
+# CONCORRÊNCIA ADAPTATIVA (RENDERIZAÇÃO E GRAVAÇÃO)
+# ===============================
+# CONFIG['concorrencia'] = {"adaptativa": true, "gravadores": 2,
+#                           "min_gravadores": 1, "max_gravadores": 8,
+#                           "min_processos": 1, "intervalo": 2}
+# A gravação em disco sai da renderização e vai para um pool de threads
+# (PoolGravacao). A cada intervalo o ControladorConcorrencia mede a vazão, a
+# ocupação da fila de gravação e quanto tempo cada etapa esperou pela outra:
+# se a gravação é o gargalo (ex: pasta de rede lenta) ganha gravadores; se a
+# renderização é o gargalo, ganha processos (até config_geral.processos) e
+# os gravadores ociosos são dispensados. Um aumento que não melhora a vazão
+# é desfeito.
+
+TAMANHO_LOTE_GRAVACAO = 16
+
+class PoolGravacao:
+    """Threads que gravam em disco os documentos já renderizados; quantidade ajustável.
+
+    ao_concluir(contexto, erro) é chamado na thread principal, na ordem de
+    envio (o checkpoint continua sempre no último registro concluído).
+    """
+    def __init__(self, gravadores, ao_concluir, capacidade):
+        self.ao_concluir = ao_concluir
+        self.fila = queue.Queue(maxsize=capacidade)
+        self.pendentes = deque()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._excedentes = 0
+        self._fechando = False
+        self.controlador = None
+        self.gravadores = 0
+        self.maior_gravadores = 0
+        # Métricas lidas pelo controlador
+        self.gravados = 0
+        self.tempo_gravacao = 0.0
+        self.ocioso = 0.0        # Soma do tempo dos gravadores esperando trabalho
+        self.espera_envio = 0.0  # Tempo que a renderização esperou por espaço na fila
+        self.redimensionar(gravadores)
+
+    def redimensionar(self, gravadores):
+        with self._lock:
+            diferenca = gravadores - self.gravadores
+            self.gravadores = gravadores
+            self.maior_gravadores = max(self.maior_gravadores, gravadores)
+            if diferenca < 0:
+                self._excedentes -= diferenca  # Os primeiros livres encerram
+                return
+            reaproveitados = min(diferenca, self._excedentes)
+            self._excedentes -= reaproveitados
+            diferenca -= reaproveitados
+        for _ in range(diferenca):
+            thread = threading.Thread(target=self._gravar, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _gravar(self):
+        while True:
+            with self._lock:
+                if self._excedentes > 0:
+                    self._excedentes -= 1
+                    return
+            inicio = time.perf_counter()
+            try:
+                caminho, dados, futuro = self.fila.get(timeout=0.1)
+            except queue.Empty:
+                with self._lock:
+                    self.ocioso += time.perf_counter() - inicio
+                if self._fechando:
+                    return
+                continue
+            gravacao = time.perf_counter()
+            try:
+                with open(caminho, 'wb') as f:
+                    f.write(dados)
+                erro = None
+            except Exception as e:
+                erro = f"Falha ao gravar documento: {str(e)}"
+            with self._lock:
+                self.ocioso += gravacao - inicio
+                self.tempo_gravacao += time.perf_counter() - gravacao
+                self.gravados += 1
+            futuro.set_result(erro)
+
+    def enviar(self, caminho, dados, contexto):
+        """Enfileira um documento renderizado (bloqueia se a fila estiver cheia)"""
+        futuro = Future()
+        self.pendentes.append((futuro, contexto))
+        inicio = time.perf_counter()
+        while True:
+            try:
+                self.fila.put((caminho, dados, futuro), timeout=0.2)
+                break
+            except queue.Full:
+                # Esperando a gravação: o controlador continua medindo (e pode ampliar o pool)
+                self.espera_envio += time.perf_counter() - inicio
+                inicio = time.perf_counter()
+                if self.controlador:
+                    self.controlador.verificar()
+        self.espera_envio += time.perf_counter() - inicio
+        self.coletar()
+
+    def registrar_falha(self, contexto, erro):
+        """Falha de renderização: entra na mesma ordem dos documentos gravados"""
+        futuro = Future()
+        futuro.set_result(erro)
+        self.pendentes.append((futuro, contexto))
+        self.coletar()
+
+    def ocupacao(self):
+        return self.fila.qsize() / self.fila.maxsize
+
+    def coletar(self):
+        """Entrega os resultados já gravados, na ordem de envio"""
+        while self.pendentes and self.pendentes[0][0].done():
+            futuro, contexto = self.pendentes.popleft()
+            self.ao_concluir(contexto, futuro.result())
+
+    def finalizar(self):
+        """Aguarda as gravações pendentes e encerra os gravadores"""
+        try:
+            while self.pendentes:
+                futuro, contexto = self.pendentes.popleft()
+                self.ao_concluir(contexto, futuro.result())
+        finally:
+            self.encerrar()
+
+    def encerrar(self):
+        self._fechando = True
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+class ControladorConcorrencia:
+    """Mede as etapas de renderização e gravação e redimensiona os pools dentro dos limites"""
+    LIMIAR_SATURACAO = 0.2   # Fração do intervalo esperando pela outra etapa
+    GANHO_MINIMO = 1.05      # Um aumento precisa melhorar a vazão em 5%
+    INTERVALOS_ESPERA = 3    # Após desfazer um aumento, aguardar antes de tentar de novo
+
+    def __init__(self, gravacao, renderizador, opcoes, diario):
+        self.gravacao = gravacao
+        self.renderizador = renderizador
+        self.diario = diario
+        gravacao.controlador = self
+        self.intervalo = float(opcoes.get('intervalo', 2))
+        self.min_gravadores = max(1, int(opcoes.get('min_gravadores', 1)))
+        self.max_gravadores = max(self.min_gravadores, int(opcoes.get('max_gravadores', 8)))
+        processos = renderizador.processos if renderizador else 1
+        self.min_processos = min(processos, max(1, int(opcoes.get('min_processos', 1))))
+        self.max_processos = processos
+        if renderizador:
+            renderizador.limite = processos
+            renderizador.controlador = self
+        self.ajustes = 0
+        self.intervalos = 0
+        self.tempo_gravacao_saturada = 0.0
+        self.tempo_renderizacao_saturada = 0.0
+        self.ociosidade_soma = 0.0
+        self._tentativa = None
+        self._espera = {'gravacao': 0, 'renderizacao': 0}
+        self._ocupacao_soma = 0.0
+        self._ocupacao_amostras = 0
+        self.inicio = time.perf_counter()
+        self._anterior = self._medidas()
+
+    def _medidas(self):
+        return (time.perf_counter(), self.gravacao.gravados, self.gravacao.ocioso,
+                self.gravacao.espera_envio, self.renderizador.espera if self.renderizador else 0.0)
+
+    def verificar(self):
+        """Chamado a cada registro: amostra a fila e, a cada intervalo, reavalia os pools"""
+        self.gravacao.coletar()
+        self._ocupacao_soma += self.gravacao.ocupacao()
+        self._ocupacao_amostras += 1
+        if time.perf_counter() - self._anterior[0] >= self.intervalo:
+            self._avaliar()
+
+    def _avaliar(self):
+        atual = self._medidas()
+        duracao = atual[0] - self._anterior[0]
+        vazao = (atual[1] - self._anterior[1]) / duracao
+        ociosidade = (atual[2] - self._anterior[2]) / (duracao * max(1, self.gravacao.gravadores))
+        espera_gravacao = (atual[3] - self._anterior[3]) / duracao
+        espera_renderizacao = (atual[4] - self._anterior[4]) / duracao
+        ocupacao = self._ocupacao_soma / max(1, self._ocupacao_amostras)
+        if vazao == 0 and ocupacao < 0.75 and espera_gravacao <= self.LIMIAR_SATURACAO:
+            return  # Nada concluído ainda (início ou bloco sendo lido): sem base para ajustar
+        self._anterior = atual
+        self._ocupacao_soma, self._ocupacao_amostras = 0.0, 0
+        self.intervalos += 1
+        self.ociosidade_soma += min(ociosidade, 1.0)
+
+        for etapa in self._espera:
+            self._espera[etapa] = max(0, self._espera[etapa] - 1)
+        if self._tentativa:
+            etapa, vazao_anterior = self._tentativa
+            self._tentativa = None
+            if vazao < vazao_anterior * self.GANHO_MINIMO:
+                self._ajustar(etapa, -1, f"sem ganho de vazão ({vazao:.1f} docs/s)")
+                self._espera[etapa] = self.INTERVALOS_ESPERA
+                return
+
+        if espera_gravacao > self.LIMIAR_SATURACAO or ocupacao > 0.75:
+            # Gravação é o gargalo: fila cheia e renderização parada esperando
+            self.tempo_gravacao_saturada += duracao
+            motivo = f"gravação saturada (fila {ocupacao:.0%}, espera {espera_gravacao:.0%})"
+            if self.gravacao.gravadores < self.max_gravadores and not self._espera['gravacao']:
+                if self._ajustar('gravacao', +1, motivo):
+                    self._tentativa = ('gravacao', vazao)
+            elif self.renderizador and self.renderizador.limite > self.min_processos:
+                self._ajustar('renderizacao', -1, motivo)
+        elif ocupacao < 0.25 and (ociosidade > 0.5 or espera_renderizacao > self.LIMIAR_SATURACAO):
+            # Renderização é o gargalo: gravadores sem trabalho
+            self.tempo_renderizacao_saturada += duracao
+            motivo = f"renderização saturada (gravadores {min(ociosidade, 1.0):.0%} ociosos)"
+            if (self.renderizador and self.renderizador.limite < self.max_processos
+                    and not self._espera['renderizacao']):
+                if self._ajustar('renderizacao', +1, motivo):
+                    self._tentativa = ('renderizacao', vazao)
+            elif self.gravacao.gravadores > self.min_gravadores:
+                self._ajustar('gravacao', -1, motivo)
+
+    def _ajustar(self, etapa, delta, motivo):
+        if etapa == 'gravacao':
+            anterior = self.gravacao.gravadores
+            novo = min(self.max_gravadores, max(self.min_gravadores, anterior + delta))
+            if novo != anterior:
+                self.gravacao.redimensionar(novo)
+        else:
+            anterior = self.renderizador.limite
+            novo = min(self.max_processos, max(self.min_processos, anterior + delta))
+            self.renderizador.limite = novo
+        if novo == anterior:
+            return False
+        self.ajustes += 1
+        self.diario.registrar('concorrencia', etapa=etapa, de=anterior, para=novo, motivo=motivo)
+        return True
+
+    def registrar_resumo(self):
+        """Grava no diário as configurações finais e a saturação observada"""
+        duracao = max(time.perf_counter() - self.inicio, 1e-9)
+        resumo = {
+            'gravadores': self.gravacao.gravadores,
+            'maior_gravadores': self.gravacao.maior_gravadores,
+            'limites_gravadores': [self.min_gravadores, self.max_gravadores],
+            'processos': self.renderizador.limite if self.renderizador else 1,
+            'limites_processos': [self.min_processos, self.max_processos],
+            'recriacoes_pool': self.renderizador.recriacoes if self.renderizador else 0,
+            'ajustes': self.ajustes,
+            'gravacao_saturada': round(self.tempo_gravacao_saturada / duracao, 3),
+            'renderizacao_saturada': round(self.tempo_renderizacao_saturada / duracao, 3),
+            'ociosidade_gravadores': round(self.ociosidade_soma / self.intervalos, 3) if self.intervalos else None,
+            'tempo_medio_gravacao': round(self.gravacao.tempo_gravacao / self.gravacao.gravados, 4)
+                                    if self.gravacao.gravados else None,
+            'duracao': round(duracao, 3),
+        }
+        self.diario.registrar('concorrencia_resumo', **resumo)
+        return resumo
+
+# ===============================
+# SAÍDA COMBINADA (MALA DIRETA)
+# ===============================
+# CONFIG['saida_combinada'] = {"modo": "unico" | "por_categoria",
+#                              "nome_arquivo": "Documentos_combinados.docx"}
+# Cada registro vira uma seção (com quebra de página) de um único .docx por
+# modelo (ou por modelo e pasta de categoria). Estilos, numeração, mídia,
+# cabeçalhos e rodapés do modelo são gravados uma única vez; o corpo de cada
+# registro é gravado em um arquivo temporário à medida que é gerado.
+
+QUEBRA_PAGINA_XML = (
+    '<w:p xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+    '<w:r><w:br w:type="page"/></w:r></w:p>'
+).encode('utf-8')
+
+class DocumentoCombinado:
+    """Acumula o corpo de vários registros de um mesmo modelo em um único .docx"""
+    def __init__(self, modelo_path, caminho_saida):
+        self.modelo_path = modelo_path
+        self.caminho_saida = caminho_saida
+        self.total = 0
+        self.primeiras_substituicoes = None
+        self._id_desenho = 0
+
+        # Modelo analisado uma única vez: elementos do corpo (sem o sectPr final).
+        # O mesmo Document recebe as imagens inseridas e é a base do arquivo final.
+        doc = self.base = abrir_modelo(modelo_path)
+        corpo = doc.element.body
+        self.elementos = [el for el in corpo if el.tag != qn('w:sectPr')]
+
+        pasta = os.path.dirname(caminho_saida) or '.'
+        fd, self.caminho_partes = tempfile.mkstemp(suffix='.xmlpart', dir=pasta)
+        self.partes = os.fdopen(fd, 'wb')
+
+    def adicionar(self, substituicoes, linhas=None):
+        """Renderiza o corpo do modelo para um registro e grava o XML no arquivo temporário"""
+        if self.primeiras_substituicoes is None:
+            self.primeiras_substituicoes = substituicoes
+        substituicoes, imagens = separar_imagens(substituicoes)
+        sorted_ph = sorted(substituicoes.keys(), key=len, reverse=True)
+
+        if self.total:
+            self.partes.write(QUEBRA_PAGINA_XML)
+        for elemento in self.elementos:
+            copia = copy.deepcopy(elemento)
+            if linhas is not None:
+                repetir_linhas_marcadas(copia, linhas, self.base.part)
+            for p in copia.iter(qn('w:p')):
+                # Parágrafo ligado à parte do documento base, que recebe as imagens
+                paragrafo = Paragraph(p, self.base.part)
+                substituir_em_paragrafo(paragrafo, sorted_ph, substituicoes)
+                if imagens:
+                    substituir_imagens_em_paragrafo(paragrafo, imagens)
+            # Ids de imagens precisam ser únicos no documento
+            for desenho in copia.iter('{http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing}docPr'):
+                self._id_desenho += 1
+                desenho.set('id', str(self._id_desenho))
+            self.partes.write(etree.tostring(copia, encoding='utf-8'))
+        self.total += 1
+
+    def finalizar(self):
+        """Monta o .docx final copiando as partes do modelo e o corpo acumulado"""
+        self.partes.close()
+        try:
+            # Cabeçalhos/rodapés são únicos: usam os valores do primeiro registro
+            base = self.base
+            if self.primeiras_substituicoes:
+                textos, imagens = separar_imagens(self.primeiras_substituicoes)
+                sorted_ph = sorted(textos.keys(), key=len, reverse=True)
+                for section in base.sections:
+                    for paragraph in list(section.header.paragraphs) + list(section.footer.paragraphs):
+                        substituir_em_paragrafo(paragraph, sorted_ph, textos)
+                        if imagens:
+                            substituir_imagens_em_paragrafo(paragraph, imagens)
+
+            # Documento sem o conteúdo do corpo, dividido onde o conteúdo entra
+            documento = copy.deepcopy(base.element)
+            corpo = documento.find(qn('w:body'))
+            for el in list(corpo):
+                if el.tag != qn('w:sectPr'):
+                    corpo.remove(el)
+            xml = etree.tostring(documento, encoding='utf-8', xml_declaration=True, standalone=True)
+            corte = xml.find(b'<w:sectPr')
+            if corte < 0:
+                corte = xml.rfind(b'</w:body>')
+            prefixo, sufixo = xml[:corte], xml[corte:]
+
+            pacote_base = io.BytesIO()
+            base.save(pacote_base)
+            pacote_base.seek(0)
+
+            with zipfile.ZipFile(pacote_base) as origem, \
+                    zipfile.ZipFile(self.caminho_saida, 'w', zipfile.ZIP_DEFLATED) as destino:
+                for item in origem.infolist():
+                    if item.filename != 'word/document.xml':
+                        destino.writestr(item, origem.read(item.filename))
+                        continue
+                    with destino.open('word/document.xml', 'w') as saida, \
+                            open(self.caminho_partes, 'rb') as partes:
+                        saida.write(prefixo)
+                        shutil.copyfileobj(partes, saida, 1024 * 1024)
+                        saida.write(sufixo)
+        finally:
+            os.remove(self.caminho_partes)
+        return self.caminho_saida
+
+    def descartar(self):
+        try:
+            self.partes.close()
+            os.remove(self.caminho_partes)
+        except Exception:
+            pass
+
+class SaidaCombinada:
+    """Distribui os registros entre os documentos combinados (por modelo e pasta)"""
+    def __init__(self, modo, nome_arquivo, sufixo=''):
+        self.modo = modo
+        self.nome_arquivo = nome_arquivo
+        self.sufixo = sufixo
+        self.documentos = {}
+
+    def caminho(self, pasta, modelo_path, varios_modelos):
+        nome, ext = os.path.splitext(self.nome_arquivo)
+        if varios_modelos:
+            nome = f"{os.path.splitext(os.path.basename(modelo_path))[0]} - {nome}"
+        return os.path.join(pasta, limpar_nome_arquivo(nome + self.sufixo) + (ext or '.docx'))
+
+    def adicionar(self, pasta, modelo_path, substituicoes, varios_modelos, linhas=None):
+        """Adiciona o registro ao documento combinado; retorna o caminho desse documento"""
+        chave = (pasta, modelo_path)
+        documento = self.documentos.get(chave)
+        if documento is None:
+            documento = DocumentoCombinado(modelo_path, self.caminho(pasta, modelo_path, varios_modelos))
+            self.documentos[chave] = documento
+        documento.adicionar(substituicoes, linhas)
+        return documento.caminho_saida
+
+    def finalizar(self):
+        """Grava todos os documentos combinados; retorna [(caminho, registros)]"""
+        gerados = []
+        for documento in self.documentos.values():
+            gerados.append((documento.finalizar(), documento.total))
+        return gerados
+
+    def descartar(self):
+        for documento in self.documentos.values():
+            documento.descartar()
+
+# ===============================
+# CONVERSÃO PARA PDF (LIBREOFFICE)
+# ===============================
+# CONFIG['conversao_pdf'] = {"ativo": true, "trabalhadores": 2, "pasta": null,
+#                            "max_conversoes": 200, "tempo_limite": 120, "soffice": null}
+# Mantém processos headless do LibreOffice abertos (via UNO, por pipe local)
+# e distribui os documentos entre eles. Sem o módulo uno neste Python (caso
+# comum no Windows), cada trabalhador conversa com o seu processo por uma
+# ponte executada no Python que acompanha o LibreOffice ("python" na seção
+# conversao_pdf indica outro). Só sem nenhum dos dois cada arquivo abre o
+# LibreOffice de novo ("soffice --convert-to"), com aviso no console e no diário.
+
+def localizar_soffice(configurado=None):
+    """Executável do LibreOffice (configurado, no PATH ou na instalação padrão)"""
+    candidatos = [limpar_caminho(configurado)] if configurado else []
+    candidatos += [shutil.which('soffice'), shutil.which('libreoffice')]
+    candidatos += [
+        r'C:\Program Files\LibreOffice\program\soffice.exe',
+        r'C:\Program Files (x86)\LibreOffice\program\soffice.exe',
+        '/usr/lib/libreoffice/program/soffice',
+        '/Applications/LibreOffice.app/Contents/MacOS/soffice',
+    ]
+    for candidato in candidatos:
+        if candidato and os.path.isfile(candidato):
+            return candidato
+    return None
+
+# Filtros de exportação do LibreOffice por formato de destino
+FILTROS_LIBREOFFICE = {'pdf': 'writer_pdf_Export', 'docx': 'MS Word 2007 XML'}
+
+def localizar_python_libreoffice(soffice, configurado=None):
+    """Python que acompanha o LibreOffice (tem o módulo uno), ou None"""
+    candidatos = [limpar_caminho(configurado)] if configurado else []
+    pasta = os.path.dirname(os.path.realpath(soffice))
+    candidatos += [
+        os.path.join(pasta, 'python.exe'),
+        os.path.join(pasta, 'python'),
+        os.path.join(os.path.dirname(pasta), 'Resources', 'python'),  # macOS
+    ]
+    for candidato in candidatos:
+        if candidato and os.path.isfile(candidato):
+            return candidato
+    return None
+
+# Ponte executada no Python do LibreOffice: conecta ao processo do trabalhador
+# e atende pedidos JSON, um por linha (stdin -> stdout)
+PONTE_UNO = r'''
+import json, sys, time
+import uno
+from com.sun.star.beans import PropertyValue
+
+def propriedade(nome, valor):
+    prop = PropertyValue()
+    prop.Name, prop.Value = nome, valor
+    return prop
+
+def responder(**dados):
+    sys.stdout.write(json.dumps(dados) + "\n")
+    sys.stdout.flush()
+
+local = uno.getComponentContext()
+resolvedor = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+limite = time.time() + float(sys.argv[2])
+while True:
+    try:
+        contexto = resolvedor.resolve("uno:pipe,name=%s;urp;StarOffice.ComponentContext" % sys.argv[1])
+        break
+    except Exception as e:
+        if time.time() > limite:
+            responder(erro="LibreOffice não respondeu ao iniciar: %s" % e)
+            sys.exit(1)
+        time.sleep(0.5)
+desktop = contexto.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", contexto)
+responder(ok=True)
+
+for linha in sys.stdin:
+    pedido = json.loads(linha)
+    try:
+        if pedido["acao"] == "encerrar":
+            desktop.terminate()
+            break
+        if pedido["acao"] == "verificar":
+            desktop.getFrames()
+        else:
+            documento = desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(pedido["origem"]), "_blank", 0, (propriedade("Hidden", True),))
+            if documento is None:
+                raise RuntimeError("LibreOffice não abriu o documento")
+            try:
+                documento.storeToURL(uno.systemPathToFileUrl(pedido["destino"]),
+                                     (propriedade("FilterName", pedido["filtro"]),))
+            finally:
+                documento.close(True)
+        responder(ok=True)
+    except Exception as e:
+        responder(erro=str(e) or type(e).__name__)
+'''
+
+def caminho_url(caminho):
+    """Caminho local (ou UNC) no formato file:// aceito pelo LibreOffice, com percent-encoding"""
+    caminho = os.path.abspath(caminho)
+    if uno is not None:
+        return uno.systemPathToFileUrl(caminho)
+    return pathlib.Path(caminho).as_uri()
+
+class TrabalhadorLibreOffice:
+    """Um processo headless do LibreOffice com perfil de usuário exclusivo.
+
+    modo: 'uno' (ponte neste processo), 'ponte' (Python do LibreOffice) ou
+    'cli' (um soffice por arquivo, sem processo persistente).
+    """
+    def __init__(self, numero, soffice, pasta_perfis, max_conversoes=200, python_ponte=None):
+        self.numero = numero
+        self.soffice = soffice
+        self.perfil = os.path.join(pasta_perfis, f"perfil_{numero}")
+        self.max_conversoes = max_conversoes
+        self.python_ponte = python_ponte
+        self.modo = 'uno' if uno is not None else ('ponte' if python_ponte else 'cli')
+        self.processo = None
+        self.ponte = None
+        self.desktop = None
+        self.conversoes = 0
+        self.reciclagens = 0
+        self.inicio_conversao = None
+
+    def _argumentos_base(self):
+        return [self.soffice, f"-env:UserInstallation={caminho_url(self.perfil)}",
+                '--headless', '--invisible', '--nologo', '--norestore', '--nodefault']
+
+    @property
+    def persistente(self):
+        return self.modo != 'cli'
+
+    def iniciar(self):
+        if not self.persistente:
+            return
+        pipe = f"docautomator_{os.getpid()}_{self.numero}"
+        self.processo = subprocess.Popen(
+            self._argumentos_base() + [f"--accept=pipe,name={pipe};urp;StarOffice.ComponentContext"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        if self.modo == 'ponte':
+            self._iniciar_ponte(pipe)
+            self.conversoes = 0
+            return
+        contexto_local = uno.getComponentContext()
+        resolvedor = contexto_local.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", contexto_local)
+        # O processo leva alguns segundos para aceitar conexões
+        limite = time.time() + 60
+        while True:
+            try:
+                contexto = resolvedor.resolve(f"uno:pipe,name={pipe};urp;StarOffice.ComponentContext")
+                break
+            except Exception:
+                if time.time() > limite or self.processo.poll() is not None:
+                    self.encerrar()
+                    raise RuntimeError("LibreOffice não respondeu ao iniciar")
+                time.sleep(0.5)
+        self.desktop = contexto.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", contexto)
+        self.conversoes = 0
+
+    def _iniciar_ponte(self, pipe):
+        script = os.path.join(os.path.dirname(self.perfil), 'ponte_uno.py')
+        if not os.path.exists(script):
+            with open(script, 'w', encoding='utf-8') as f:
+                f.write(PONTE_UNO)
+        self.ponte = subprocess.Popen(
+            [self.python_ponte, script, pipe, '60'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, text=True, encoding='utf-8'
+        )
+        try:
+            resposta = self._resposta_ponte()
+        except RuntimeError:
+            resposta = {'erro': "a ponte UNO encerrou ao iniciar"}
+        if 'erro' in resposta:
+            self.encerrar()
+            raise RuntimeError(resposta['erro'])
+
+    def _resposta_ponte(self):
+        linha = self.ponte.stdout.readline()
+        if not linha:
+            raise RuntimeError("Ponte UNO do LibreOffice encerrada")
+        return json.loads(linha)
+
+    def _pedir_ponte(self, **pedido):
+        """Envia um pedido à ponte e aguarda a resposta (erro vira exceção)"""
+        self.ponte.stdin.write(json.dumps(pedido) + '\n')
+        self.ponte.stdin.flush()
+        resposta = self._resposta_ponte()
+        if 'erro' in resposta:
+            raise RuntimeError(resposta['erro'])
+
+    def saudavel(self):
+        """Verificação de saúde: processo vivo e respondendo"""
+        if not self.persistente:
+            return True
+        if self.processo is None or self.processo.poll() is not None:
+            return False
+        try:
+            if self.modo == 'ponte':
+                if self.ponte is None or self.ponte.poll() is not None:
+                    return False
+                self._pedir_ponte(acao='verificar')
+            elif self.desktop is None:
+                return False
+            else:
+                self.desktop.getFrames()
+            return True
+        except Exception:
+            return False
+
+    def reciclar(self):
+        self.encerrar()
+        self.reciclagens += 1
+        self.iniciar()
+
+    def converter(self, origem, destino, tempo_limite=120, formato='pdf'):
+        """Converte um documento; recicla o processo se estiver doente ou muito usado"""
+        if self.persistente and (not self.saudavel() or self.conversoes >= self.max_conversoes):
+            self.reciclar()
+        self.inicio_conversao = time.time()
+        try:
+            if self.modo == 'uno':
+                self._converter_uno(origem, destino, formato)
+            elif self.modo == 'ponte':
+                self._pedir_ponte(acao='converter', origem=os.path.abspath(origem),
+                                  destino=os.path.abspath(destino), filtro=FILTROS_LIBREOFFICE[formato])
+            else:
+                self._converter_cli(origem, destino, tempo_limite, formato)
+            self.conversoes += 1
+        except Exception:
+            # Processo possivelmente travado/corrompido: trocar antes do próximo uso
+            if self.persistente:
+                self.encerrar()
+            raise
+        finally:
+            self.inicio_conversao = None
+
+    def _converter_uno(self, origem, destino, formato):
+        def propriedade(nome, valor):
+            prop = PropertyValue()
+            prop.Name, prop.Value = nome, valor
+            return prop
+
+        documento = self.desktop.loadComponentFromURL(
+            caminho_url(origem), "_blank", 0, (propriedade("Hidden", True),))
+        if documento is None:
+            raise RuntimeError("LibreOffice não abriu o documento")
+        try:
+            documento.storeToURL(caminho_url(destino), (propriedade("FilterName", FILTROS_LIBREOFFICE[formato]),))
+        finally:
+            documento.close(True)
+
+    def _converter_cli(self, origem, destino, tempo_limite, formato):
+        pasta_saida = os.path.dirname(destino)
+        subprocess.run(
+            self._argumentos_base() + ['--convert-to', formato, '--outdir', pasta_saida, origem],
+            check=True, timeout=tempo_limite, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        gerado = os.path.join(pasta_saida, os.path.splitext(os.path.basename(origem))[0] + '.' + formato)
+        if os.path.abspath(gerado) != os.path.abspath(destino):
+            os.replace(gerado, destino)
+        if not os.path.exists(destino):
+            raise RuntimeError(f"LibreOffice não gerou o arquivo .{formato}")
+
+    def encerrar(self):
+        if self.ponte is not None:
+            try:
+                # A ponte fecha o LibreOffice e termina ao fim da entrada
+                if self.ponte.poll() is None:
+                    self.ponte.stdin.write(json.dumps({'acao': 'encerrar'}) + '\n')
+                    self.ponte.stdin.close()
+                self.ponte.wait(timeout=10)
+            except Exception:
+                self.ponte.kill()
+            self.ponte = None
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.processo is not None:
+            try:
+                self.processo.terminate()
+                self.processo.wait(timeout=10)
+            except Exception:
+                self.processo.kill()
+            self.processo = None
+
+class PoolConversaoPDF:
+    """Distribui conversões .docx -> .pdf entre trabalhadores LibreOffice persistentes"""
+    def __init__(self, opcoes, diario=None, saida_path=None):
+        self.soffice = localizar_soffice(opcoes.get('soffice'))
+        if not self.soffice:
+            raise RuntimeError("LibreOffice (soffice) não encontrado; informe conversao_pdf.soffice")
+        self.opcoes = opcoes
+        self.diario = diario
+        self.saida_path = saida_path
+        self.tempo_limite = opcoes.get('tempo_limite', 120)
+        self.total_trabalhadores = max(1, int(opcoes.get('trabalhadores', 2)))
+        self.pasta_perfis = tempfile.mkdtemp(prefix='docautomator_lo_')
+        python_ponte = None if uno is not None else localizar_python_libreoffice(self.soffice, opcoes.get('python'))
+        self.trabalhadores = [
+            TrabalhadorLibreOffice(n, self.soffice, self.pasta_perfis, opcoes.get('max_conversoes', 200),
+                                   python_ponte)
+            for n in range(self.total_trabalhadores)
+        ]
+        self.livres = queue.Queue()
+        for trabalhador in self.trabalhadores:
+            self.livres.put(trabalhador)
+        self.executor = ThreadPoolExecutor(max_workers=self.total_trabalhadores)
+        self.pendentes = []
+        self.convertidos = 0
+        self.falhas = 0
+        self._lock = threading.Lock()  # Contadores atualizados pelas threads de conversão
+        self.inicio = time.time()
+        self._reciclagens_registradas = 0
+        self._ativo = True
+        # Vigia: encerra processos presos além do tempo limite (serão reciclados)
+        self._vigia = threading.Thread(target=self._vigiar, daemon=True)
+        self._vigia.start()
+
+    @property
+    def persistente(self):
+        return self.trabalhadores[0].persistente
+
+    @property
+    def modo(self):
+        return {'uno': 'persistente (UNO)', 'ponte': 'persistente (ponte UNO do LibreOffice)',
+                'cli': 'linha de comando'}[self.trabalhadores[0].modo]
+
+    def iniciar(self):
+        """Abre os processos; se a ponte não funcionar, cai para a linha de comando (com aviso)"""
+        for trabalhador in self.trabalhadores:
+            try:
+                trabalhador.iniciar()
+            except Exception as e:
+                if trabalhador.modo != 'ponte':
+                    raise
+                print(f"⚠ Ponte UNO do LibreOffice indisponível: {str(e)}")
+                for outro in self.trabalhadores:
+                    outro.encerrar()
+                    outro.modo = 'cli'
+                break
+        if not self.persistente:
+            print("⚠ Conversão PDF sem processo persistente: cada arquivo abrirá o LibreOffice "
+                  "(informe \"python\" na seção conversao_pdf com o Python do LibreOffice)")
+            self.registrar_modo()
+
+    def registrar_modo(self):
+        """Registra no diário atual que o pool não mantém processos abertos"""
+        if self.diario and not self.persistente:
+            self.diario.registrar('pdf_aviso', modo=self.modo,
+                                  erro="Conversão sem processo persistente (soffice por arquivo)")
+
+    def caminho_pdf(self, caminho_docx):
+        base = os.path.splitext(caminho_docx)[0] + '.pdf'
+        pasta = self.opcoes.get('pasta')
+        if not pasta or not self.saida_path:
+            return base
+        # Espelhar a estrutura de subpastas da saída na pasta de PDFs
+        relativo = os.path.relpath(base, self.saida_path)
+        destino = os.path.join(limpar_caminho(pasta), relativo)
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        return destino
+
+    def enviar(self, caminho_docx):
+        """Agenda a conversão (não bloqueia a geração dos próximos documentos)"""
+        futuro = self.executor.submit(self._converter, caminho_docx)
+        self.pendentes.append(futuro)
+        return futuro
+
+    def _converter(self, caminho_docx):
+        trabalhador = self.livres.get()
+        inicio = time.time()
+        caminho_pdf = None
+        try:
+            # Dentro do try: uma falha ao montar o destino também devolve o trabalhador
+            caminho_pdf = self.caminho_pdf(caminho_docx)
+            trabalhador.converter(caminho_docx, caminho_pdf, self.tempo_limite)
+            with self._lock:
+                self.convertidos += 1
+            status, erro = 'ok', None
+        except Exception as e:
+            with self._lock:
+                self.falhas += 1
+            status, erro = 'erro', str(e)
+        finally:
+            self.livres.put(trabalhador)
+        duracao = time.time() - inicio
+        if self.diario:
+            self.diario.registrar('pdf', arquivo=caminho_docx, pdf=caminho_pdf, status=status,
+                                  duracao=round(duracao, 3), trabalhador=trabalhador.numero, erro=erro)
+        return status == 'ok'
+
+    def _vigiar(self):
+        while self._ativo:
+            time.sleep(2)
+            for trabalhador in self.trabalhadores:
+                inicio = trabalhador.inicio_conversao
+                if inicio and time.time() - inicio > self.tempo_limite and trabalhador.processo:
+                    trabalhador.processo.kill()
+
+    def usar_diario(self, diario):
+        """Pool compartilhado entre bases: passa a registrar no diário da próxima base"""
+        self.diario = diario
+        self.registrar_modo()
+        with self._lock:
+            self.convertidos = 0
+            self.falhas = 0
+        self.inicio = time.time()
+
+    def aguardar(self):
+        """Aguarda as conversões pendentes e registra o resumo no diário atual"""
+        for futuro in self.pendentes:
+            futuro.result()
+        self.pendentes = []
+        duracao = time.time() - self.inicio
+        reciclagens = sum(t.reciclagens for t in self.trabalhadores)
+        if self.diario:
+            self.diario.registrar('pdf_resumo', duracao=round(duracao, 3), trabalhadores=self.total_trabalhadores,
+                                  modo=self.modo, persistente=self.persistente, reciclagens=reciclagens - self._reciclagens_registradas,
+                                  convertidos=self.convertidos, falhas=self.falhas)
+        self._reciclagens_registradas = reciclagens
+        return self.convertidos, self.falhas
+
+    def finalizar(self):
+        """Aguarda as conversões pendentes, encerra os processos e registra o resumo"""
+        resultado = self.aguardar()
+        self.executor.shutdown(wait=True)
+        self._ativo = False
+        for trabalhador in self.trabalhadores:
+            trabalhador.encerrar()
+        shutil.rmtree(self.pasta_perfis, ignore_errors=True)
+        return resultado
+
+def iniciar_pool_pdf(opcoes, diario=None, saida_path=None):
+    """Cria e aquece o pool de conversão; retorna None (com aviso) se indisponível"""
+    try:
+        pool = PoolConversaoPDF(opcoes, diario, saida_path)
+        pool.iniciar()
+        print(f"✓ Conversão PDF: {pool.total_trabalhadores} trabalhadores LibreOffice ({pool.modo})")
+        return pool
+    except Exception as e:
+        print(f"⚠ Conversão para PDF desativada: {str(e)}")
+        return None
+
+def converter_pasta_pdf(pasta, opcoes=None):
+    """Converte para PDF todos os .docx de uma pasta (e subpastas)"""
+    opcoes = dict(CONFIG.get('conversao_pdf', {}) if opcoes is None else opcoes)
+    documentos = [os.path.join(raiz, nome) for raiz, _, arquivos in os.walk(pasta)
+                  for nome in arquivos if nome.lower().endswith('.docx') and not nome.startswith('~$')]
+    if not documentos:
+        print(f"❌ Nenhum .docx encontrado em: {pasta}")
+        return None
+    diario = DiarioExecucao(os.path.join(pasta, 'diario_conversao_pdf.jsonl'))
+    pool = iniciar_pool_pdf(opcoes, diario, pasta)
+    if pool is None:
+        diario.fechar()
+        return None
+    print(f"⏳ Convertendo {len(documentos)} documentos...")
+    for i, caminho in enumerate(documentos, 1):
+        pool.enviar(caminho)
+    convertidos, falhas = pool.finalizar()
+    diario.fechar()
+    print(f"✓ PDFs gerados: {convertidos}/{len(documentos)} ({falhas} falhas) "
+          f"em {time.time() - pool.inicio:.1f} segundos")
+    return convertidos, falhas
+
+# ===============================
+# MODELOS LEGADOS (.doc)
+# ===============================
+# python-docx só abre .docx: modelos .doc são convertidos uma única vez e a
+# cópia fica em cache pelo hash do arquivo (CONFIG['conversao_doc']['pasta_cache'],
+# padrão: pasta "cache_modelos" ao lado do arquivo de configuração).
+
+def pasta_cache_modelos():
+    pasta = CONFIG.get('conversao_doc', {}).get('pasta_cache')
+    if pasta:
+        pasta = limpar_caminho(pasta)
+    else:
+        pasta = os.path.join(os.path.dirname(os.path.abspath(CONFIG_FILE)), 'cache_modelos')
+    os.makedirs(pasta, exist_ok=True)
+    return pasta
+
+def hash_arquivo(caminho):
+    """SHA-256 do conteúdo do arquivo"""
+    resumo = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            resumo.update(bloco)
+    return resumo.hexdigest()
+
+class ConversorModelosLegados:
+    """Converte .doc -> .docx com LibreOffice headless (ou Word, no Windows)"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.trabalhador = None
+        self.convertidos = 0
+        self.reaproveitados = 0
+
+    def converter(self, modelo_path):
+        """Caminho do .docx equivalente (reaproveitado do cache quando possível)"""
+        with self._lock:
+            destino = os.path.join(pasta_cache_modelos(), hash_arquivo(modelo_path) + '.docx')
+            if os.path.exists(destino):
+                self.reaproveitados += 1
+                return destino
+            # Converter em pasta temporária: execuções paralelas não disputam o mesmo arquivo
+            pasta_temp = tempfile.mkdtemp(prefix='docautomator_doc_')
+            try:
+                temporario = os.path.join(pasta_temp, 'modelo.docx')
+                self._converter(modelo_path, temporario)
+                shutil.move(temporario, destino)
+            finally:
+                shutil.rmtree(pasta_temp, ignore_errors=True)
+            self.convertidos += 1
+            return destino
+
+    def _converter(self, origem, destino):
+        soffice = localizar_soffice(CONFIG.get('conversao_pdf', {}).get('soffice'))
+        if soffice:
+            if self.trabalhador is None:
+                opcoes = CONFIG.get('conversao_pdf', {})
+                python_ponte = None if uno is not None else localizar_python_libreoffice(soffice, opcoes.get('python'))
+                trabalhador = TrabalhadorLibreOffice(0, soffice, tempfile.mkdtemp(prefix='docautomator_lo_'),
+                                                     python_ponte=python_ponte)
+                try:
+                    trabalhador.iniciar()
+                except Exception:
+                    if trabalhador.modo != 'ponte':
+                        raise
+                    trabalhador.modo = 'cli'
+                self.trabalhador = trabalhador
+            self.trabalhador.converter(origem, destino, formato='docx')
+            return
+        # Sem LibreOffice: usar o Word instalado. A conversão pode ocorrer em threads
+        # do servidor, então o COM é inicializado (e o Word encerrado) na própria thread;
+        # DispatchEx abre uma instância exclusiva, sem fechar o Word do usuário.
+        pythoncom.CoInitialize()
+        try:
+            word = win32.DispatchEx("Word.Application")
+            word.Visible = False
+            try:
+                documento = word.Documents.Open(os.path.abspath(origem), ReadOnly=True)
+                try:
+                    documento.SaveAs2(os.path.abspath(destino), FileFormat=16)  # wdFormatDocumentDefault
+                finally:
+                    documento.Close(False)
+            finally:
+                word.Quit()
+        finally:
+            pythoncom.CoUninitialize()
+
+    def encerrar(self):
+        """Fecha o processo de conversão (é reaberto se necessário)"""
+        with self._lock:
+            if self.trabalhador is not None:
+                self.trabalhador.encerrar()
+                shutil.rmtree(os.path.dirname(self.trabalhador.perfil), ignore_errors=True)
+                self.trabalhador = None
+
+CONVERSOR_MODELOS = ConversorModelosLegados()
+
+def preparar_modelos_legados(modelos):
+    """Converte antecipadamente os modelos .doc; retorna {modelo: erro} dos que falharem"""
+    legados = [m for m in modelos if m.lower().endswith('.doc')]
+    falhas = {}
+    if not legados:
+        return falhas
+    print(f"\n🔄 Preparando {len(legados)} modelos .doc (conversão para .docx)...")
+    try:
+        for modelo_path in legados:
+            try:
+                CACHE_MODELOS.conteudo(modelo_path)
+                print(f"  ✅ {os.path.basename(modelo_path)}")
+            except Exception as e:
+                falhas[modelo_path] = str(e)
+                print(f"  ❌ {os.path.basename(modelo_path)}: {str(e)}")
+    finally:
+        CONVERSOR_MODELOS.encerrar()
+    print(f"✓ Modelos .doc: {CONVERSOR_MODELOS.convertidos} convertidos, "
+          f"{CONVERSOR_MODELOS.reaproveitados} reaproveitados do cache, {len(falhas)} falhas")
+    return falhas
+
+# ===============================
+# TELEMETRIA (PROGRESSO E EVENTOS)
+# ===============================
+# Em vez de uma linha por documento, o progresso é atualizado em intervalos
+# fixos: barra, vazão, tempo restante e contagem por status. No console a
+# linha é reescrita ("intervalo", padrão 1 s); com a saída redirecionada para
+# arquivo, uma linha nova a cada "intervalo_log" (padrão 30 s). Os eventos de
+# cada documento podem ir para um fluxo JSON lines acompanhável por outras
+# ferramentas ("eventos": caminho do arquivo, ou --eventos ARQUIVO).
+# CONFIG['telemetria'] = {"intervalo": 1, "intervalo_log": 30, "eventos": null}
+
+MAX_AVISOS_CONSOLE = 20
+
+class Telemetria:
+    """Progresso com taxa de atualização limitada e fluxo opcional de eventos"""
+    def __init__(self, total, opcoes=None, caminho_eventos=None, saida=None):
+        opcoes = opcoes or {}
+        self.total = total
+        self.saida = saida or sys.stdout
+        self.console = bool(getattr(self.saida, 'isatty', lambda: False)())
+        self.intervalo = float(opcoes.get('intervalo', 1) if self.console else opcoes.get('intervalo_log', 30))
+        self.contagens = defaultdict(int)
+        self.pulados = 0
+        self.avisos = 0
+        self.inicio = time.time()
+        self._ultima = time.monotonic()
+        self._largura_linha = 0
+        caminho_eventos = caminho_eventos or opcoes.get('eventos')
+        self.eventos = None
+        if caminho_eventos:
+            # Acrescentado (não sobrescrito): quem acompanha o arquivo continua lendo
+            self.eventos = open(limpar_caminho(caminho_eventos), 'a', encoding='utf-8')
+            self._emitir('inicio', total=total)
+
+    @property
+    def concluidos(self):
+        return sum(self.contagens.values())
+
+    def _emitir(self, tipo, **dados):
+        evento = {'tipo': tipo, 't': round(time.time(), 3)}
+        evento.update(dados)
+        self.eventos.write(json.dumps(evento, ensure_ascii=False, default=str) + "\n")
+
+    def documento(self, indice, nome, status, arquivo=None, erro=None):
+        """Resultado de um documento: só contagem e evento; a tela segue o intervalo"""
+        self.contagens[status] += 1
+        if self.eventos:
+            self._emitir('documento', indice=indice, nome=nome, status=status, arquivo=arquivo, erro=erro)
+        self.atualizar()
+
+    def pular(self):
+        """Registro que não gera documento nesta execução (ex: já feito antes do checkpoint)"""
+        self.pulados += 1
+        self.atualizar()
+
+    def atualizar(self):
+        agora = time.monotonic()
+        if agora - self._ultima >= self.intervalo:
+            self._ultima = agora
+            self.mostrar()
+
+    def aviso(self, mensagem):
+        """Mensagem de erro/alerta; após MAX_AVISOS_CONSOLE, apenas no diário. Retorna se foi exibida"""
+        self.avisos += 1
+        if self.avisos > MAX_AVISOS_CONSOLE:
+            return False
+        self._limpar_linha()
+        print(mensagem)
+        if self.avisos == MAX_AVISOS_CONSOLE:
+            print("ⓘ Demais avisos apenas no diário e no relatório")
+        return True
+
+    def _limpar_linha(self):
+        if self.console and self._largura_linha:
+            self.saida.write("\r" + " " * self._largura_linha + "\r")
+            self._largura_linha = 0
+
+    def estado(self):
+        """Instantâneo do progresso (também enviado ao fluxo de eventos)"""
+        decorrido = time.time() - self.inicio
+        concluidos = self.concluidos
+        vazao = concluidos / decorrido if decorrido > 0 else 0.0
+        restantes = max(self.total - concluidos - self.pulados, 0)
+        return {'concluidos': concluidos + self.pulados, 'total': self.total,
+                'vazao': round(vazao, 2), 'restante_s': round(restantes / vazao, 1) if vazao else None,
+                'decorrido_s': round(decorrido, 1), 'contagens': dict(self.contagens)}
+
+    def mostrar(self, largura=30):
+        estado = self.estado()
+        atual, total = estado['concluidos'], self.total
+        percentual = min(atual / total, 1.0) if total else 1.0
+        completos = int(largura * percentual)
+        barra = '[' + '=' * completos + ' ' * (largura - completos) + ']'
+        restante = formatar_duracao(estado['restante_s']) if estado['restante_s'] is not None else '--'
+        contagens = ' · '.join(f"{status} {quantidade}" for status, quantidade in sorted(self.contagens.items()))
+        linha = (f"{barra} {atual}/{total} ({percentual:.1%}) | {estado['vazao']:.1f} docs/s | "
+                 f"restante {restante}" + (f" | {contagens}" if contagens else ""))
+        if self.console:
+            self.saida.write("\r" + linha.ljust(self._largura_linha))
+            self._largura_linha = max(self._largura_linha, len(linha))
+        else:
+            self.saida.write(linha + "\n")
+        self.saida.flush()
+        if self.eventos:
+            self._emitir('progresso', **estado)
+            self.eventos.flush()
+
+    def finalizar(self):
+        self.mostrar()
+        if self.console:
+            self.saida.write("\n")
+            self._largura_linha = 0
+        if self.eventos:
+            self._emitir('fim', **self.estado())
+            self.fechar()
+
+    def fechar(self):
+        if self.eventos:
+            try:
+                self.eventos.close()
+            except Exception:
+                pass
+            self.eventos = None
+
+# ===============================
+# DIÁRIO DE EXECUÇÃO E RELATÓRIO
+# ===============================
+
+# Limites dos resumos mantidos em memória (o restante fica apenas no diário)
+MAX_AMOSTRAS_ERROS = 20
+MAX_AMOSTRAS_FUNCIONARIOS = 5
+MAX_AMOSTRAS_AJUSTES = 20
+
+class DiarioExecucao:
+    """Diário append-only (JSON lines) com o resultado de cada documento"""
+    def __init__(self, caminho, continuar=False):
+        self.caminho = caminho
+        # Buffer por linha: cada evento chega ao disco assim que é registrado
+        self.arquivo = open(caminho, 'a' if continuar else 'w', encoding='utf-8', buffering=1)
+        self._lock = threading.Lock()
+        self.contagens = defaultdict(int)
+        self.amostras_erros = []
+        self.modelos_faltantes = {}
+        self.telemetria = None  # Recebe o resultado de cada documento (progresso/eventos)
+
+    def registrar(self, tipo, **dados):
+        """Grava um evento no diário"""
+        evento = {'tipo': tipo, 't': round(time.time(), 3)}
+        evento.update(dados)
+        linha = json.dumps(evento, ensure_ascii=False, default=str) + "\n"
+        # Eventos também chegam de threads (ex: conversão para PDF)
+        with self._lock:
+            self.arquivo.write(linha)
+
+    def registrar_documento(self, indice, nome, status, modelo=None, arquivo=None, erro=None):
+        """Grava o resultado de um registro e atualiza apenas os resumos limitados"""
+        self.registrar('documento', indice=indice, nome=nome, status=status,
+                       modelo=modelo, arquivo=arquivo, erro=erro)
+        self.contagens[status] += 1
+        if self.telemetria:
+            self.telemetria.documento(indice, nome, status, arquivo, erro)
+
+        if status == 'ok':
+            return
+
+        if len(self.amostras_erros) < MAX_AMOSTRAS_ERROS:
+            self.amostras_erros.append({'indice': indice, 'nome': nome, 'erro': erro, 'modelo': modelo})
+
+        if status == 'modelo_faltante':
+            info = self.modelos_faltantes.setdefault(modelo, {'contagem': 0, 'funcionarios': []})
+            info['contagem'] += 1
+            if len(info['funcionarios']) < MAX_AMOSTRAS_FUNCIONARIOS and nome not in info['funcionarios']:
+                info['funcionarios'].append(nome)
+
+    @property
+    def total_erros(self):
+        return sum(qtd for status, qtd in self.contagens.items() if status != 'ok')
+
+    def fechar(self):
+        try:
+            self.arquivo.close()
+        except Exception:
+            pass
+
+def ler_diario(caminho):
+    """Lê os eventos de um diário linha a linha (ignora linhas corrompidas)"""
+    with open(caminho, 'r', encoding='utf-8') as f:
+        for linha in f:
+            linha = linha.strip()
+            if not linha:
+                continue
+            try:
+                yield json.loads(linha)
+            except ValueError:
+                # Última linha pode estar incompleta após uma queda
+                continue
+
+def resumir_diarios(caminhos_diarios):
+    """Percorre os diários e monta apenas contagens e amostras limitadas"""
+    resumo = {
+        'total_registros': 0,
+        'gerados': 0,
+        'erros': 0,
+        'tempo_total': 0.0,
+        'modelos_faltantes': {},
+        'falhas_pos_processamento': 0,
+        'pdf': {'convertidos': 0, 'falhas': 0, 'tempo_soma': 0.0, 'tempo_max': 0.0,
+                'tempo_etapa': 0.0, 'reciclagens': 0, 'trabalhadores': 0, 'modo': None,
+                'persistente': None},
+        'auditoria': None,
+        'concorrencia': [],
+        'diarios': [],
+    }
+
+    for caminho in caminhos_diarios:
+        parcial = {'diario': caminho, 'fragmento': None, 'conjunto': None, 'total_registros': 0,
+                   'gerados': 0, 'erros': 0, 'tempo': 0.0, 'substituidos': set()}
+        # Diário retomado repete índices, mas só depois do checkpoint (o último 'ok'):
+        # janela guarda o último 'ok' da sessão (o checkpoint pode não ter sido gravado)
+        # e as falhas seguintes; numa retomada os eventos depois do checkpoint viram
+        # pendentes e, se o registro for refeito, a contagem anterior é desfeita
+        # (a posição do evento substituído vai para 'substituidos').
+        janela = {}
+        pendentes = {}
+        posicao = 0
+        inicio_sessao = None
+        ultimo_evento = None
+        auditoria = None
+        concorrencia = None
+        for evento in ler_diario(caminho):
+            tipo = evento.get('tipo')
+            if tipo == 'inicio':
+                auditoria = None
+                concorrencia = None
+                # Sessão anterior interrompida: contabilizar até o último evento
+                if inicio_sessao is not None and ultimo_evento is not None:
+                    parcial['tempo'] += ultimo_evento - inicio_sessao
+                inicio_sessao = evento.get('t')
+                parcial['total_registros'] = evento.get('total_registros', parcial['total_registros'])
+                retomada = evento.get('retomada')
+                pendentes = {indice: anterior for indice, anterior in {**pendentes, **janela}.items()
+                             if retomada is None or indice > retomada}
+                janela = {}
+                parcial['fragmento'] = evento.get('fragmento')
+                parcial['conjunto'] = evento.get('conjunto')
+            elif tipo == 'fim' and evento.get('total_registros') is not None:
+                # Total real (em fragmentos por hash só é conhecido ao final)
+                parcial['total_registros'] = evento['total_registros']
+            elif tipo == 'pos_processamento':
+                resumo['falhas_pos_processamento'] += 1
+            elif tipo == 'concorrencia_resumo':
+                concorrencia = evento
+            elif tipo == 'auditoria':
+                # Vale a última auditoria da sessão (ela cobre o diário inteiro)
+                auditoria = evento
+            elif tipo == 'pdf':
+                pdf = resumo['pdf']
+                pdf['convertidos' if evento.get('status') == 'ok' else 'falhas'] += 1
+                pdf['tempo_soma'] += evento.get('duracao', 0)
+                pdf['tempo_max'] = max(pdf['tempo_max'], evento.get('duracao', 0))
+            elif tipo == 'pdf_resumo':
+                pdf = resumo['pdf']
+                pdf['tempo_etapa'] += evento.get('duracao', 0)
+                pdf['reciclagens'] += evento.get('reciclagens', 0)
+                pdf['trabalhadores'] = max(pdf['trabalhadores'], evento.get('trabalhadores', 0))
+                pdf['modo'] = evento.get('modo')
+                pdf['persistente'] = evento.get('persistente')
+            elif tipo == 'documento':
+                posicao += 1
+                indice = evento.get('indice')
+                status = evento.get('status')
+                anterior = pendentes.pop(indice, None)
+                if anterior is not None:
+                    status_anterior, modelo_anterior, posicao_anterior = anterior
+                    parcial['gerados' if status_anterior == 'ok' else 'erros'] -= 1
+                    parcial['substituidos'].add(posicao_anterior)
+                    if status_anterior == 'modelo_faltante':
+                        resumo['modelos_faltantes'][modelo_anterior]['contagem'] -= 1
+                if status == 'ok':
+                    parcial['gerados'] += 1
+                    janela = {}
+                else:
+                    parcial['erros'] += 1
+                janela[indice] = (status, evento.get('modelo'), posicao)
+                if status == 'modelo_faltante':
+                    info = resumo['modelos_faltantes'].setdefault(
+                        evento.get('modelo'), {'contagem': 0, 'funcionarios': []})
+                    info['contagem'] += 1
+                    nome = evento.get('nome')
+                    if len(info['funcionarios']) < MAX_AMOSTRAS_FUNCIONARIOS and nome not in info['funcionarios']:
+                        info['funcionarios'].append(nome)
+            ultimo_evento = evento.get('t', ultimo_evento)
+
+        if inicio_sessao is not None and ultimo_evento is not None:
+            parcial['tempo'] += ultimo_evento - inicio_sessao
+        if auditoria is not None:
+            total = resumo['auditoria'] or {'arquivos': 0, 'corrompidos': 0, 'com_placeholders': 0,
+                                            'faltantes': 0, 'nao_listados': 0, 'placeholders': {},
+                                            'duracao': 0.0}
+            for chave in ('arquivos', 'corrompidos', 'com_placeholders', 'faltantes', 'nao_listados', 'duracao'):
+                total[chave] += auditoria.get(chave, 0)
+            for ph, quantidade in auditoria.get('placeholders', {}).items():
+                total['placeholders'][ph] = total['placeholders'].get(ph, 0) + quantidade
+            resumo['auditoria'] = total
+        if concorrencia is not None:
+            rotulo = parcial['conjunto'] or parcial['fragmento'] or os.path.basename(caminho)
+            resumo['concorrencia'].append((rotulo, caminho, concorrencia))
+        resumo['diarios'].append(parcial)
+        for chave in ('total_registros', 'gerados', 'erros'):
+            resumo[chave] += parcial[chave]
+
+    resumo['tempo_total'] = sum(parcial['tempo'] for parcial in resumo['diarios'])
+    # Modelos que só faltaram em sessões já refeitas com sucesso
+    resumo['modelos_faltantes'] = {modelo: info for modelo, info in resumo['modelos_faltantes'].items()
+                                   if info['contagem'] > 0}
+    return resumo
+
+def escrever_secao_concorrencia(f, concorrencias):
+    """Seção CONCORRÊNCIA ADAPTATIVA: configuração final, saturação e ajustes feitos"""
+    f.write("\n\nCONCORRÊNCIA ADAPTATIVA:\n")
+    f.write("="*50 + "\n")
+    for rotulo, caminho, conc in concorrencias:
+        if len(concorrencias) > 1:
+            f.write(f"\n{rotulo}:\n")
+        minimo, maximo = conc['limites_gravadores']
+        f.write(f"• Gravadores ao final: {conc['gravadores']} (limites {minimo}-{maximo}, "
+                f"maior valor usado {conc['maior_gravadores']})\n")
+        minimo, maximo = conc['limites_processos']
+        f.write(f"• Processos de renderização ao final: {conc['processos']} (limites {minimo}-{maximo})\n")
+        if conc.get('recriacoes_pool'):
+            f.write(f"• Pool de processos recriado entre blocos: {conc['recriacoes_pool']} vez(es)\n")
+        f.write(f"• Ajustes realizados: {conc['ajustes']}\n")
+        f.write(f"• Tempo com gravação saturada: {conc['gravacao_saturada']:.0%}\n")
+        f.write(f"• Tempo com renderização saturada: {conc['renderizacao_saturada']:.0%}\n")
+        if conc.get('ociosidade_gravadores') is not None:
+            f.write(f"• Ociosidade média dos gravadores: {conc['ociosidade_gravadores']:.0%}\n")
+        if conc.get('tempo_medio_gravacao') is not None:
+            f.write(f"• Tempo médio de gravação: {conc['tempo_medio_gravacao'] * 1000:.1f} ms/documento\n")
+
+        # Segunda passada: ajustes da última sessão
+        ajustes, inicio = [], None
+        for evento in ler_diario(caminho):
+            if evento.get('tipo') == 'inicio':
+                ajustes, inicio = [], evento.get('t')
+            elif evento.get('tipo') == 'concorrencia' and len(ajustes) < MAX_AMOSTRAS_AJUSTES:
+                ajustes.append(evento)
+        for evento in ajustes:
+            momento = evento.get('t', 0) - (inicio or evento.get('t', 0))
+            f.write(f"  - {momento:7.1f} s  {evento.get('etapa')}: {evento.get('de')} → {evento.get('para')} "
+                    f"({evento.get('motivo')})\n")
+        if conc['ajustes'] > len(ajustes):
+            f.write(f"  ... e mais {conc['ajustes'] - len(ajustes)} ajustes (detalhes no diário)\n")
+
+def gerar_relatorio(caminhos_diarios, log_path, modelos_disponiveis=(), concorrentes=False):
+    """Renderiza o relatorio_geracao.txt a partir dos diários de execução"""
+    resumo = resumir_diarios(caminhos_diarios)
+    if concorrentes and resumo['diarios']:
+        # Fragmentos executados em paralelo: vale o tempo do mais lento
+        resumo['tempo_total'] = max(parcial['tempo'] for parcial in resumo['diarios'])
+    tempo_total = resumo['tempo_total']
+
+    with open(log_path, 'w', encoding='utf-8') as f:
+        f.write("RELATÓRIO DE GERAÇÃO DE DOCUMENTOS\n")
+        f.write("="*50 + "\n\n")
+        f.write(f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
+        f.write(f"Total de registros: {resumo['total_registros']}\n")
+        f.write(f"Documentos gerados: {resumo['gerados']}\n")
+        f.write(f"Documentos com erro: {resumo['erros']}\n")
+        if resumo['falhas_pos_processamento']:
+            f.write(f"Falhas de pós-processamento: {resumo['falhas_pos_processamento']}\n")
+        f.write(f"Tempo total: {tempo_total:.1f} segundos\n")
+        if tempo_total > 0:
+            f.write(f"Velocidade média: {resumo['gerados']/tempo_total:.1f} docs/segundo\n\n")
+
+        f.write("CONFIGURAÇÃO UTILIZADA:\n")
+        f.write(f"• Pasta de modelos: {CONFIG['diretorios']['modelos']}\n")
+        f.write(f"• Arquivo de dados: {CONFIG['diretorios']['base_dados']}\n")
+        f.write(f"• Pasta de saída: {CONFIG['diretorios']['saida']}\n")
+        f.write(f"• Padrão de nome: {CONFIG['config_geral']['padrao_nome_arquivo']}\n\n")
+
+        f.write("PLACEHOLDERS UTILIZADOS:\n")
+        for ph, info in CONFIG['placeholders'].items():
+            f.write(f"- {ph}: {info['descricao']} ({info['coluna']})\n")
+
+        pdf = resumo['pdf']
+        if pdf['convertidos'] or pdf['falhas']:
+            total_pdf = pdf['convertidos'] + pdf['falhas']
+            f.write("\n\nCONVERSÃO PARA PDF:\n")
+            f.write("="*50 + "\n")
+            f.write(f"• Convertidos: {pdf['convertidos']}/{total_pdf}\n")
+            f.write(f"• Falhas: {pdf['falhas']}\n")
+            f.write(f"• Trabalhadores LibreOffice: {pdf['trabalhadores']} ({pdf['modo']})\n")
+            if pdf['persistente'] is False:
+                f.write("⚠ Sem processo persistente: cada arquivo abriu o LibreOffice "
+                        "(informe \"python\" na seção conversao_pdf)\n")
+            f.write(f"• Tempo médio por documento: {pdf['tempo_soma']/total_pdf:.2f} s\n")
+            f.write(f"• Maior tempo: {pdf['tempo_max']:.2f} s\n")
+            f.write(f"• Tempo total da etapa: {pdf['tempo_etapa']:.1f} s\n")
+            f.write(f"• Reciclagens de trabalhadores: {pdf['reciclagens']}\n")
+
+        if resumo['concorrencia']:
+            escrever_secao_concorrencia(f, resumo['concorrencia'])
+
+        if resumo['auditoria']:
+            escrever_secao_auditoria(f, resumo['auditoria'], caminhos_diarios)
+
+        if len(resumo['diarios']) > 1:
+            if any(parcial['conjunto'] for parcial in resumo['diarios']):
+                f.write("\n\nBASES DE DADOS:\n")
+            else:
+                f.write("\n\nFRAGMENTOS MESCLADOS:\n")
+            f.write("="*50 + "\n")
+            for parcial in resumo['diarios']:
+                rotulo = parcial['conjunto'] or parcial['fragmento'] or os.path.basename(parcial['diario'])
+                f.write(f"- {rotulo}: {parcial['gerados']}/{parcial['total_registros']} gerados, "
+                        f"{parcial['erros']} erros, {parcial['tempo']:.1f} s\n")
+
+        if resumo['erros']:
+            # Segunda passada: erros copiados do diário sem mantê-los em memória
+            f.write("\n\nERROS DETALHADOS:\n")
+            f.write("="*50 + "\n")
+            for parcial in resumo['diarios']:
+                substituidos = parcial['substituidos']
+                posicao = 0
+                for evento in ler_diario(parcial['diario']):
+                    if evento.get('tipo') != 'documento':
+                        continue
+                    posicao += 1
+                    # Falhas refeitas numa retomada ficam de fora
+                    if evento.get('status') == 'ok' or posicao in substituidos:
+                        continue
+                    f.write(f"\n• REGISTRO #{evento.get('indice')}\n")
+                    f.write(f"  Nome: {evento.get('nome')}\n")
+                    f.write(f"  Modelo: {evento.get('modelo') or 'Não especificado'}\n")
+                    f.write(f"  Erro: {evento.get('erro')}\n")
+                    f.write("-"*50 + "\n")
+        else:
+            f.write("\n\nNENHUM ERRO ENCONTRADO DURANTE O PROCESSAMENTO\n")
+
+        # Seção detalhada de modelos faltantes
+        modelos_faltantes = resumo['modelos_faltantes']
+        if modelos_faltantes:
+            f.write("\n\n🔍 MODELOS FALTANTES DETECTADOS:\n")
+            f.write("="*50 + "\n")
+            f.write(f"Total de modelos faltantes: {len(modelos_faltantes)}\n")
+            f.write(f"Total de ocorrências: {sum(info['contagem'] for info in modelos_faltantes.values())}\n\n")
+
+            for modelo, info in sorted(modelos_faltantes.items(), key=lambda item: -item[1]['contagem']):
+                f.write(f"\n• MODELO: {modelo}\n")
+                f.write(f"  Ocorrências: {info['contagem']}\n")
+                f.write(f"  Funcionários afetados (amostra de {len(info['funcionarios'])}):\n")
+                for func in info['funcionarios']:
+                    f.write(f"    - {func}\n")
+                if info['contagem'] > len(info['funcionarios']):
+                    f.write(f"    ... e mais {info['contagem'] - len(info['funcionarios'])} ocorrências\n")
+                f.write("-"*50 + "\n")
+
+            f.write("\nMODELOS DISPONÍVEIS NA PASTA:\n")
+            f.write("="*50 + "\n")
+            for modelo in modelos_disponiveis:
+                f.write(f"- {modelo}\n")
+
+    return resumo
+
+def gerar_manifesto(caminhos_diarios, caminho_csv, bases=None):
+    """Gera o manifesto CSV dos documentos gerados, ordenado pelo índice do registro.
+
+    Com `bases` (um nome por diário) o manifesto ganha a coluna 'base' e
+    lista uma base após a outra, já que bases diferentes repetem índices.
+    """
+    def documentos_gerados(caminho):
+        # Registros refeitos após uma retomada aparecem em sequência: vale o último
+        anterior = None
+        for evento in ler_diario(caminho):
+            if evento.get('tipo') == 'documento' and evento.get('status') == 'ok':
+                linha = (evento['indice'], evento.get('nome'), evento.get('modelo'), evento.get('arquivo'))
+                if anterior is not None and anterior[0] != linha[0]:
+                    yield anterior
+                anterior = linha
+        if anterior is not None:
+            yield anterior
+
+    total = 0
+    with open(caminho_csv, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        if bases is None:
+            writer.writerow(['indice', 'nome', 'modelo', 'arquivo'])
+            # Cada diário já está em ordem crescente: intercalação sem carregar tudo
+            linhas = heapq.merge(*(documentos_gerados(c) for c in caminhos_diarios), key=lambda l: l[0])
+        else:
+            writer.writerow(['base', 'indice', 'nome', 'modelo', 'arquivo'])
+            linhas = ((base,) + linha for base, caminho in zip(bases, caminhos_diarios)
+                      for linha in documentos_gerados(caminho))
+        for linha in linhas:
+            writer.writerow(linha)
+            total += 1
+    return total
+
+# ===============================
+# AUDITORIA DOS DOCUMENTOS GERADOS
+# ===============================
+# Depois da geração, cada .docx é aberto como zip (sem Word): o CRC de todas
+# as partes é conferido e o texto de cada parágrafo do corpo, cabeçalhos e
+# rodapés é remontado (placeholders quebrados entre runs também aparecem).
+# Os arquivos são auditados em paralelo e o resultado vai para o diário.
+# CONFIG['auditoria'] = {"ativo": false, "processos": null}
+
+PARTES_TEXTO_DOCX = re.compile(r'word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$')
+MAX_AMOSTRAS_AUDITORIA = 50
+
+_padroes_auditoria = {}
+
+def padrao_placeholders(placeholders):
+    """Regex única com todos os placeholders (os mais longos primeiro)"""
+    padrao = _padroes_auditoria.get(placeholders)
+    if padrao is None:
+        ordenados = sorted(placeholders, key=len, reverse=True)
+        padrao = re.compile('|'.join(re.escape(ph) for ph in ordenados)) if ordenados else None
+        _padroes_auditoria[placeholders] = padrao
+    return padrao
+
+def auditar_arquivo(caminho, placeholders=()):
+    """Confere integridade e placeholders restantes de um .docx; retorna o resultado"""
+    padrao = padrao_placeholders(tuple(placeholders))
+    restantes = defaultdict(int)
+    tag_paragrafo, tag_texto = qn('w:p'), qn('w:t')
+    try:
+        with zipfile.ZipFile(caminho) as pacote:
+            if 'word/document.xml' not in pacote.namelist():
+                return {'arquivo': caminho, 'status': 'corrompido', 'erro': "word/document.xml ausente"}
+            for info in pacote.infolist():
+                # Ler cada parte até o fim faz o zipfile conferir o CRC
+                with pacote.open(info) as parte:
+                    if padrao is not None and PARTES_TEXTO_DOCX.match(info.filename):
+                        for _, paragrafo in etree.iterparse(parte, events=('end',), tag=tag_paragrafo):
+                            texto = ''.join(t.text or '' for t in paragrafo.iter(tag_texto))
+                            for encontrado in padrao.findall(texto):
+                                restantes[encontrado] += 1
+                            paragrafo.clear()
+                    while parte.read(1024 * 1024):
+                        pass
+    except (zipfile.BadZipFile, zlib.error, etree.XMLSyntaxError, EOFError, OSError, ValueError) as e:
+        return {'arquivo': caminho, 'status': 'corrompido', 'erro': str(e) or type(e).__name__}
+    if restantes:
+        return {'arquivo': caminho, 'status': 'placeholders', 'restantes': dict(restantes)}
+    return {'arquivo': caminho, 'status': 'ok'}
+
+def placeholders_auditados():
+    """Placeholders da configuração (e o marcador de repetição) que não podem sobrar"""
+    placeholders = list(CONFIG.get('placeholders', {}))
+    agrupamento = CONFIG.get('agrupamento', {})
+    if agrupamento.get('ativo'):
+        placeholders.append(agrupamento.get('marcador') or '[REPETIR]')
+    return tuple(placeholders)
+
+def auditar_documentos(arquivos, placeholders, processos=None):
+    """Audita os arquivos em paralelo; gera os resultados na ordem recebida"""
+    processos = processos or CONFIG.get('auditoria', {}).get('processos') or os.cpu_count() or 1
+    auditar = functools.partial(auditar_arquivo, placeholders=placeholders)
+    if processos <= 1 or len(arquivos) < 2 * processos:
+        yield from map(auditar, arquivos)
+        return
+    # Lotes grandes por tarefa: o custo de envio não domina com 100 mil arquivos
+    lote = max(1, min(256, len(arquivos) // (processos * 4)))
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        yield from executor.map(auditar, arquivos, chunksize=lote)
+
+def executar_auditoria(arquivos, diario, faltantes=(), nao_listados=(), processos=None):
+    """Audita os arquivos e grava no diário um evento por problema e o resumo"""
+    inicio = time.time()
+    contagens = defaultdict(int)
+    por_placeholder = defaultdict(int)
+    for resultado in auditar_documentos(arquivos, placeholders_auditados(), processos):
+        contagens[resultado['status']] += 1
+        if resultado['status'] == 'ok':
+            continue
+        diario.registrar('auditoria_problema', **resultado)
+        for ph, quantidade in resultado.get('restantes', {}).items():
+            por_placeholder[ph] += quantidade
+    for caminho in faltantes:
+        diario.registrar('auditoria_problema', arquivo=caminho, status='faltante')
+    for caminho in nao_listados:
+        diario.registrar('auditoria_problema', arquivo=caminho, status='nao_listado')
+
+    auditoria = {'arquivos': len(arquivos), 'corrompidos': contagens['corrompido'],
+                 'com_placeholders': contagens['placeholders'], 'faltantes': len(faltantes),
+                 'nao_listados': len(nao_listados), 'placeholders': dict(por_placeholder),
+                 'duracao': round(time.time() - inicio, 3)}
+    diario.registrar('auditoria', **auditoria)
+    return auditoria
+
+def auditar_geracao(diario, caminho_diario, processos=None):
+    """Audita os arquivos registrados como gerados no diário da execução"""
+    gerados = []
+    vistos = set()
+    for evento in ler_diario(caminho_diario):
+        arquivo = evento.get('arquivo')
+        if evento.get('tipo') == 'documento' and evento.get('status') == 'ok' and arquivo and arquivo not in vistos:
+            vistos.add(arquivo)
+            gerados.append(arquivo)
+    presentes = [caminho for caminho in gerados if os.path.exists(caminho)]
+    faltantes = [caminho for caminho in gerados if not os.path.exists(caminho)]
+    return executar_auditoria(presentes, diario, faltantes=faltantes, processos=processos)
+
+def mostrar_auditoria(auditoria):
+    problemas = auditoria['corrompidos'] + auditoria['com_placeholders'] + auditoria['faltantes']
+    print(f"✓ Auditoria: {auditoria['arquivos']} arquivos em {auditoria['duracao']:.1f} s, "
+          f"{problemas} com problema")
+    if auditoria['corrompidos']:
+        print(f"  ⚠ Corrompidos: {auditoria['corrompidos']}")
+    if auditoria['com_placeholders']:
+        print(f"  ⚠ Com placeholders não substituídos: {auditoria['com_placeholders']}")
+    if auditoria['faltantes']:
+        print(f"  ⚠ No manifesto, mas ausentes no disco: {auditoria['faltantes']}")
+    if auditoria['nao_listados']:
+        print(f"  ⓘ No disco, mas fora do manifesto: {auditoria['nao_listados']}")
+
+def escrever_secao_auditoria(f, auditoria, caminhos_diarios):
+    """Seção AUDITORIA do relatório (amostras lidas dos diários)"""
+    f.write("\n\nAUDITORIA DOS DOCUMENTOS:\n")
+    f.write("="*50 + "\n")
+    f.write(f"• Arquivos auditados: {auditoria['arquivos']}\n")
+    f.write(f"• Corrompidos: {auditoria['corrompidos']}\n")
+    f.write(f"• Com placeholders não substituídos: {auditoria['com_placeholders']}\n")
+    f.write(f"• No manifesto, mas ausentes no disco: {auditoria['faltantes']}\n")
+    if auditoria['nao_listados']:
+        f.write(f"• No disco, mas fora do manifesto: {auditoria['nao_listados']}\n")
+    f.write(f"• Tempo da auditoria: {auditoria['duracao']:.1f} s\n")
+    for ph, quantidade in sorted(auditoria['placeholders'].items(), key=lambda item: -item[1]):
+        f.write(f"  - {ph}: {quantidade} ocorrências restantes\n")
+
+    # Apenas os problemas da última auditoria de cada diário
+    amostras = 0
+    for caminho in caminhos_diarios:
+        problemas = []
+        for evento in ler_diario(caminho):
+            if evento.get('tipo') == 'inicio':
+                problemas = []
+            elif evento.get('tipo') == 'auditoria_problema' and len(problemas) < MAX_AMOSTRAS_AUDITORIA:
+                problemas.append(evento)
+        for evento in problemas[:MAX_AMOSTRAS_AUDITORIA - amostras]:
+            detalhe = evento.get('erro') or ', '.join(f"{ph} ({n}x)" for ph, n in evento.get('restantes', {}).items())
+            f.write(f"  [{evento.get('status')}] {evento.get('arquivo')}" + (f": {detalhe}" if detalhe else "") + "\n")
+            amostras += 1
+    total = auditoria['corrompidos'] + auditoria['com_placeholders'] + auditoria['faltantes'] + auditoria['nao_listados']
+    if total > amostras:
+        f.write(f"  ... e mais {total - amostras} arquivos (detalhes no diário)\n")
+
+def ler_manifestos(pasta):
+    """Arquivos listados nos manifestos da pasta (None se não houver manifesto)"""
+    manifestos = glob.glob(os.path.join(pasta, '**', 'manifesto_*.csv'), recursive=True)
+    if not manifestos:
+        return None
+    esperados = set()
+    for caminho in manifestos:
+        with open(caminho, 'r', encoding='utf-8', newline='') as f:
+            for linha in csv.DictReader(f, delimiter=';'):
+                if linha.get('arquivo'):
+                    esperados.add(os.path.normcase(os.path.abspath(linha['arquivo'])))
+    return esperados
+
+def auditar_pasta(pasta=None, processos=None):
+    """Audita todos os .docx de uma pasta e compara com os manifestos; retorna o resumo"""
+    pasta = pasta or limpar_caminho(CONFIG.get('diretorios', {}).get('saida', ''))
+    if not pasta or not os.path.isdir(pasta):
+        print(f"❌ Pasta não encontrada: {pasta}")
+        return None
+    arquivos = [os.path.join(raiz, nome) for raiz, _, nomes in os.walk(pasta)
+                for nome in nomes if nome.lower().endswith('.docx') and not nome.startswith('~$')]
+    faltantes, nao_listados = [], []
+    esperados = ler_manifestos(pasta)
+    if esperados is not None:
+        presentes = {os.path.normcase(os.path.abspath(caminho)): caminho for caminho in arquivos}
+        faltantes = sorted(esperados - presentes.keys())
+        nao_listados = sorted(presentes[chave] for chave in presentes.keys() - esperados)
+
+    caminho_diario = os.path.join(pasta, 'diario_auditoria.jsonl')
+    diario = DiarioExecucao(caminho_diario)
+    print(f"🔎 Auditando {len(arquivos)} documentos em {pasta}...")
+    auditoria = executar_auditoria(arquivos, diario, faltantes, nao_listados, processos)
+    diario.fechar()
+    mostrar_auditoria(auditoria)
+
+    log_path = os.path.join(pasta, 'relatorio_auditoria.txt')
+    with open(log_path, 'w', encoding='utf-8') as f:
+        f.write("RELATÓRIO DE AUDITORIA DOS DOCUMENTOS\n")
+        f.write("="*50 + "\n\n")
+        f.write(f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
+        f.write(f"Pasta: {pasta}\n")
+        if esperados is None:
+            f.write("Nenhum manifesto encontrado: contagem de arquivos não conferida\n")
+        else:
+            f.write(f"Arquivos no manifesto: {len(esperados)} | no disco: {len(arquivos)}\n")
+        escrever_secao_auditoria(f, auditoria, [caminho_diario])
+    print(f"📝 Relatório da auditoria: {log_path}")
+    return auditoria
+
+# ===============================
+# SIMULAÇÃO (ESTIMATIVA SEM GERAR DOCUMENTOS)
+# ===============================
+# --simular (ou "Simular processamento" no menu) faz a mesma leitura,
+# validação, escolha de modelos e definição de nomes/pastas de uma execução
+# real, mas não grava documentos: renderiza em memória uma amostra de cada
+# modelo para medir tempo e tamanho e projeta a duração total e o espaço em
+# disco por pasta de organização (relatorio_simulacao.txt na pasta de saída).
+# CONFIG['simulacao'] = {"amostra_por_modelo": 5}
+
+TAMANHO_CLUSTER = 4096  # Espaço ocupado em disco é arredondado para o cluster
+LIMITE_CAMINHO_WINDOWS = 260
+MAX_PASTAS_RELATORIO = 50
+
+def formatar_bytes(quantidade):
+    for unidade in ('B', 'KB', 'MB', 'GB'):
+        if quantidade < 1024:
+            return f"{quantidade:.0f} {unidade}" if unidade == 'B' else f"{quantidade:.1f} {unidade}"
+        quantidade /= 1024
+    return f"{quantidade:.1f} TB"
+
+def formatar_duracao(segundos):
+    horas, resto = divmod(int(round(segundos)), 3600)
+    minutos, segundos = divmod(resto, 60)
+    return f"{horas}h{minutos:02d}min" if horas else f"{minutos}min{segundos:02d}s"
+
+def planejar_execucao(registros, modelos, indice_modelos, falhas_modelos, saida_path, cabecalhos,
+                      amostra_por_modelo):
+    """Percorre todos os registros sem gerar nada: modelos, pastas, nomes e amostras"""
+    plano = {'registros': 0, 'documentos': 0, 'por_modelo': defaultdict(int),
+             'por_pasta': defaultdict(lambda: defaultdict(int)), 'modelos_faltantes': defaultdict(int),
+             'modelos_nao_convertidos': 0, 'colisoes': 0, 'exemplos_colisoes': [],
+             'caminhos_longos': 0, 'amostras': defaultdict(list)}
+    destinos = set()
+    sorteio = random.Random(0)  # Amostra reproduzível entre simulações
+    for idx, registro, subs, linhas in registros:
+        plano['registros'] += 1
+        modelo_path, nome_modelo = selecionar_modelo(registro, modelos, indice_modelos)
+        if not modelo_path:
+            plano['modelos_faltantes'][nome_modelo] += 1
+            continue
+        if modelo_path in falhas_modelos:
+            plano['modelos_nao_convertidos'] += 1
+            continue
+
+        pasta = resolver_pasta_saida(registro, saida_path, None)
+        caminho = os.path.join(pasta, gerar_nome_arquivo(registro, idx, cabecalhos))
+        chave = os.path.normcase(caminho)
+        if chave in destinos:
+            # Mesmo nome para registros diferentes: a execução real sobrescreveria o arquivo
+            plano['colisoes'] += 1
+            if len(plano['exemplos_colisoes']) < MAX_AMOSTRAS_ERROS:
+                plano['exemplos_colisoes'].append(caminho)
+        destinos.add(chave)
+        if len(os.path.abspath(caminho)) >= LIMITE_CAMINHO_WINDOWS:
+            plano['caminhos_longos'] += 1
+
+        plano['documentos'] += 1
+        plano['por_modelo'][modelo_path] += 1
+        plano['por_pasta'][pasta][modelo_path] += 1
+        contagem = plano['por_modelo'][modelo_path]
+
+        # Amostragem por reservatório: cada registro do modelo tem a mesma chance
+        amostras = plano['amostras'][modelo_path]
+        if len(amostras) < amostra_por_modelo:
+            amostras.append((subs, linhas))
+        else:
+            sorteado = sorteio.randrange(contagem)
+            if sorteado < amostra_por_modelo:
+                amostras[sorteado] = (subs, linhas)
+    return plano
+
+def medir_amostras(amostras, saida_path):
+    """Renderiza as amostras em memória; mede tempo e tamanho por modelo e a gravação na saída"""
+    medidas = {}
+    tempos_gravacao = []
+    for modelo_path, lista in amostras.items():
+        medida = {'amostras': 0, 'tempo': 0.0, 'bytes': 0, 'maior': 0, 'carga': 0.0, 'erros': []}
+        for posicao, (subs, linhas) in enumerate(lista):
+            inicio = time.perf_counter()
+            try:
+                dados = renderizar_documento(modelo_path, subs, linhas=linhas)
+            except Exception as e:
+                medida['erros'].append(str(e))
+                continue
+            duracao = time.perf_counter() - inicio
+            if posicao == 0 and len(lista) > 1:
+                # Primeira renderização inclui a leitura do modelo (feita uma vez por execução)
+                medida['carga'] = duracao
+                continue
+            medida['amostras'] += 1
+            medida['tempo'] += duracao
+            medida['bytes'] += len(dados)
+            medida['maior'] = max(medida['maior'], len(dados))
+
+            # Gravação real na pasta de saída (ex: compartilhamento de rede), apagada em seguida
+            try:
+                descritor, temporario = tempfile.mkstemp(suffix='.tmp', dir=saida_path)
+                inicio = time.perf_counter()
+                with os.fdopen(descritor, 'wb') as f:
+                    f.write(dados)
+                tempos_gravacao.append(time.perf_counter() - inicio)
+                os.remove(temporario)
+            except OSError:
+                pass
+        if medida['amostras']:
+            medida['tempo'] /= medida['amostras']
+            medida['bytes'] /= medida['amostras']
+        medidas[modelo_path] = medida
+    tempo_gravacao = sum(tempos_gravacao) / len(tempos_gravacao) if tempos_gravacao else 0.0
+    return medidas, tempo_gravacao
+
+def estimar_execucao(registros, modelos, indice_modelos, falhas_modelos, saida_path, cabecalhos,
+                     processos=1, sufixo='', combinado=False):
+    """Simulação completa: planeja, mede a amostra, projeta e grava relatorio_simulacao.txt"""
+    opcoes = CONFIG.get('simulacao', {})
+    amostra_por_modelo = max(2, int(opcoes.get('amostra_por_modelo', 5)))
+    # A pasta de saída recebe o relatório e a medição de gravação: criada antes do trabalho pesado
+    os.makedirs(saida_path, exist_ok=True)
+
+    print("\n🧪 Simulação: planejando a execução (nenhum documento será gravado)...")
+    inicio = time.time()
+    plano = planejar_execucao(registros, modelos, indice_modelos, falhas_modelos, saida_path,
+                              cabecalhos, amostra_por_modelo)
+    tempo_planejamento = time.time() - inicio
+    print(f"✓ {plano['registros']} registros planejados em {tempo_planejamento:.1f} s")
+
+    print(f"⏳ Renderizando amostra (até {amostra_por_modelo} documentos por modelo)...")
+    medidas, tempo_gravacao = medir_amostras(plano['amostras'], saida_path)
+
+    # Projeções: custo médio de cada modelo multiplicado pelo número de documentos dele
+    efetivos = max(1, min(processos, os.cpu_count() or 1))
+    tempo_renderizacao = sum(quantidade * medidas[modelo]['tempo'] + medidas[modelo]['carga']
+                             for modelo, quantidade in plano['por_modelo'].items())
+    tempo_total = tempo_planejamento + (tempo_renderizacao + plano['documentos'] * tempo_gravacao) / efetivos
+
+    pastas = []
+    for pasta, por_modelo in plano['por_pasta'].items():
+        tamanho = sum(quantidade * medidas[modelo]['bytes'] for modelo, quantidade in por_modelo.items())
+        disco = sum(quantidade * -(-int(medidas[modelo]['bytes']) // TAMANHO_CLUSTER) * TAMANHO_CLUSTER
+                    for modelo, quantidade in por_modelo.items())
+        pastas.append((pasta, sum(por_modelo.values()), tamanho, disco))
+    pastas.sort(key=lambda item: -item[3])
+    tamanho_total = sum(item[2] for item in pastas)
+    disco_total = sum(item[3] for item in pastas)
+    try:
+        livre = shutil.disk_usage(saida_path).free
+    except OSError:
+        livre = None
+
+    erros_amostra = sum(len(medida['erros']) for medida in medidas.values())
+    estimativa = {
+        'registros': plano['registros'],
+        'documentos': plano['documentos'],
+        'erros': sum(plano['modelos_faltantes'].values()) + plano['modelos_nao_convertidos'],
+        'colisoes': plano['colisoes'],
+        'caminhos_longos': plano['caminhos_longos'],
+        'erros_amostra': erros_amostra,
+        'tempo_estimado': tempo_total,
+        'tamanho_estimado': tamanho_total,
+        'disco_estimado': disco_total,
+        'espaco_livre': livre,
+    }
+
+    print("\n" + "="*50)
+    print("🧪 ESTIMATIVA DA EXECUÇÃO")
+    print("="*50)
+    print(f"• Documentos a gerar: {plano['documentos']} de {plano['registros']} registros")
+    print(f"• Tempo estimado: {formatar_duracao(tempo_total)} ({efetivos} processo(s))")
+    print(f"• Tamanho estimado: {formatar_bytes(tamanho_total)} ({formatar_bytes(disco_total)} em disco)")
+    if livre is not None and disco_total > livre:
+        print(f"⚠ Espaço livre insuficiente na saída: {formatar_bytes(livre)}")
+    if estimativa['erros']:
+        print(f"⚠ Registros sem modelo utilizável: {estimativa['erros']}")
+    if plano['colisoes']:
+        print(f"⚠ Nomes de arquivo repetidos (seriam sobrescritos): {plano['colisoes']}")
+    if plano['caminhos_longos']:
+        print(f"⚠ Caminhos com {LIMITE_CAMINHO_WINDOWS}+ caracteres: {plano['caminhos_longos']}")
+    if erros_amostra:
+        print(f"⚠ Falhas ao renderizar a amostra: {erros_amostra}")
+
+    log_path = os.path.join(saida_path, f"relatorio_simulacao{sufixo}.txt")
+    with open(log_path, 'w', encoding='utf-8') as f:
+        f.write("RELATÓRIO DE SIMULAÇÃO (NENHUM DOCUMENTO GERADO)\n")
+        f.write("="*50 + "\n\n")
+        f.write(f"Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
+        f.write(f"Total de registros: {plano['registros']}\n")
+        f.write(f"Documentos a gerar: {plano['documentos']}\n")
+        f.write(f"Registros sem modelo utilizável: {estimativa['erros']}\n")
+        f.write(f"Tempo estimado: {formatar_duracao(tempo_total)} "
+                f"(leitura e planejamento: {tempo_planejamento:.1f} s; {efetivos} processo(s))\n")
+        f.write(f"Tamanho estimado: {formatar_bytes(tamanho_total)}\n")
+        f.write(f"Espaço em disco estimado: {formatar_bytes(disco_total)}\n")
+        if livre is not None:
+            f.write(f"Espaço livre na saída: {formatar_bytes(livre)}\n")
+        if combinado:
+            f.write("ⓘ Saída combinada: estimativa calculada como um arquivo por registro\n")
+
+        f.write("\n\nCUSTO POR MODELO (AMOSTRA):\n")
+        f.write("="*50 + "\n")
+        for modelo, quantidade in sorted(plano['por_modelo'].items(), key=lambda item: -item[1]):
+            medida = medidas[modelo]
+            f.write(f"• {os.path.basename(modelo)}: {quantidade} documentos, "
+                    f"{medida['tempo'] * 1000:.1f} ms/documento, {formatar_bytes(medida['bytes'])} em média "
+                    f"(maior {formatar_bytes(medida['maior'])}; {medida['amostras']} amostras)\n")
+            for erro in medida['erros'][:3]:
+                f.write(f"  ⚠ Falha na amostra: {erro}\n")
+        f.write(f"• Gravação na pasta de saída: {tempo_gravacao * 1000:.1f} ms/documento\n")
+
+        f.write("\n\nESPAÇO POR PASTA:\n")
+        f.write("="*50 + "\n")
+        for pasta, quantidade, tamanho, disco in pastas[:MAX_PASTAS_RELATORIO]:
+            f.write(f"- {pasta}: {quantidade} documentos, {formatar_bytes(tamanho)} "
+                    f"({formatar_bytes(disco)} em disco)\n")
+        if len(pastas) > MAX_PASTAS_RELATORIO:
+            f.write(f"... e mais {len(pastas) - MAX_PASTAS_RELATORIO} pastas\n")
+
+        if plano['modelos_faltantes'] or plano['colisoes'] or plano['caminhos_longos']:
+            f.write("\n\nPROBLEMAS ENCONTRADOS:\n")
+            f.write("="*50 + "\n")
+            for nome, quantidade in sorted(plano['modelos_faltantes'].items(), key=lambda item: -item[1]):
+                f.write(f"• Modelo não encontrado '{nome}': {quantidade} registros\n")
+            if plano['modelos_nao_convertidos']:
+                f.write(f"• Modelos .doc não convertidos: {plano['modelos_nao_convertidos']} registros\n")
+            if plano['colisoes']:
+                f.write(f"• Nomes de arquivo repetidos: {plano['colisoes']} (ex: {', '.join(plano['exemplos_colisoes'][:5])})\n")
+            if plano['caminhos_longos']:
+                f.write(f"• Caminhos com {LIMITE_CAMINHO_WINDOWS}+ caracteres: {plano['caminhos_longos']}\n")
+    print(f"\n📝 Relatório da simulação: {log_path}")
+    return estimativa
+
+# ===============================
+# FRAGMENTAÇÃO (SHARDING) ENTRE MÁQUINAS
+# ===============================
+
+def interpretar_fragmento(texto):
+    """Converte 'i/N' (i de 1 a N) em uma tupla (i, N)"""
+    try:
+        i, n = (int(parte) for parte in texto.split('/'))
+    except (ValueError, AttributeError):
+        raise ValueError(f"Fragmento inválido: '{texto}' (use o formato i/N, ex: 1/4)")
+    if n < 1 or not 1 <= i <= n:
+        raise ValueError(f"Fragmento inválido: '{texto}' (i deve estar entre 1 e N)")
+    return i, n
+
+def sufixo_fragmento(fragmento):
+    """Sufixo usado nos arquivos de checkpoint, diário e relatório de cada fragmento"""
+    if not fragmento:
+        return ''
+    return f"_fragmento_{fragmento[0]}de{fragmento[1]}"
+
+def mascara_fragmento(df, fragmento, modo='hash', coluna_chave=None, inicio=0, total=None):
+    """Seleciona de forma determinística as linhas pertencentes ao fragmento.
+
+    `inicio` é a posição da primeira linha do bloco na base e `total` o
+    número de linhas da base inteira (necessário no modo faixa).
+    """
+    i, n = fragmento
+    total = len(df) if total is None else total
+    posicoes = pd.Series(range(inicio, inicio + len(df)), index=df.index)
+
+    if modo == 'faixa':
+        # Blocos contíguos de linhas: fragmento i recebe [inicio, fim)
+        inicio = (i - 1) * total // n
+        fim = i * total // n
+        return (posicoes >= inicio) & (posicoes < fim)
+
+    # Hash estável (crc32) da coluna chave ou da posição da linha. A chave é
+    # normalizada como em agrupar_registros: um grupo nunca fica dividido entre fragmentos.
+    if coluna_chave:
+        chaves = df[coluna_chave].map(formatar_valor).str.strip()
+    else:
+        chaves = posicoes.astype(str)
+    hashes = chaves.map(lambda valor: zlib.crc32(valor.encode('utf-8')))
+    return (hashes % n) == (i - 1)
+
+def fragmento_do_diario(caminho):
+    """(i, N, modo) do fragmento que gravou o diário (evento 'inicio'; senão, o nome do arquivo)"""
+    for evento in ler_diario(caminho):
+        if evento.get('tipo') == 'inicio' and evento.get('fragmento'):
+            i, n = (int(parte) for parte in evento['fragmento'].split('/'))
+            return i, n, evento.get('modo_fragmento')
+    encontrado = re.search(r'_fragmento_(\d+)de(\d+)\.jsonl$', caminho)
+    return (int(encontrado.group(1)), int(encontrado.group(2)), None) if encontrado else (None, None, None)
+
+def mesclar_fragmentos(saida_path=None):
+    """Combina diários de todos os fragmentos em um único relatório e manifesto"""
+    saida_path = saida_path or limpar_caminho(CONFIG['diretorios']['saida'])
+    diarios = sorted(glob.glob(os.path.join(saida_path, 'diario_geracao_fragmento_*.jsonl')))
+    if not diarios:
+        print(f"❌ Nenhum diário de fragmento encontrado em: {saida_path}")
+        return None
+
+    # Só diários de uma mesma divisão (mesmo N e modo): sobras de uma divisão
+    # anterior contariam os mesmos registros duas vezes
+    fragmentos = {caminho: fragmento_do_diario(caminho) for caminho in diarios}
+    totais = {n for _, n, _ in fragmentos.values()}
+    modos = {modo for _, _, modo in fragmentos.values() if modo}
+    if len(totais) > 1 or len(modos) > 1:
+        print("❌ Diários de divisões diferentes na pasta de saída (remova os que não fazem parte da execução):")
+        for caminho, (i, n, modo) in fragmentos.items():
+            print(f"  • {os.path.basename(caminho)}: fragmento {i}/{n}" + (f" ({modo})" if modo else ""))
+        return None
+    total = totais.pop()
+    faltantes = sorted(set(range(1, (total or 0) + 1)) - {i for i, _, _ in fragmentos.values()})
+    if faltantes:
+        print(f"⚠ Fragmentos sem diário (ainda não executados?): {', '.join(f'{i}/{total}' for i in faltantes)}")
+
+    print(f"🔗 Mesclando {len(diarios)} fragmentos...")
+    for caminho in diarios:
+        print(f"  • {os.path.basename(caminho)}")
+
+    modelos_disponiveis = []
+    caminho_modelos = limpar_caminho(CONFIG.get('diretorios', {}).get('modelos', ''))
+    if caminho_modelos and os.path.isdir(caminho_modelos):
+        modelos_disponiveis = [os.path.basename(m) for m in listar_modelos(caminho_modelos)]
+
+    log_path = os.path.join(saida_path, "relatorio_geracao.txt")
+    resumo = gerar_relatorio(diarios, log_path, modelos_disponiveis, concorrentes=True)
+    manifesto_path = os.path.join(saida_path, "manifesto_geracao.csv")
+    total_manifesto = gerar_manifesto(diarios, manifesto_path)
+
+    print(f"✓ Documentos gerados: {resumo['gerados']}/{resumo['total_registros']}")
+    print(f"✓ Erros: {resumo['erros']}")
+    print(f"📝 Relatório mesclado salvo em: {log_path}")
+    print(f"🧾 Manifesto ({total_manifesto} documentos): {manifesto_path}")
+    return resumo
+
+def carregar_modelos(interativo=True):
+    """Lista, converte (.doc) e indexa os modelos; retorna (modelos, índice, falhas) ou None"""
+    # Verificar modelos
+    caminho_modelos = limpar_caminho(CONFIG['diretorios']['modelos'])
+    print(f"🔍 Verificando acesso ao diretório de modelos: {caminho_modelos}")
+
+    # Verificar permissões
+    if not os.access(caminho_modelos, os.R_OK):
+        print(f"❌ Sem permissão de leitura no diretório: {caminho_modelos}")
+        pausar("\nPressione Enter para voltar...", interativo)
+        return None
+
+    print(f"\n🔍 Procurando modelos em: {caminho_modelos}")
+    modelos = listar_modelos(caminho_modelos)
+    for modelo_path in modelos:
+        print(f"  ✅ Encontrado: {os.path.basename(modelo_path)}")
+
+    if not modelos:
+        print("❌ Nenhum modelo Word encontrado!")
+        pausar("\nPressione Enter para voltar...", interativo)
+        return None
+
+    print(f"✓ {len(modelos)} modelos encontrados")
+
+    # Converter modelos .doc antes de começar (cache reaproveitado entre execuções)
+    falhas_modelos = preparar_modelos_legados(modelos)
+
+    # Criar estruturas para busca eficiente de modelos
+    indice_modelos = indexar_modelos(modelos)
+
+    # Se for caminho de rede, tentar mapear unidade (apenas para Windows)
+    if caminho_modelos.startswith('\\\\'):
+        print("ⓘ Caminho de rede detectado, ativando compatibilidade...")
+        # Tenta mapear a unidade de rede (apenas Windows)
+        try:
+            drive_letter = 'Z:'  # Pode ser necessário escolher uma letra livre
+            os.system(f'net use {drive_letter} {caminho_modelos} /persistent:yes > nul 2>&1')
+            caminho_modelos = drive_letter + '\\'
+            print(f"✓ Caminho de rede mapeado para {drive_letter}")
+        except:
+            print("⚠ Não foi possível mapear o caminho de rede. Continuando...")
+
+    return modelos, indice_modelos, falhas_modelos
+
+def processar_documentos(interativo=True, fragmento=None, modo_fragmento='hash', coluna_fragmento=None,
+                         modo_combinado=None, converter_pdf=None, coluna_grupo=None, trabalho=None,
+                         processos=None, auditar=None, adaptativo=None, simular=False, eventos=None):
+    """Gera os documentos; com fragmento=(i, N) processa apenas a fatia i de N.
+
+    modo_combinado ("unico" ou "por_categoria") gera documentos combinados
+    em vez de um arquivo por registro (padrão: CONFIG['saida_combinada']).
+    converter_pdf liga a conversão para PDF (padrão: CONFIG['conversao_pdf']).
+    coluna_grupo gera um documento por grupo (padrão: CONFIG['agrupamento']).
+    trabalho (executor de planos) traz recursos já prontos e compartilhados:
+    "nome", "fonte" (base já aberta), "saida", "modelos", "pool_pdf" e
+    "renderizador" (criado na primeira base e mantido aberto para as seguintes).
+    processos > 1 renderiza em processos paralelos (padrão: config_geral.processos).
+    auditar confere os arquivos gravados ao final (padrão: CONFIG['auditoria']).
+    adaptativo grava em threads e ajusta os pools durante a execução
+    (padrão: CONFIG['concorrencia']['adaptativa']).
+    simular faz toda a preparação sem gravar documentos e estima tempo e espaço.
+    eventos grava os eventos de cada documento em JSON lines (padrão: CONFIG['telemetria']).
+    """
+    resumo = None
+    trabalho = trabalho or {}
+    try:
+        print("\n" + "="*60)
+        print("🚀 INICIANDO PROCESSAMENTO DE DOCUMENTOS")
+        print("="*60)
+        
+        # Verificar configuração mínima
+        if not CONFIG['placeholders']:
+            print("❌ Nenhum placeholder configurado! Execute a configuração primeiro.")
+            pausar("\nPressione Enter para voltar...", interativo)
+            return
+            
+        CACHE_IMAGENS.limite_bytes = int(CONFIG.get('imagens', {}).get('limite_cache_mb', 64)) * 1024 * 1024
+        
+        # Agrupamento: um documento por titular, com as linhas dos dependentes
+        agrupamento = configurar_agrupamento(coluna_grupo)
+        if agrupamento and fragmento:
+            # Membros de um grupo precisam cair no mesmo fragmento
+            if modo_fragmento != 'hash' or (coluna_fragmento and coluna_fragmento != agrupamento['coluna']):
+                print(f"ⓘ Agrupamento ativo: fragmentação por hash da coluna '{agrupamento['coluna']}'")
+            modo_fragmento, coluna_fragmento = 'hash', agrupamento['coluna']
+        
+        # Carregar base de dados
+        try:
+            # Obter e limpar caminho
+            fonte = trabalho.get('fonte')
+            caminho_base = fonte.caminho if fonte else limpar_caminho(CONFIG['diretorios']['base_dados'])
+            
+            # Verificar se arquivo existe
+            if not os.path.exists(caminho_base):
+                print(f"❌ Arquivo não encontrado: {caminho_base}")
+                pausar("\nPressione Enter para voltar...", interativo)
+                return
+                
+            # Ler apenas os cabeçalhos para validação
+            fonte = fonte or abrir_fonte_dados(caminho_base)
+            cabecalhos = fonte.cabecalhos()
+            print(f"✓ Cabeçalhos encontrados na base ({type(fonte).__name__}): {', '.join(cabecalhos)}")
+            
+            # Verificar colunas necessárias (inclusive as criadas no pré-processamento)
+            colunas_faltantes = []
+            colunas_disponiveis = set(cabecalhos) | colunas_criadas_pre_processamento()
+            for ph, info in CONFIG['placeholders'].items():
+                coluna = info['coluna']
+                if coluna not in colunas_disponiveis:
+                    colunas_faltantes.append(f"'{coluna}' (para placeholder {ph})")
+            if fragmento and coluna_fragmento and coluna_fragmento not in cabecalhos:
+                colunas_faltantes.append(f"'{coluna_fragmento}' (para fragmentação)")
+            if agrupamento:
+                for chave in ('coluna', 'coluna_tipo'):
+                    if agrupamento.get(chave) and agrupamento[chave] not in colunas_disponiveis:
+                        colunas_faltantes.append(f"'{agrupamento[chave]}' (para agrupamento)")
+            colunas_faltantes.extend(verificar_etapas_pre(cabecalhos, caminho_base))
+            
+            if colunas_faltantes:
+                print("❌ Colunas faltando na base de dados:")
+                for col in colunas_faltantes:
+                    print(f"  - {col}")
+                pausar("\nPressione Enter para voltar...", interativo)
+                return
+            
+            # Ler apenas as colunas usadas, em blocos
+            colunas = colunas_utilizadas(cabecalhos, coluna_fragmento if fragmento else None)
+            fonte.preparar(colunas)
+            total_fonte = fonte.contar_registros()
+            total_registros = total_fonte
+            print(f"✓ Base de dados: {total_fonte} registros encontrados "
+                  f"({len(colunas)} de {len(cabecalhos)} colunas utilizadas)")
+            
+            if fragmento:
+                # Tamanho aproximado do fragmento (exato apenas no modo faixa)
+                i, n = fragmento
+                total_registros = i * total_fonte // n - (i - 1) * total_fonte // n
+                print(f"✓ Fragmento {i}/{n} ({modo_fragmento}): ~{total_registros} registros")
+            
+            cabecalhos = cabecalhos + sorted(colunas_criadas_pre_processamento() - set(cabecalhos))
+            blocos = None
+            argumentos_leitura = dict(
+                fragmento=fragmento,
+                modo_fragmento=modo_fragmento,
+                coluna_fragmento=coluna_fragmento,
+                contexto_etapas=criar_contexto_etapas(caminho_base)
+            )
+            if agrupamento:
+                # Base agrupada uma única vez; cada item é um grupo completo
+                total_registros, total_linhas, registros = agrupar_registros(
+                    iterar_blocos(fonte, colunas, total_fonte, **argumentos_leitura), agrupamento)
+                print(f"✓ Agrupamento por '{agrupamento['coluna']}': {total_registros} documentos "
+                      f"para {total_linhas} registros")
+            else:
+                blocos = iterar_blocos(fonte, colunas, total_fonte, **argumentos_leitura)
+            
+        except Exception as e:
+            print(f"❌ Erro ao carregar base de dados: {str(e)}")
+            traceback.print_exc()
+            pausar("\nPressione Enter para voltar...", interativo)
+            return
+            
+        # Modelos: já preparados pelo executor de planos ou carregados agora
+        if trabalho.get('modelos'):
+            modelos, indice_modelos, falhas_modelos = trabalho['modelos']
+        else:
+            carregados = carregar_modelos(interativo)
+            if carregados is None:
+                return
+            modelos, indice_modelos, falhas_modelos = carregados
+        modelos_por_nome = indice_modelos[0]
+        
+        saida_path = trabalho.get('saida') or limpar_caminho(CONFIG['diretorios']['saida'])
+        sufixo = sufixo_fragmento(fragmento)
+        if blocos is not None:
+            registros = ((idx, registro, subs, None) for indices, bloco, formatados in blocos
+                         for idx, registro, subs in registros_do_bloco(indices, bloco, formatados))
+        
+        if simular:
+            # Mesma preparação da execução real; nada é gravado além do relatório
+            if processos is None:
+                processos = int(CONFIG['config_geral'].get('processos', 1))
+            modo_combinado = modo_combinado or CONFIG.get('saida_combinada', {}).get('modo')
+            resumo = estimar_execucao(registros, modelos, indice_modelos, falhas_modelos, saida_path,
+                                      cabecalhos, 1 if (modo_combinado or agrupamento) else processos,
+                                      sufixo, combinado=bool(modo_combinado))
+            return resumo
+        
+        # Sistema de checkpoint
+        checkpoint_file = os.path.join(saida_path, f'checkpoint{sufixo}.json')
+        checkpoint = {}
+        
+        # Saída combinada: um documento por modelo (e por categoria, se configurado)
+        config_combinada = CONFIG.get('saida_combinada', {})
+        modo_combinado = modo_combinado or config_combinada.get('modo')
+        saida_combinada = None
+        if modo_combinado:
+            saida_combinada = SaidaCombinada(
+                modo_combinado,
+                config_combinada.get('nome_arquivo', 'Documentos_combinados.docx'),
+                sufixo
+            )
+            varios_modelos = CONFIG.get('modelo_especifico', {}).get('ativo', False) and len(modelos) > 1
+            print(f"ⓘ Saída combinada ({modo_combinado}): checkpoint desativado nesta execução")
+        
+        # Conversão para PDF em paralelo à geração (opcional)
+        pool_pdf = None
+        if converter_pdf is None:
+            converter_pdf = CONFIG.get('conversao_pdf', {}).get('ativo', False)
+        
+        # Carregar checkpoint se existir
+        if os.path.exists(checkpoint_file) and not saida_combinada:
+            try:
+                with open(checkpoint_file, 'r') as f:
+                    checkpoint = json.load(f)
+                print(f"✓ Checkpoint encontrado: Continuando do registro {checkpoint.get('ultimo_registro', 0)}")
+            except:
+                print("⚠ Erro ao carregar checkpoint, iniciando do zero")
+        
+        # Renderização em processos: apenas arquivos individuais (não combinados nem agrupados)
+        if processos is None:
+            processos = int(CONFIG['config_geral'].get('processos', 1))
+        if processos > 1 and (saida_combinada or agrupamento):
+            print("ⓘ Renderização em processos não se aplica à saída combinada/agrupada; usando 1 processo")
+            processos = 1
+        
+        # Concorrência adaptativa: gravação em threads, pools ajustados durante a execução
+        opcoes_concorrencia = CONFIG.get('concorrencia', {})
+        if adaptativo is None:
+            adaptativo = opcoes_concorrencia.get('adaptativa', False)
+        if adaptativo and saida_combinada:
+            print("ⓘ Concorrência adaptativa não se aplica à saída combinada")
+            adaptativo = False
+        
+        # Diário de execução: continua o anterior quando retomando do checkpoint
+        diario_path = os.path.join(saida_path, f'diario_geracao{sufixo}.jsonl')
+        diario = DiarioExecucao(diario_path, continuar=bool(checkpoint) and os.path.exists(diario_path))
+        diario.registrar('inicio', total_registros=total_registros,
+                         base_dados=caminho_base, conjunto=trabalho.get('nome'),
+                         fragmento=f"{fragmento[0]}/{fragmento[1]}" if fragmento else None,
+                         modo_fragmento=modo_fragmento if fragmento else None,
+                         agrupamento=agrupamento['coluna'] if agrupamento else None,
+                         processos=processos, adaptativo=bool(adaptativo),
+                         retomada=checkpoint.get('ultimo_registro') if checkpoint else None)
+        if trabalho.get('pool_pdf'):
+            pool_pdf = trabalho['pool_pdf']
+            pool_pdf.usar_diario(diario)
+        elif converter_pdf:
+            pool_pdf = iniciar_pool_pdf(CONFIG.get('conversao_pdf', {}), diario, saida_path)
+
+        # Processar cada registro
+        total_processados = 0
+        categorias = set()
+        
+        def concluir_documento(contexto, erro):
+            """Registra o resultado de um documento (gerado aqui ou em outro processo)"""
+            nonlocal total_processados
+            idx, nome_funcionario, modelo_path, caminho_completo, nome_arquivo, registro = contexto
+            if erro is None:
+                total_processados += 1
+                diario.registrar_documento(idx, nome_funcionario, 'ok',
+                                           modelo=modelo_path, arquivo=caminho_completo)
+                for falha in aplicar_pos_processamento(caminho_completo, registro):
+                    diario.registrar('pos_processamento', indice=idx, arquivo=caminho_completo, erro=falha)
+                    telemetria.aviso(f"⚠ Pós-processamento falhou para {nome_funcionario}: {falha}")
+                if pool_pdf:
+                    pool_pdf.enviar(caminho_completo)
+            
+                # Salvar checkpoint após cada documento processado com sucesso
+                try:
+                    with open(checkpoint_file, 'w') as f:
+                        json.dump({'ultimo_registro': idx}, f)
+                except Exception as e:
+                    print(f"⚠ Erro ao salvar checkpoint: {str(e)}")
+            else:
+                diario.registrar_documento(idx, nome_funcionario, 'erro', modelo=modelo_path, erro=erro)
+                telemetria.aviso(f"❌ Falha ao gerar documento para {nome_funcionario}: {erro}")
+        
+        gravacao = controlador = None
+        if adaptativo:
+            max_gravadores = max(1, int(opcoes_concorrencia.get('max_gravadores', 8)))
+            gravadores = min(max_gravadores, max(1, int(opcoes_concorrencia.get('gravadores', 2))))
+            gravacao = PoolGravacao(gravadores, concluir_documento, capacidade=4 * max_gravadores)
+        
+        renderizador = None
+        if processos > 1:
+            renderizador = trabalho.get('renderizador')
+            if renderizador:
+                renderizador.vincular(concluir_documento, gravacao)
+            else:
+                renderizador = RenderizadorProcessos(processos, modelos, concluir_documento, gravacao)
+                if 'renderizador' in trabalho:
+                    trabalho['renderizador'] = renderizador  # Mesmo pool para as próximas bases do plano
+            registros = iterar_registros_processos(blocos, renderizador)
+            print(f"ⓘ Renderização em {processos} processos (substituições em memória compartilhada)")
+        
+        if gravacao:
+            controlador = ControladorConcorrencia(gravacao, renderizador, opcoes_concorrencia, diario)
+            print(f"ⓘ Concorrência adaptativa: {controlador.min_gravadores}-{controlador.max_gravadores} gravadores, "
+                  f"{controlador.min_processos}-{controlador.max_processos} processos de renderização")
+
+        print("\n⏳ Gerando documentos...")
+        inicio = time.time()
+
+        # Progresso em intervalos fixos (não a cada documento)
+        telemetria = Telemetria(total_registros, CONFIG.get('telemetria', {}), eventos)
+        diario.telemetria = telemetria
+        telemetria.mostrar()
+
+        # Índice inicial
+        start_idx = checkpoint.get('ultimo_registro', 0)
+
+        posicao = 0
+        for posicao, (idx, registro, subs, linhas) in enumerate(registros, 1):
+            if controlador:
+                controlador.verificar()
+            
+            # Pular registros já processados
+            if idx <= start_idx:
+                telemetria.pular()
+                continue
+            
+            try:
+                # Obter nome do funcionário para logs
+                nome_funcionario = obter_nome_funcionario(registro)
+                
+                # Selecionar modelo apropriado
+                modelo_path, nome_modelo = selecionar_modelo(registro, modelos, indice_modelos)
+                if not modelo_path:
+                    # Registrar modelo faltante no diário (contagem mantida no resumo)
+                    diario.registrar_documento(
+                        idx, nome_funcionario, 'modelo_faltante',
+                        modelo=nome_modelo,
+                        erro=f"Modelo '{nome_modelo}' não encontrado"
+                    )
+                    telemetria.aviso(f"❌ Modelo não encontrado: '{nome_modelo}' para {nome_funcionario}")
+                    continue
+                if modelo_path in falhas_modelos:
+                    diario.registrar_documento(
+                        idx, nome_funcionario, 'erro', modelo=modelo_path,
+                        erro=f"Modelo .doc não convertido: {falhas_modelos[modelo_path]}"
+                    )
+                    telemetria.aviso(f"❌ Modelo .doc não convertido: '{nome_modelo}' para {nome_funcionario}")
+                    continue
+                
+                # Organizar por categoria se necessário
+                if saida_combinada and saida_combinada.modo != 'por_categoria':
+                    saida_path_atual = saida_path
+                else:
+                    saida_path_atual = resolver_pasta_saida(registro, saida_path, categorias)
+                if saida_path_atual is None:
+                    telemetria.pular()
+                    continue
+                
+                if saida_combinada:
+                    # Registro vira uma seção do documento combinado
+                    caminho_combinado = saida_combinada.adicionar(saida_path_atual, modelo_path, subs,
+                                                                  varios_modelos, linhas)
+                    total_processados += 1
+                    diario.registrar_documento(idx, nome_funcionario, 'ok',
+                                               modelo=modelo_path, arquivo=caminho_combinado)
+                    continue
+                
+                # Gerar nome de arquivo personalizado usando dados da planilha
+                nome_arquivo = gerar_nome_arquivo(registro, idx, cabecalhos)
+                caminho_completo = os.path.join(saida_path_atual, nome_arquivo)
+                
+                contexto = (idx, nome_funcionario, modelo_path, caminho_completo, nome_arquivo, registro)
+                if renderizador:
+                    # Renderizado em outro processo; resultado registrado ao fim do bloco
+                    renderizador.enviar(idx, modelo_path, caminho_completo, contexto)
+                elif gravacao:
+                    # Renderizado aqui; a gravação em disco fica com as threads de gravação
+                    try:
+                        dados = renderizar_documento(modelo_path, subs, linhas=linhas)
+                    except Exception as e:
+                        gravacao.registrar_falha(contexto, str(e))
+                    else:
+                        gravacao.enviar(caminho_completo, dados, contexto)
+                else:
+                    # Processar documento individual
+                    erro = processar_documento_individual(modelo_path, caminho_completo, subs, linhas)
+                    concluir_documento(contexto, erro)
+                
+            except Exception as e:
+                # Registrar erro com detalhes
+                nome_funcionario = obter_nome_funcionario(registro)
+                
+                diario.registrar_documento(
+                    idx, nome_funcionario, 'erro',
+                    modelo=modelo_path if 'modelo_path' in locals() else "Não definido",
+                    erro=str(e)
+                )
+                if telemetria.aviso(f"❌ Erro no registro {idx} ({nome_funcionario}): {str(e)}"):
+                    traceback.print_exc()
+                
+                # Pausa para evitar sobrecarga
+                time.sleep(2)
+            
+            # Atualizar o progresso (apenas se o intervalo já passou)
+            telemetria.atualizar()
+        
+        # Resultados do último bloco renderizado em processos
+        if renderizador:
+            if renderizador is trabalho.get('renderizador'):
+                renderizador.concluir_bloco()  # Pool segue aberto para a próxima base
+            else:
+                renderizador.finalizar()
+            renderizador = None
+        concorrencia = None
+        if gravacao:
+            gravacao.finalizar()
+            concorrencia = controlador.registrar_resumo()
+        telemetria.finalizar()
+        
+        # Gravar documentos combinados (um único arquivo por modelo/pasta)
+        if saida_combinada:
+            print("\n\n📚 Montando documentos combinados...")
+            for caminho_combinado, quantidade in saida_combinada.finalizar():
+                diario.registrar('combinado', arquivo=caminho_combinado, registros=quantidade,
+                                 bytes=os.path.getsize(caminho_combinado))
+                print(f"✓ {caminho_combinado} ({quantidade} registros)")
+                for falha in aplicar_pos_processamento(caminho_combinado, None):
+                    diario.registrar('pos_processamento', arquivo=caminho_combinado, erro=falha)
+                    print(f"⚠ Pós-processamento falhou para {caminho_combinado}: {falha}")
+                if pool_pdf:
+                    pool_pdf.enviar(caminho_combinado)
+        
+        # Aguardar as conversões para PDF ainda na fila
+        if pool_pdf:
+            print("\n📄 Aguardando conversões para PDF...")
+            if pool_pdf is trabalho.get('pool_pdf'):
+                convertidos, falhas_pdf = pool_pdf.aguardar()  # Pool segue aberto para a próxima base
+            else:
+                convertidos, falhas_pdf = pool_pdf.finalizar()
+            print(f"✓ PDFs gerados: {convertidos} ({falhas_pdf} falhas)")
+        
+        # Auditoria dos arquivos gravados (zip íntegro, sem placeholders restantes)
+        if auditar is None:
+            auditar = CONFIG.get('auditoria', {}).get('ativo', False)
+        if auditar:
+            print("\n🔎 Auditando documentos gerados...")
+            mostrar_auditoria(auditar_geracao(diario, diario_path))
+        
+        # Remover checkpoint após conclusão
+        if os.path.exists(checkpoint_file) and not saida_combinada:
+            try:
+                os.remove(checkpoint_file)
+            except:
+                pass
+        
+        tempo_total = time.time() - inicio
+        diario.registrar('fim', tempo_total=round(tempo_total, 3), total_registros=posicao)
+        diario.fechar()
+        print(f"\n\n✅ Processamento concluído em {tempo_total:.1f} segundos")
+        
+        # Relatório final
+        print("\n" + "="*50)
+        print(f"📊 RESUMO DO PROCESSAMENTO")
+        print("="*50)
+        print(f"• Documentos gerados: {total_processados}/{total_registros}")
+        print(f"• Erros encontrados: {diario.total_erros}")
+        if tempo_total > 0:
+            print(f"• Velocidade: {total_processados/tempo_total:.1f} docs/segundo")
+        if pool_pdf:
+            print(f"• PDFs: {pool_pdf.convertidos} convertidos, {pool_pdf.falhas} falhas")
+        if concorrencia:
+            print(f"• Concorrência: {concorrencia['gravadores']} gravadores, {concorrencia['processos']} "
+                  f"processos ao final ({concorrencia['ajustes']} ajustes)")
+        if CACHE_IMAGENS.preparacoes:
+            print(f"• Imagens: {CACHE_IMAGENS.preparacoes} preparadas, {CACHE_IMAGENS.acertos} reaproveitadas "
+                  f"({CACHE_IMAGENS.descartes} descartadas do cache)")
+        if diario.amostras_erros:
+            print(f"• Primeiros erros (detalhes completos no diário):")
+            for erro in diario.amostras_erros[:5]:
+                print(f"  - #{erro['indice']} {erro['nome']}: {erro['erro']}")
+        
+        # Salvar relatório detalhado (renderizado a partir do diário)
+        log_path = os.path.join(saida_path, f"relatorio_geracao{sufixo}.txt")
+        try:
+            resumo = gerar_relatorio([diario_path], log_path, modelos_por_nome.keys())
+            gerar_manifesto([diario_path], os.path.join(saida_path, f"manifesto_geracao{sufixo}.csv"))
+            print(f"\n📝 Relatório completo salvo em: {log_path}")
+            print(f"🧾 Diário de execução: {diario_path}")
+            if fragmento:
+                print("ⓘ Após concluir todos os fragmentos, use --mesclar para o relatório combinado")
+        except Exception as e:
+            print(f"⚠ Não foi possível salvar relatório: {str(e)}")
+            
+    except Exception as e:
+        print(f"\n❌ ERRO GRAVE: {str(e)}")
+        traceback.print_exc()
+    finally:
+        if 'diario' in locals():
+            diario.fechar()
+        if locals().get('renderizador'):
+            renderizador.descartar()
+            if renderizador is not trabalho.get('renderizador'):
+                renderizador.executor.shutdown(wait=False, cancel_futures=True)
+        if locals().get('gravacao'):
+            gravacao.encerrar()
+        if locals().get('telemetria'):
+            telemetria.fechar()
+        if locals().get('pool_pdf') and pool_pdf._ativo and pool_pdf is not trabalho.get('pool_pdf'):
+            pool_pdf.finalizar()
+        if locals().get('saida_combinada') and resumo is None:
+            # Execução interrompida: remover arquivos temporários
+            saida_combinada.descartar()
+        pausar("\nPressione Enter para voltar ao menu...", interativo)
+    return resumo
+
+# ===============================
+# EXECUTOR DE PLANOS (VÁRIAS BASES)
+# ===============================
+# config/config_planos.json: {"caminho_saude": "...", "caminho_odonto": "...",
+#                             "caminho_log": "pasta dos relatórios"}
+# config/mapeamento_colunas.json: {"saude": {"COLUNA CANÔNICA": "Coluna na planilha"}}
+# Cada "caminho_<nome>" (exceto caminho_log) é uma base. Todas rodam no mesmo
+# processo com modelos, cache de modelos, processos de renderização e pool de
+# PDF compartilhados; cada base é lida enquanto a anterior gera documentos
+# (no máximo uma base carregada à frente).
+
+PASTA_CONFIG_PLANOS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config')
+
+def carregar_planos(caminho_planos=None, caminho_mapeamento=None):
+    """Lê as bases do arquivo de planos; retorna ([(nome, caminho, mapeamento)], pasta de log)"""
+    caminho_planos = caminho_planos or os.path.join(PASTA_CONFIG_PLANOS, 'config_planos.json')
+    caminho_mapeamento = caminho_mapeamento or os.path.join(os.path.dirname(caminho_planos),
+                                                            'mapeamento_colunas.json')
+    with open(caminho_planos, 'r', encoding='utf-8') as f:
+        planos = json.load(f)
+    mapeamentos = {}
+    if os.path.exists(caminho_mapeamento):
+        with open(caminho_mapeamento, 'r', encoding='utf-8') as f:
+            mapeamentos = json.load(f)
+
+    conjuntos = []
+    for chave, valor in planos.items():
+        if chave.startswith('caminho_') and chave != 'caminho_log' and valor:
+            nome = chave[len('caminho_'):]
+            conjuntos.append((nome, limpar_caminho(valor), mapeamentos.get(nome) or {}))
+    return conjuntos, limpar_caminho(planos.get('caminho_log'))
+
+def pre_carregar_fonte(caminho, mapeamento):
+    """Abre a base e já lê as colunas usadas (executado em segundo plano, uma base à frente)"""
+    if not os.path.exists(caminho):
+        raise FileNotFoundError(f"Arquivo não encontrado: {caminho}")
+    fonte = abrir_fonte_dados(caminho, mapeamento=mapeamento)
+    fonte.preparar(colunas_utilizadas(fonte.cabecalhos()))
+    fonte.contar_registros()
+    return fonte
+
+def executar_planos(caminho_planos=None, caminho_mapeamento=None, converter_pdf=None,
+                    modo_combinado=None, coluna_grupo=None, auditar=None, adaptativo=None,
+                    eventos=None, processos=None):
+    """Gera os documentos de todas as bases do plano; retorna o resumo combinado (ou None)"""
+    try:
+        conjuntos, pasta_log = carregar_planos(caminho_planos, caminho_mapeamento)
+    except Exception as e:
+        print(f"❌ Erro ao ler os planos: {str(e)}")
+        return None
+    if not conjuntos:
+        print("❌ Nenhuma base (caminho_...) definida no arquivo de planos")
+        return None
+    print(f"📚 Bases do plano: {', '.join(nome for nome, _, _ in conjuntos)}")
+    inicio = time.time()
+
+    # Opções da linha de comando aplicadas antes da pré-carga: as colunas lidas
+    # (e a chave do cache da planilha) são as mesmas que o processamento usa
+    configurar_agrupamento(coluna_grupo)
+
+    # Recursos preparados uma única vez e compartilhados pelas bases
+    modelos_carregados = carregar_modelos(interativo=False)
+    if modelos_carregados is None:
+        return None
+    saida_base = limpar_caminho(CONFIG['diretorios']['saida'])
+    pasta_log = pasta_log or saida_base
+    os.makedirs(pasta_log, exist_ok=True)
+    if converter_pdf is None:
+        converter_pdf = CONFIG.get('conversao_pdf', {}).get('ativo', False)
+    pool_pdf = iniciar_pool_pdf(CONFIG.get('conversao_pdf', {}), None, saida_base) if converter_pdf else None
+
+    diarios = []
+    trabalho = {'modelos': modelos_carregados, 'pool_pdf': pool_pdf, 'renderizador': None}
+    leitor = ThreadPoolExecutor(max_workers=1)
+    try:
+        carregamento = leitor.submit(pre_carregar_fonte, *conjuntos[0][1:])
+        for posicao, (nome, caminho, _) in enumerate(conjuntos):
+            print(f"\n📂 Base '{nome}': {caminho}")
+            try:
+                fonte = carregamento.result()
+            except Exception as e:
+                print(f"❌ Não foi possível carregar a base '{nome}': {str(e)}")
+                fonte = None
+            # A próxima base é lida enquanto esta gera documentos: no máximo duas em memória
+            if posicao + 1 < len(conjuntos):
+                carregamento = leitor.submit(pre_carregar_fonte, *conjuntos[posicao + 1][1:])
+            if fonte is None:
+                continue
+            saida = os.path.join(saida_base, limpar_nome_arquivo(nome))
+            os.makedirs(saida, exist_ok=True)
+            trabalho.update(nome=nome, fonte=fonte, saida=saida)
+            resumo = processar_documentos(
+                interativo=False,
+                modo_combinado=modo_combinado,
+                converter_pdf=pool_pdf is not None,
+                coluna_grupo=coluna_grupo,
+                processos=processos,
+                auditar=auditar,
+                adaptativo=adaptativo,
+                eventos=eventos,
+                trabalho=trabalho
+            )
+            trabalho['fonte'] = fonte = None
+            if resumo is not None:
+                diarios.append((nome, os.path.join(saida, 'diario_geracao.jsonl')))
+    finally:
+        leitor.shutdown(wait=True)
+        if trabalho['renderizador']:
+            trabalho['renderizador'].finalizar()
+        if pool_pdf:
+            pool_pdf.usar_diario(None)  # Diários das bases já fechados
+            pool_pdf.finalizar()
+
+    if not diarios:
+        return None
+    # Relatório por base e relatório combinado na pasta de log
+    modelos_disponiveis = list(modelos_carregados[1][0].keys())
+    for nome, diario in diarios:
+        gerar_relatorio([diario], os.path.join(pasta_log, f"relatorio_{limpar_nome_arquivo(nome)}.txt"),
+                        modelos_disponiveis)
+    caminhos = [diario for _, diario in diarios]
+    log_path = os.path.join(pasta_log, "relatorio_planos.txt")
+    resumo = gerar_relatorio(caminhos, log_path, modelos_disponiveis)
+    manifesto_path = os.path.join(pasta_log, "manifesto_planos.csv")
+    total_manifesto = gerar_manifesto(caminhos, manifesto_path, [nome for nome, _ in diarios])
+
+    print("\n" + "="*50)
+    print(f"📚 PLANOS CONCLUÍDOS EM {time.time() - inicio:.1f} SEGUNDOS")
+    print("="*50)
+    print(f"• Bases processadas: {len(diarios)}/{len(conjuntos)}")
+    print(f"• Documentos gerados: {resumo['gerados']}/{resumo['total_registros']}")
+    print(f"• Erros: {resumo['erros']}")
+    print(f"📝 Relatório combinado: {log_path}")
+    print(f"🧾 Manifesto ({total_manifesto} documentos): {manifesto_path}")
+    if len(diarios) < len(conjuntos):
+        resumo['erros'] += len(conjuntos) - len(diarios)
+    return resumo
+
+# ===============================
+# SERVIDOR LOCAL (MODO DAEMON)
+# ===============================
+
+class ServicoGeracao:
+    """Estado quente do servidor: configuração, índice de modelos e cache de modelos"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.categorias = set()
+        self.recarregar()
+
+    def recarregar(self):
+        """Relê a configuração e a pasta de modelos.
+
+        A nova configuração é montada à parte e trocada de uma vez: pedidos em
+        andamento continuam com o dicionário antigo, que não é alterado. O
+        contador não volta a zero (nomes automáticos não sobrescrevem arquivos).
+        """
+        global CONFIG
+        novo_config = {**CONFIG, **carregar_configuracao()}
+        caminho_modelos = limpar_caminho(novo_config['diretorios']['modelos'])
+        modelos = listar_modelos(caminho_modelos)
+        if not modelos:
+            raise ValueError(f"Nenhum modelo Word encontrado em: {caminho_modelos}")
+        indice_modelos = indexar_modelos(modelos)
+        base_dados = limpar_caminho(novo_config['diretorios'].get('base_dados'))
+        with self._lock:
+            CONFIG = novo_config
+            self.modelos = modelos
+            self.indice_modelos = indice_modelos
+            self.contexto_etapas = criar_contexto_etapas(base_dados)
+            self.saida_path = limpar_caminho(novo_config['diretorios']['saida'])
+            self.categorias = set()
+            self.contador = getattr(self, 'contador', 0)
+        CACHE_MODELOS.limpar()
+        # Aquecer o cache com todos os modelos (.doc convertidos uma vez)
+        falhas = preparar_modelos_legados(modelos)
+        for modelo_path in modelos:
+            if modelo_path not in falhas:
+                CACHE_MODELOS.conteudo(modelo_path)
+
+    def resolver_modelo(self, pedido, registro):
+        """Modelo explícito do pedido ou a regra da configuração (modelo_especifico)"""
+        if pedido.get('modelo'):
+            return encontrar_modelo(str(pedido['modelo']), *self.indice_modelos), str(pedido['modelo'])
+        return selecionar_modelo(registro, self.modelos, self.indice_modelos)
+
+    def pre_processar(self, registro):
+        """Aplica ao registro as mesmas etapas "pre" do processamento em lote"""
+        if not registro or not CONFIG.get('pre_pos_processamento', {}).get('pre'):
+            return registro
+        df = aplicar_pre_processamento(pd.DataFrame([registro]), self.contexto_etapas)
+        return df.iloc[0].to_dict()
+
+    def preparar(self, pedido, registro):
+        """Converte um pedido em (modelo, substituições), aceitando dados por coluna ou por placeholder"""
+        if 'substituicoes' in pedido:
+            subs = {ph: formatar_valor(valor) for ph, valor in pedido['substituicoes'].items()}
+        else:
+            faltantes = [info['coluna'] for info in CONFIG['placeholders'].values() if info['coluna'] not in registro]
+            if faltantes:
+                raise ValueError(f"Colunas faltando no registro: {', '.join(faltantes)}")
+            subs = montar_substituicoes(registro)
+
+        modelo_path, nome_modelo = self.resolver_modelo(pedido, registro)
+        if not modelo_path:
+            raise LookupError(f"Modelo '{nome_modelo}' não encontrado")
+        return modelo_path, subs
+
+    def gerar_arquivo(self, pedido, registro):
+        """Gera o documento na pasta de saída e retorna o caminho"""
+        modelo_path, subs = self.preparar(pedido, registro)
+        with self._lock:
+            self.contador += 1
+            contador = self.contador
+        pasta = resolver_pasta_saida(registro, self.saida_path, self.categorias, restrito=True)
+        if pasta is None:
+            raise OSError("Não foi possível criar a pasta de saída")
+        if pedido.get('nome_arquivo'):
+            # Nome informado pelo cliente: apenas o nome, sem permitir outras pastas
+            nome, ext = os.path.splitext(os.path.basename(str(pedido['nome_arquivo'])))
+            nome_arquivo = limpar_nome_arquivo(nome) + (ext or '.docx')
+        else:
+            nome_arquivo = gerar_nome_arquivo(registro, contador, list(registro.keys()))
+        caminho_completo = os.path.join(pasta, nome_arquivo)
+        if not dentro_da_pasta(caminho_completo, self.saida_path):
+            raise ValueError(f"Arquivo fora da pasta de saída: {nome_arquivo}")
+        substituir_texto_com_docx(modelo_path, subs, caminho_completo)
+        for falha in aplicar_pos_processamento(caminho_completo, registro):
+            print(f"⚠ Pós-processamento falhou para {caminho_completo}: {falha}")
+        return caminho_completo
+
+    def gerar_bytes(self, pedido, registro):
+        """Gera o documento e retorna seu conteúdo (.docx)"""
+        modelo_path, subs = self.preparar(pedido, registro)
+        return renderizar_documento(modelo_path, subs)
+
+    def estado(self):
+        return {
+            'status': 'ok',
+            'modelos': len(self.modelos),
+            'cache': {'acertos': CACHE_MODELOS.acertos, 'leituras': CACHE_MODELOS.leituras},
+            'imagens': {'acertos': CACHE_IMAGENS.acertos, 'preparadas': CACHE_IMAGENS.preparacoes,
+                        'bytes': CACHE_IMAGENS.bytes_em_uso},
+        }
+
+class ManipuladorGeracao(BaseHTTPRequestHandler):
+    """Rotas: GET /estado, POST /renderizar, POST /lote, POST /recarregar"""
+    servico = None
+
+    def log_message(self, formato, *args):
+        # Silenciar o log padrão por requisição
+        pass
+
+    def responder_json(self, codigo, dados):
+        corpo = json.dumps(dados, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(codigo)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def ler_pedido(self):
+        tamanho = int(self.headers.get('Content-Length') or 0)
+        if not tamanho:
+            return {}
+        return json.loads(self.rfile.read(tamanho).decode('utf-8'))
+
+    def do_GET(self):
+        if self.path == '/estado':
+            self.responder_json(200, self.servico.estado())
+        else:
+            self.responder_json(404, {'erro': 'Rota não encontrada'})
+
+    def do_POST(self):
+        inicio = time.time()
+        try:
+            pedido = self.ler_pedido()
+            if self.path == '/renderizar':
+                registro = self.servico.pre_processar(pedido.get('dados', {}))
+                if pedido.get('resposta', 'bytes') == 'caminho':
+                    caminho = self.servico.gerar_arquivo(pedido, registro)
+                    self.responder_json(200, {'caminho': caminho, 'tempo_ms': round((time.time() - inicio) * 1000, 1)})
+                else:
+                    conteudo = self.servico.gerar_bytes(pedido, registro)
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+                    self.send_header('Content-Length', str(len(conteudo)))
+                    self.end_headers()
+                    self.wfile.write(conteudo)
+            elif self.path == '/lote':
+                documentos = []
+                for i, registro in enumerate(pedido.get('registros', []), 1):
+                    try:
+                        registro = self.servico.pre_processar(registro)
+                        documentos.append({'indice': i, 'caminho': self.servico.gerar_arquivo(pedido, registro)})
+                    except Exception as e:
+                        documentos.append({'indice': i, 'erro': str(e)})
+                self.responder_json(200, {'documentos': documentos,
+                                          'tempo_ms': round((time.time() - inicio) * 1000, 1)})
+            elif self.path == '/recarregar':
+                self.servico.recarregar()
+                self.responder_json(200, self.servico.estado())
+            else:
+                self.responder_json(404, {'erro': 'Rota não encontrada'})
+        except (ValueError, LookupError) as e:
+            self.responder_json(400, {'erro': str(e)})
+        except Exception as e:
+            traceback.print_exc()
+            self.responder_json(500, {'erro': str(e)})
+
+def iniciar_servidor(porta=8765):
+    """Mantém o processo ativo atendendo pedidos de geração em 127.0.0.1"""
+    try:
+        ManipuladorGeracao.servico = ServicoGeracao()
+    except Exception as e:
+        print(f"❌ Não foi possível iniciar o servidor: {str(e)}")
+        return 1
+
+    servidor = ThreadingHTTPServer(('127.0.0.1', porta), ManipuladorGeracao)
+    print(f"🌐 Servidor de geração ativo em http://127.0.0.1:{porta}")
+    print(f"✓ {len(ManipuladorGeracao.servico.modelos)} modelos carregados em memória")
+    print("Pressione Ctrl+C para encerrar.")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("\n✅ Servidor encerrado.")
+    finally:
+        servidor.server_close()
+    return 0
+
+# ===============================
+# MENU PRINCIPAL
+# ===============================
+
+def menu_principal():
+    try:
         loaded_config = carregar_configuracao()
         if loaded_config:
             CONFIG.update(loaded_config)
@@ -1026,8 +4751,9 @@ def menu_principal():
         print("="*60)
         print("1. Configurar sistema")
         print("2. Processar documentos")
-        print("3. Visualizar configuração atual")
-        print("4. Sair")
+        print("3. Simular processamento (estimar tempo e espaço)")
+        print("4. Visualizar configuração atual")
+        print("5. Sair")
         
         opcao = input("\nSelecione uma opção: ").strip()
         
@@ -1040,22 +4766,154 @@ def menu_principal():
             else:
                 processar_documentos()
         elif opcao == '3':
+            if not CONFIG.get('diretorios') or not CONFIG.get('placeholders'):
+                print("⚠ Configure o sistema primeiro!")
+                input("Pressione Enter para continuar...")
+            else:
+                processar_documentos(simular=True)
+        elif opcao == '4':
             print("\nConfiguração atual:")
             print(json.dumps(CONFIG, indent=4, ensure_ascii=False))
             print(f"\nArquivo de configuração: {CONFIG_FILE}")
             input("\nPressione Enter para voltar...")
-        elif opcao == '4':
+        elif opcao == '5':
             print("\n✅ Sistema encerrado. Até logo!")
             break
         else:
             print("⚠ Opção inválida! Tente novamente.")
             time.sleep(1)
 
+# ===============================
+# LINHA DE COMANDO (EXECUÇÃO EM LOTE)
+# ===============================
+
+def criar_parser():
+    parser = argparse.ArgumentParser(
+        description="Document Automator - execução sem menu (lote)"
+    )
+    parser.add_argument('--config', help="Arquivo de configuração JSON (padrão: o do menu)")
+    parser.add_argument('--processar', action='store_true', help="Processar documentos sem interação")
+    parser.add_argument('--fragmento', '--shard', dest='fragmento', metavar='i/N',
+                        help="Processar apenas o fragmento i de N (ex: 1/4)")
+    parser.add_argument('--modo-fragmento', choices=['hash', 'faixa'], default='hash',
+                        help="hash: hash estável da chave/linha; faixa: blocos contíguos de linhas")
+    parser.add_argument('--coluna-fragmento', help="Coluna usada como chave do hash (padrão: índice da linha)")
+    parser.add_argument('--mesclar', action='store_true',
+                        help="Mesclar relatórios, modelos faltantes e manifestos dos fragmentos")
+    parser.add_argument('--combinado', choices=['unico', 'por_categoria'],
+                        help="Gerar documentos combinados (mala direta) em vez de um arquivo por registro")
+    parser.add_argument('--agrupar', metavar='COLUNA',
+                        help="Gerar um documento por grupo (ex: titular), repetindo as linhas marcadas das tabelas")
+    parser.add_argument('--processos', type=int, metavar='N',
+                        help="Renderizar em N processos paralelos (padrão: config_geral.processos ou 1)")
+    parser.add_argument('--eventos', metavar='ARQUIVO',
+                        help="Gravar os eventos de cada documento e do progresso em JSON lines (para monitoramento)")
+    parser.add_argument('--simular', action='store_true',
+                        help="Simular a execução sem gravar documentos: estima tempo, tamanho e espaço por pasta")
+    parser.add_argument('--adaptativo', action='store_true', default=None,
+                        help="Gravar em threads e ajustar gravadores/processos conforme a saturação medida")
+    parser.add_argument('--pdf', action='store_true', default=None,
+                        help="Converter os documentos gerados para PDF (LibreOffice headless)")
+    parser.add_argument('--converter-pdf', metavar='PASTA',
+                        help="Apenas converter para PDF os .docx já existentes na pasta")
+    parser.add_argument('--auditar', nargs='?', const='', metavar='PASTA',
+                        help="Com --processar/--planos: auditar os documentos gerados; "
+                             "sozinho: auditar os .docx já existentes na PASTA (padrão: pasta de saída)")
+    parser.add_argument('--planos', nargs='?', const='', metavar='ARQUIVO',
+                        help="Processar todas as bases de config/config_planos.json (ou do ARQUIVO) em uma execução")
+    parser.add_argument('--mapeamento', metavar='ARQUIVO',
+                        help="Mapeamento de colunas por base (padrão: mapeamento_colunas.json ao lado dos planos)")
+    parser.add_argument('--servidor', action='store_true',
+                        help="Manter o processo ativo atendendo pedidos HTTP locais de geração")
+    parser.add_argument('--porta', type=int, default=8765, help="Porta do servidor local (padrão: 8765)")
+    return parser
+
+def executar_linha_comando(argv):
+    """Executa o sistema a partir de argumentos; retorna o código de saída"""
+    global CONFIG_FILE
+    args = criar_parser().parse_args(argv)
+
+    if args.config:
+        CONFIG_FILE = limpar_caminho(args.config)
+    loaded_config = carregar_configuracao()
+    if loaded_config:
+        CONFIG.update(loaded_config)
+
+    if args.mesclar:
+        return 0 if mesclar_fragmentos() else 1
+
+    if args.servidor:
+        return iniciar_servidor(args.porta)
+
+    if args.converter_pdf:
+        resultado = converter_pasta_pdf(limpar_caminho(args.converter_pdf))
+        return 0 if resultado and resultado[1] == 0 else 1
+
+    if args.auditar is not None and not args.processar and not args.fragmento and args.planos is None:
+        auditoria = auditar_pasta(limpar_caminho(args.auditar) or None, args.processos)
+        if auditoria is None:
+            return 1
+        problemas = auditoria['corrompidos'] + auditoria['com_placeholders'] + auditoria['faltantes']
+        return 0 if problemas == 0 else 3
+
+    if not args.processar and not args.simular and not args.fragmento and args.planos is None:
+        criar_parser().print_help()
+        return 2
+
+    if not CONFIG.get('diretorios') or not CONFIG.get('placeholders'):
+        print("⚠ Configure o sistema primeiro!")
+        return 1
+
+    if args.planos is not None:
+        resumo = executar_planos(
+            limpar_caminho(args.planos) or None,
+            limpar_caminho(args.mapeamento) if args.mapeamento else None,
+            converter_pdf=args.pdf,
+            modo_combinado=args.combinado,
+            coluna_grupo=args.agrupar,
+            auditar=args.auditar is not None or None,
+            adaptativo=args.adaptativo,
+            eventos=args.eventos,
+            processos=args.processos
+        )
+        if resumo is None:
+            return 1
+        return 0 if resumo['erros'] == 0 else 3
+
+    fragmento = None
+    if args.fragmento:
+        try:
+            fragmento = interpretar_fragmento(args.fragmento)
+        except ValueError as e:
+            print(f"❌ {str(e)}")
+            return 2
+
+    resumo = processar_documentos(
+        interativo=False,
+        fragmento=fragmento,
+        modo_fragmento=args.modo_fragmento,
+        coluna_fragmento=args.coluna_fragmento,
+        modo_combinado=args.combinado,
+        converter_pdf=args.pdf,
+        coluna_grupo=args.agrupar,
+        processos=args.processos,
+        auditar=args.auditar is not None or None,
+        adaptativo=args.adaptativo,
+        simular=args.simular,
+        eventos=args.eventos
+    )
+    if resumo is None:
+        return 1
+    return 0 if resumo['erros'] == 0 else 3
+
 # ===============================
 # PONTO DE ENTRADA
 # ===============================
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(executar_linha_comando(sys.argv[1:]))
+
     try:
         menu_principal()
     except Exception as e:
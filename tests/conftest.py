@@ -0,0 +1,14 @@
+import os
+import sys
+import types
+
+# O módulo importa win32com/pythoncom (somente Windows); fora do Windows os
+# testes usam módulos vazios, já que as funções testadas não usam o Word.
+for nome in ('win32com', 'win32com.client', 'pythoncom'):
+    try:
+        __import__(nome)
+    except ImportError:
+        sys.modules[nome] = types.ModuleType(nome)
+sys.modules['win32com'].client = sys.modules['win32com.client']
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
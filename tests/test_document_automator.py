@@ -0,0 +1,983 @@
+import io
+import json
+import os
+import struct
+import sys
+import zipfile
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+from docx import Document
+
+import document_automator as da
+
+
+def png_1x1(cor):
+    """PNG mínimo de 1x1 pixel na cor informada (r, g, b)"""
+    def bloco(tipo, dados):
+        return (struct.pack('>I', len(dados)) + tipo + dados
+                + struct.pack('>I', zlib.crc32(tipo + dados) & 0xffffffff))
+    return (b'\x89PNG\r\n\x1a\n'
+            + bloco(b'IHDR', struct.pack('>IIBBBBB', 1, 1, 8, 2, 0, 0, 0))
+            + bloco(b'IDAT', zlib.compress(b'\x00' + bytes(cor)))
+            + bloco(b'IEND', b''))
+
+
+@pytest.fixture
+def config(monkeypatch):
+    """CONFIG isolado por teste"""
+    cfg = {
+        'diretorios': {'modelos': 'modelos', 'base_dados': 'base.xlsx', 'saida': 'saida'},
+        'placeholders': {},
+        'config_geral': {'padrao_nome_arquivo': 'Documento_[CONTADOR].docx'},
+        'organizacao': {},
+    }
+    monkeypatch.setattr(da, 'CONFIG', cfg)
+    return cfg
+
+
+# ===============================
+# DOCUMENTOS AGRUPADOS COM IMAGENS
+# ===============================
+
+@pytest.fixture
+def modelo_agrupado_com_imagem(tmp_path, config):
+    """Modelo com imagem no corpo e na linha repetida de tabela"""
+    (tmp_path / 'a.png').write_bytes(png_1x1((255, 0, 0)))
+    (tmp_path / 'b.png').write_bytes(png_1x1((0, 0, 255)))
+    config['placeholders'] = {
+        '[NOME]': {'coluna': 'Nome'},
+        '[ASSIN]': {'coluna': 'Assin', 'tipo': 'imagem', 'largura_cm': 3},
+    }
+    config['imagens'] = {'pasta': str(tmp_path)}
+    config['agrupamento'] = {'ativo': True, 'marcador': '[REPETIR]'}
+
+    doc = Document()
+    doc.add_paragraph('Titular [NOME] [ASSIN]')
+    tabela = doc.add_table(rows=1, cols=2)
+    tabela.cell(0, 0).text = '[REPETIR][NOME]'
+    tabela.cell(0, 1).text = '[ASSIN]'
+    caminho = tmp_path / 'Modelo.docx'
+    doc.save(caminho)
+    return caminho
+
+
+TITULAR = {'[NOME]': 'Ana', '[ASSIN]': 'a.png'}
+MEMBROS = [{'[NOME]': 'Bia', '[ASSIN]': 'b.png'}, {'[NOME]': 'Caio', '[ASSIN]': 'a.png'}]
+
+
+def verificar_imagens_nas_linhas(doc):
+    tabela = doc.tables[0]
+    assert [linha.cells[0].text for linha in tabela.rows] == ['Bia', 'Caio']
+    for linha in tabela.rows:
+        celula = linha.cells[1]
+        assert celula.text == ''
+        assert celula._tc.xpath('.//w:drawing')
+    assert 'a.png' not in doc.element.xml and 'b.png' not in doc.element.xml
+
+
+def test_agrupado_insere_imagens_nas_linhas_repetidas(modelo_agrupado_com_imagem):
+    doc = Document(modelo_agrupado_com_imagem)
+    da.aplicar_substituicoes(doc, TITULAR, MEMBROS)
+
+    verificar_imagens_nas_linhas(doc)
+    assert len(doc.inline_shapes) == 3
+    # Mesma imagem em várias linhas usa uma única parte de mídia
+    assert len(doc.part.package.image_parts) == 2
+
+
+def test_combinado_insere_imagens_nas_linhas_repetidas(modelo_agrupado_com_imagem, tmp_path):
+    saida = tmp_path / 'Combinado.docx'
+    combinado = da.DocumentoCombinado(str(modelo_agrupado_com_imagem), str(saida))
+    combinado.adicionar(TITULAR, MEMBROS)
+    combinado.finalizar()
+
+    doc = Document(saida)
+    verificar_imagens_nas_linhas(doc)
+    assert len(doc.inline_shapes) == 3
+
+
+def test_imagem_analisada_uma_vez_para_varios_documentos(modelo_agrupado_com_imagem, monkeypatch):
+    da.aplicar_substituicoes(Document(modelo_agrupado_com_imagem), TITULAR, MEMBROS)
+    analises = []
+    from_file = da.ImagemDocx.from_file
+    monkeypatch.setattr(da.ImagemDocx, 'from_file',
+                        classmethod(lambda cls, descritor: analises.append(descritor) or from_file(descritor)))
+
+    for _ in range(3):
+        doc = Document(modelo_agrupado_com_imagem)
+        da.aplicar_substituicoes(doc, TITULAR, MEMBROS)
+        verificar_imagens_nas_linhas(doc)
+        assert len(doc.part.package.image_parts) == 2
+    assert analises == []
+
+
+def test_cache_de_imagens_limita_os_arquivos_lembrados(tmp_path):
+    cache = da.CacheImagens(limite_arquivos=2)
+    for numero in range(4):
+        (tmp_path / f'{numero}.png').write_bytes(png_1x1((0, 0, 0)))
+        cache.obter(str(tmp_path / f'{numero}.png'))
+
+    assert [chave[0] for chave in cache._por_arquivo] == [str(tmp_path / '2.png'), str(tmp_path / '3.png')]
+    assert (cache.preparacoes, cache.acertos) == (1, 3)
+
+
+def test_documento_individual_retorna_texto_do_erro(modelo_agrupado_com_imagem, tmp_path, capsys):
+    subs = {'[NOME]': 'Ana', '[ASSIN]': 'inexistente.png'}
+    erro = da.processar_documento_individual(str(modelo_agrupado_com_imagem),
+                                             str(tmp_path / 'Saida.docx'), subs)
+
+    assert 'inexistente.png' in erro
+    assert capsys.readouterr().out == ''
+    assert da.processar_documento_individual(str(modelo_agrupado_com_imagem),
+                                             str(tmp_path / 'Saida.docx'), TITULAR) is None
+
+
+# ===============================
+# DIÁRIO E RELATÓRIO
+# ===============================
+
+def escrever_diario(caminho, eventos):
+    with open(caminho, 'w', encoding='utf-8') as f:
+        for evento in eventos:
+            f.write(json.dumps(evento) + '\n')
+    return str(caminho)
+
+
+def documento(indice, status, t, modelo='M.docx', erro=None):
+    return {'tipo': 'documento', 't': t, 'indice': indice, 'nome': f'P{indice}', 'status': status,
+            'modelo': modelo, 'arquivo': f'Doc_{indice}.docx' if status == 'ok' else None, 'erro': erro}
+
+
+@pytest.fixture
+def diario_retomado(tmp_path):
+    """Primeira sessão interrompida com erros; a retomada refaz os registros 3 e 4"""
+    return escrever_diario(tmp_path / 'diario_geracao.jsonl', [
+        {'tipo': 'inicio', 't': 0.0, 'total_registros': 4},
+        documento(1, 'ok', 1.0),
+        documento(2, 'erro', 2.0, erro='falha de disco'),
+        documento(3, 'modelo_faltante', 3.0, modelo='X', erro="Modelo 'X' não encontrado"),
+        documento(4, 'erro', 4.0, erro='primeira falha'),
+        {'tipo': 'inicio', 't': 10.0, 'total_registros': 4, 'retomada': 1},
+        documento(3, 'ok', 11.0),
+        documento(4, 'erro', 12.0, erro='segunda falha'),
+        {'tipo': 'fim', 't': 13.0},
+    ])
+
+
+def test_resumo_conta_o_ultimo_status_de_cada_registro(diario_retomado):
+    resumo = da.resumir_diarios([diario_retomado])
+
+    assert resumo['gerados'] == 2
+    assert resumo['erros'] == 2
+    assert resumo['modelos_faltantes'] == {}
+    assert resumo['tempo_total'] == pytest.approx(7.0)
+    # Só os eventos refeitos após a retomada ficam guardados (posições 3 e 4 do diário)
+    assert resumo['diarios'][0]['substituidos'] == {3, 4}
+
+
+def test_relatorio_e_manifesto_sem_registros_repetidos(config, diario_retomado, tmp_path):
+    relatorio = tmp_path / 'relatorio.txt'
+    da.gerar_relatorio([diario_retomado], str(relatorio))
+    texto = relatorio.read_text(encoding='utf-8')
+
+    assert texto.count('• REGISTRO #') == 2
+    assert 'segunda falha' in texto and 'primeira falha' not in texto
+
+    manifesto = tmp_path / 'manifesto.csv'
+    assert da.gerar_manifesto([diario_retomado], str(manifesto)) == 2
+
+
+# ===============================
+# FRAGMENTOS
+# ===============================
+
+def test_fragmento_usa_a_chave_normalizada_do_agrupamento():
+    df = pd.DataFrame({'CPF TIT': ['T1', ' T1', 'T1 ', None, np.nan, 'T2']})
+    mascaras = [da.mascara_fragmento(df, (i, 3), 'hash', 'CPF TIT') for i in (1, 2, 3)]
+
+    # Cada linha cai em exatamente um fragmento
+    assert sum(mascara.astype(int) for mascara in mascaras).tolist() == [1] * len(df)
+    for mascara in mascaras:
+        # Mesma chave normalizada, mesmo fragmento
+        assert len(set(mascara.iloc[:3])) == 1
+        assert mascara.iloc[3] == mascara.iloc[4]
+
+
+def test_fragmentos_por_faixa_dividem_a_base_em_blocos_contiguos():
+    df = pd.DataFrame({'Nome': [f'P{i}' for i in range(4)]})
+    # Bloco com as posições 4 a 7 de uma base de 10 linhas: fragmentos [0, 3), [3, 6), [6, 10)
+    df.index = range(4, 8)
+    mascaras = [da.mascara_fragmento(df, (i, 3), 'faixa', inicio=4, total=10) for i in (1, 2, 3)]
+
+    assert [mascara.tolist() for mascara in mascaras] == [
+        [False] * 4, [True, True, False, False], [False, False, True, True]]
+
+
+
+def diario_de_fragmento(pasta, i, n, indices, modo='hash'):
+    return escrever_diario(pasta / f'diario_geracao_fragmento_{i}de{n}.jsonl', [
+        {'tipo': 'inicio', 't': 0.0, 'total_registros': len(indices), 'fragmento': f'{i}/{n}',
+         'modo_fragmento': modo},
+        *(documento(indice, 'ok', float(indice)) for indice in indices),
+    ])
+
+
+def test_mesclar_recusa_diarios_de_divisoes_diferentes(config, tmp_path, capsys):
+    diario_de_fragmento(tmp_path, 1, 2, [1, 3])
+    diario_de_fragmento(tmp_path, 2, 2, [2, 4])
+    diario_de_fragmento(tmp_path, 1, 3, [1, 4])  # Sobra de uma execução com 3 fragmentos
+
+    assert da.mesclar_fragmentos(str(tmp_path)) is None
+    assert 'diario_geracao_fragmento_1de3.jsonl: fragmento 1/3' in capsys.readouterr().out
+    assert not (tmp_path / 'relatorio_geracao.txt').exists()
+
+
+def test_mesclar_combina_os_fragmentos_da_mesma_divisao(config, tmp_path, capsys):
+    diario_de_fragmento(tmp_path, 1, 3, [1, 3])
+    diario_de_fragmento(tmp_path, 2, 3, [2, 4])
+    resumo = da.mesclar_fragmentos(str(tmp_path))
+
+    assert (resumo['gerados'], resumo['erros']) == (4, 0)
+    assert 'Fragmentos sem diário (ainda não executados?): 3/3' in capsys.readouterr().out
+    assert (tmp_path / 'manifesto_geracao.csv').exists()
+
+# ===============================
+# AGRUPAMENTO
+# ===============================
+
+def blocos_da_base(df, tamanho, colunas):
+    """Blocos no formato de iterar_blocos: (índices, DataFrame, textos formatados)"""
+    for inicio in range(0, len(df), tamanho):
+        bloco = df.iloc[inicio:inicio + tamanho]
+        formatados = {ph: bloco[coluna].map(da.formatar_valor).tolist() for ph, coluna in colunas.items()}
+        yield list(range(inicio + 1, inicio + len(bloco) + 1)), bloco, formatados
+
+
+def test_agrupar_registros_um_documento_por_titular():
+    df = pd.DataFrame({
+        'CPF TIT': ['T2', 'T1', 'T1 ', 'T2', 'T1', 'T3'],
+        'TIT/DEP': ['DEPENDENTE', 'TITULAR', 'DEPENDENTE', 'titular', 'DEPENDENTE', 'DEPENDENTE'],
+        'Nome': ['Dep2', 'Tit1', 'Dep1a', 'Tit2', 'Dep1b', 'Dep3'],
+    })
+    agrupamento = {'coluna': 'CPF TIT', 'coluna_tipo': 'TIT/DEP', 'valor_titular': 'T'}
+    total, linhas, registros = da.agrupar_registros(
+        blocos_da_base(df, 4, {'[NOME]': 'Nome'}), agrupamento)
+    grupos = [(idx, registro['Nome'], subs['[NOME]'], [m['[NOME]'] for m in membros])
+              for idx, registro, subs, membros in registros]
+
+    assert (total, linhas) == (3, 6)
+    # Ordem da primeira aparição; chave comparada sem espaços; grupo sem titular usa a primeira linha
+    assert grupos == [
+        (1, 'Tit2', 'Tit2', ['Dep2']),
+        (2, 'Tit1', 'Tit1', ['Dep1a', 'Dep1b']),
+        (6, 'Dep3', 'Dep3', []),
+    ]
+
+
+def test_agrupar_registros_sem_coluna_tipo_inclui_todos_os_membros():
+    df = pd.DataFrame({'Família': ['A', 'B', 'A'], 'Nome': ['X', 'Y', 'Z']})
+    _, _, registros = da.agrupar_registros(
+        blocos_da_base(df, 10, {'[NOME]': 'Nome'}), {'coluna': 'Família'})
+
+    assert [[m['[NOME]'] for m in membros] for _, _, _, membros in registros] == [['X', 'Z'], ['Y']]
+
+
+def test_agrupar_base_vazia():
+    total, linhas, registros = da.agrupar_registros(iter(()), {'coluna': 'CPF TIT'})
+    assert (total, linhas, list(registros)) == (0, 0, [])
+
+
+# ===============================
+# SIMULAÇÃO
+# ===============================
+
+def test_simulacao_estima_sem_gerar_documentos(config, tmp_path):
+    config['placeholders'] = {'[NOME]': {'coluna': 'Nome'}}
+    config['config_geral']['padrao_nome_arquivo'] = 'Doc_[Nome].docx'
+    config['simulacao'] = {'amostra_por_modelo': 2}
+    doc = Document()
+    doc.add_paragraph('Contrato de [NOME]')
+    modelo = tmp_path / 'modelos' / 'Contrato.docx'
+    modelo.parent.mkdir()
+    doc.save(modelo)
+    modelos = [str(modelo)]
+
+    # Pasta de saída ainda inexistente; "Ana" aparece duas vezes (mesmo nome de arquivo)
+    saida = tmp_path / 'saida'
+    nomes = ['Ana', 'Bia', 'Ana', 'Caio', 'Davi']
+    registros = [(i, {'Nome': nome}, {'[NOME]': nome}, None) for i, nome in enumerate(nomes, 1)]
+    estimativa = da.estimar_execucao(registros, modelos, da.indexar_modelos(modelos), {},
+                                     str(saida), ['Nome'])
+
+    assert estimativa['registros'] == estimativa['documentos'] == 5
+    assert estimativa['erros'] == 0
+    assert estimativa['colisoes'] == 1
+    assert estimativa['tamanho_estimado'] > 0
+    assert estimativa['disco_estimado'] % da.TAMANHO_CLUSTER == 0
+    assert sorted(p.name for p in saida.iterdir()) == ['relatorio_simulacao.txt']
+
+
+# ===============================
+# CONVERSÃO PARA PDF
+# ===============================
+
+@pytest.fixture
+def soffice_falso(tmp_path):
+    """Executável que imita o soffice: "--convert-to" grava um PDF mínimo e
+    "--accept" fica aberto (processo persistente); cada início vai para soffice.log"""
+    if os.name == 'nt':
+        pytest.skip("executável de teste em script de shell")
+    caminho = tmp_path / 'soffice'
+    caminho.write_text(
+        f"#!{sys.executable}\n"
+        "import os, sys, time\n"
+        "a = sys.argv\n"
+        f"open({str(tmp_path / 'soffice.log')!r}, 'a').write('inicio\\n')\n"
+        "if any(arg.startswith('--accept') for arg in a):\n"
+        "    time.sleep(3600)\n"
+        "saida, origem, formato = a[a.index('--outdir') + 1], a[-1], a[a.index('--convert-to') + 1]\n"
+        "nome = os.path.splitext(os.path.basename(origem))[0] + '.' + formato\n"
+        "open(os.path.join(saida, nome), 'w').write('%PDF')\n")
+    caminho.chmod(0o755)
+    return str(caminho)
+
+
+def test_pool_pdf_devolve_o_trabalhador_quando_o_destino_falha(soffice_falso, tmp_path, monkeypatch):
+    monkeypatch.setattr(da, 'uno', None)
+    pool = da.PoolConversaoPDF({'soffice': soffice_falso, 'trabalhadores': 1}, saida_path=str(tmp_path))
+    caminho_pdf = pool.caminho_pdf
+
+    def destino_instavel(caminho_docx):
+        if 'ruim' in caminho_docx:
+            raise OSError("pasta de PDFs inacessível")
+        return caminho_pdf(caminho_docx)
+
+    monkeypatch.setattr(pool, 'caminho_pdf', destino_instavel)
+    documentos = []
+    for nome in ('ruim1', 'ruim2', 'bom1', 'ruim3', 'bom2'):
+        (tmp_path / f'{nome}.docx').write_bytes(b'docx')
+        documentos.append(str(tmp_path / f'{nome}.docx'))
+    try:
+        resultados = [pool.enviar(caminho).result(timeout=30) for caminho in documentos]
+    finally:
+        pool.finalizar()
+
+    assert resultados == [False, False, True, False, True]
+    assert (pool.convertidos, pool.falhas) == (2, 3)
+    assert (tmp_path / 'bom2.pdf').exists()
+
+
+def escrever_executavel(caminho, codigo):
+    caminho.write_text(f"#!{sys.executable}\n" + codigo)
+    caminho.chmod(0o755)
+    return str(caminho)
+
+
+def test_pool_pdf_sem_uno_usa_a_ponte_do_python_do_libreoffice(soffice_falso, tmp_path, monkeypatch):
+    monkeypatch.setattr(da, 'uno', None)
+    # Imita a ponte: responde "pronto" e converte copiando o arquivo
+    python_lo = escrever_executavel(tmp_path / 'python_lo', (
+        "import json, shutil, sys\n"
+        "print(json.dumps({'ok': True}), flush=True)\n"
+        "for linha in sys.stdin:\n"
+        "    pedido = json.loads(linha)\n"
+        "    if pedido['acao'] == 'encerrar':\n"
+        "        break\n"
+        "    if pedido['acao'] == 'converter':\n"
+        "        shutil.copy(pedido['origem'], pedido['destino'])\n"
+        "    print(json.dumps({'ok': True}), flush=True)\n"))
+    diario = da.DiarioExecucao(str(tmp_path / 'diario.jsonl'))
+    pool = da.PoolConversaoPDF({'soffice': soffice_falso, 'trabalhadores': 1, 'python': python_lo},
+                               diario, str(tmp_path))
+    pool.iniciar()
+    assert pool.modo == 'persistente (ponte UNO do LibreOffice)'
+    for i in range(3):
+        (tmp_path / f'doc{i}.docx').write_bytes(b'docx')
+        pool.enviar(str(tmp_path / f'doc{i}.docx'))
+    assert pool.finalizar() == (3, 0)
+    diario.fechar()
+
+    # Um único LibreOffice aberto para as três conversões
+    assert (tmp_path / 'soffice.log').read_text().count('inicio') == 1
+    assert (tmp_path / 'doc2.pdf').read_bytes() == b'docx'
+    eventos = list(da.ler_diario(str(tmp_path / 'diario.jsonl')))
+    assert [e['persistente'] for e in eventos if e['tipo'] == 'pdf_resumo'] == [True]
+
+
+def test_pool_pdf_sem_ponte_avisa_e_registra_no_diario(soffice_falso, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(da, 'uno', None)
+    python_sem_uno = escrever_executavel(tmp_path / 'python_lo', "import sys\nsys.exit(1)\n")
+    diario = da.DiarioExecucao(str(tmp_path / 'diario.jsonl'))
+    pool = da.PoolConversaoPDF({'soffice': soffice_falso, 'trabalhadores': 2, 'python': python_sem_uno},
+                               diario, str(tmp_path))
+    pool.iniciar()
+    (tmp_path / 'doc.docx').write_bytes(b'docx')
+    pool.enviar(str(tmp_path / 'doc.docx'))
+    assert pool.finalizar() == (1, 0)
+    diario.fechar()
+
+    assert pool.modo == 'linha de comando'
+    assert capsys.readouterr().out.count('sem processo persistente') == 1
+    eventos = list(da.ler_diario(str(tmp_path / 'diario.jsonl')))
+    assert [e['tipo'] for e in eventos].count('pdf_aviso') == 1
+    assert [e['persistente'] for e in eventos if e['tipo'] == 'pdf_resumo'] == [False]
+
+
+# ===============================
+# SERVIDOR LOCAL
+# ===============================
+
+@pytest.fixture
+def servico(tmp_path, config, monkeypatch):
+    """ServicoGeracao com um modelo e organização por departamento (sem limpar caracteres)"""
+    pasta_modelos = tmp_path / 'modelos'
+    pasta_modelos.mkdir()
+    doc = Document()
+    doc.add_paragraph('Contrato de [NOME]')
+    doc.save(pasta_modelos / 'Contrato.docx')
+    (tmp_path / 'saida').mkdir()
+    config['diretorios'] = {'modelos': str(pasta_modelos), 'saida': str(tmp_path / 'saida')}
+    config['placeholders'] = {'[NOME]': {'coluna': 'Nome'}}
+    config['organizacao'] = {'ativo': True, 'coluna': 'Depto', 'limpar_caracteres': False}
+    monkeypatch.setattr(da, 'carregar_configuracao', lambda: json.loads(json.dumps(config)))
+    return da.ServicoGeracao()
+
+
+@pytest.mark.parametrize('depto', ['../../fora', '..', '.', '../', 'a/../../fora', '/tmp/fora'])
+def test_servidor_nao_grava_fora_da_pasta_de_saida(servico, tmp_path, depto):
+    saida = tmp_path / 'saida'
+    try:
+        caminho = servico.gerar_arquivo({}, {'Nome': 'Ana', 'Depto': depto})
+    except ValueError:
+        pass
+    else:
+        # Categoria limpa: vira uma subpasta comum da saída
+        assert os.path.dirname(os.path.dirname(caminho)) == str(saida)
+    assert [p for p in tmp_path.rglob('*.docx') if saida not in p.parents and p.parent.name != 'modelos'] == []
+
+
+def test_servidor_grava_na_subpasta_da_categoria(servico, tmp_path):
+    caminho = servico.gerar_arquivo({'nome_arquivo': '../Ana.docx'}, {'Nome': 'Ana', 'Depto': 'RH/Folha'})
+    assert caminho == str(tmp_path / 'saida' / 'RH_Folha' / 'Ana.docx')
+    assert 'Contrato de Ana' in Document(caminho).paragraphs[0].text
+
+
+def test_recarregar_troca_a_configuracao_sem_alterar_a_anterior(servico, config, tmp_path, monkeypatch):
+    primeiro = servico.gerar_arquivo({}, {'Nome': 'Ana', 'Depto': 'RH'})
+    anterior = da.CONFIG
+    novo = json.loads(json.dumps(config))
+    novo['placeholders'] = {'[NOME]': {'coluna': 'Nome completo'}}
+    monkeypatch.setattr(da, 'carregar_configuracao', lambda: novo)
+    servico.recarregar()
+
+    # Pedidos em andamento continuam vendo a configuração antiga, intacta
+    assert anterior['placeholders'] == {'[NOME]': {'coluna': 'Nome'}}
+    assert da.CONFIG['placeholders'] == {'[NOME]': {'coluna': 'Nome completo'}}
+    assert servico.categorias == set()
+    # O contador continua: o nome automático não repete o do primeiro arquivo
+    segundo = servico.gerar_arquivo({}, {'Nome completo': 'Ana', 'Nome': 'Ana', 'Depto': 'RH'})
+    assert segundo != primeiro
+    assert os.path.exists(primeiro) and os.path.exists(segundo)
+
+
+def test_cache_de_modelos_analisa_uma_vez_e_entrega_copias(servico, tmp_path, monkeypatch):
+    modelo = str(tmp_path / 'modelos' / 'Contrato.docx')
+    analises = []
+    original = da.Document
+    monkeypatch.setattr(da, 'Document', lambda *a: analises.append(1) or original(*a))
+    da.CACHE_MODELOS.limpar()
+
+    primeiro = da.CACHE_MODELOS.abrir(modelo)
+    primeiro.paragraphs[0].text = 'alterado'
+    segundo = da.CACHE_MODELOS.abrir(modelo)
+
+    assert len(analises) == 1
+    assert segundo.paragraphs[0].text == 'Contrato de [NOME]'
+
+
+def test_resumo_desfaz_ok_sem_checkpoint_gravado(tmp_path):
+    # Queda entre o evento 'ok' do registro 2 e a gravação do checkpoint (que ficou em 1)
+    diario = escrever_diario(tmp_path / 'diario_geracao.jsonl', [
+        {'tipo': 'inicio', 't': 0.0, 'total_registros': 3},
+        documento(1, 'ok', 1.0),
+        documento(2, 'ok', 2.0),
+        {'tipo': 'inicio', 't': 10.0, 'total_registros': 3, 'retomada': 1},
+        documento(2, 'ok', 11.0),
+        documento(3, 'erro', 12.0, erro='falha'),
+    ])
+    resumo = da.resumir_diarios([diario])
+
+    assert (resumo['gerados'], resumo['erros']) == (2, 1)
+    assert da.gerar_manifesto([diario], str(tmp_path / 'manifesto.csv')) == 2
+
+
+# ===============================
+# PRÉ E PÓS-PROCESSAMENTO
+# ===============================
+
+def test_etapas_pre_transformam_colunas_inteiras(config):
+    config['pre_pos_processamento'] = {'pre': [
+        {'tipo': 'aparar', 'colunas': ['Nome']},
+        {'tipo': 'maiusculas', 'colunas': ['Nome']},
+        {'tipo': 'mascara_cpf', 'colunas': ['CPF']},
+        {'tipo': 'mascara_telefone', 'colunas': ['Fone']},
+        {'tipo': 'formato_data', 'colunas': ['Admissao']},
+    ]}
+    df = pd.DataFrame({
+        'Nome': ['  ana   maria ', 'bia'],
+        'CPF': [1234567890.0, 98765432100.0],
+        'Fone': ['11987654321', 'sem telefone'],
+        'Admissao': ['2024-01-04', '2024-02-30'],
+    })
+    df = da.aplicar_pre_processamento(df, da.criar_contexto_etapas())
+
+    assert list(df['Nome']) == ['ANA MARIA', 'BIA']
+    assert list(df['CPF']) == ['012.345.678-90', '987.654.321-00']
+    assert list(df['Fone']) == ['(11) 98765-4321', 'sem telefone']
+    assert list(df['Admissao']) == ['04/01/2024', '2024-02-30']
+
+
+def test_etapa_pre_desconhecida_ou_sem_coluna(config):
+    config['pre_pos_processamento'] = {'pre': [{'tipo': 'inverter', 'colunas': ['Nome']},
+                                               {'tipo': 'maiusculas', 'colunas': ['Cargo']}]}
+    problemas = da.verificar_etapas_pre(['Nome'])
+
+    assert problemas == ["Etapa de pré-processamento desconhecida: 'inverter'",
+                         "Etapa 'maiusculas': colunas não encontradas: Cargo"]
+    with pytest.raises(ValueError, match='inverter'):
+        da.aplicar_pre_processamento(pd.DataFrame({'Nome': ['a']}), da.criar_contexto_etapas())
+
+
+BUSCA = {'tipo': 'busca', 'coluna': 'Cod', 'aba': 'Departamentos',
+         'chave': 'Codigo', 'valor': 'Nome', 'destino': 'Depto', 'padrao': '?'}
+DEPARTAMENTOS = pd.DataFrame({'Codigo': [1, 2, 2], 'Nome': ['RH', 'TI', 'Outro']})
+
+
+def buscar(config, etapa, caminho_base):
+    config['pre_pos_processamento'] = {'pre': [etapa]}
+    contexto = da.criar_contexto_etapas(caminho_base)
+    df = da.aplicar_pre_processamento(pd.DataFrame({'Cod': [2, 1, 9]}), contexto)
+    return list(df['Depto']), contexto
+
+
+def test_busca_em_outra_aba_da_base_excel(config, tmp_path):
+    base = tmp_path / 'base.xlsx'
+    with pd.ExcelWriter(base) as escritor:
+        pd.DataFrame({'Cod': [1]}).to_excel(escritor, sheet_name='Dados', index=False)
+        DEPARTAMENTOS.to_excel(escritor, sheet_name='Departamentos', index=False)
+
+    assert buscar(config, BUSCA, str(base))[0] == ['TI', 'RH', '?']
+
+
+def test_busca_em_tabela_da_base_sqlite(config, tmp_path):
+    import sqlite3
+    base = tmp_path / 'base.db'
+    with sqlite3.connect(base) as conexao:
+        pd.DataFrame({'Cod': [1]}).to_sql('dados', conexao, index=False)
+        DEPARTAMENTOS.to_sql('Departamentos', conexao, index=False)
+    config['fonte_dados'] = {'tabela': 'dados'}
+
+    assert buscar(config, BUSCA, str(base))[0] == ['TI', 'RH', '?']
+
+
+def test_busca_em_arquivo_csv_e_lida_uma_vez(config, tmp_path, monkeypatch):
+    tabela = tmp_path / 'departamentos.csv'
+    DEPARTAMENTOS.to_csv(tabela, sep=';', index=False)
+    etapa = {**BUSCA, 'arquivo': str(tabela)}
+    leituras = []
+    ler_blocos = da.FonteCSV.ler_blocos
+    monkeypatch.setattr(da.FonteCSV, 'ler_blocos',
+                        lambda self, colunas=None: leituras.append(colunas) or ler_blocos(self, colunas))
+
+    valores, contexto = buscar(config, etapa, str(tmp_path / 'base.parquet'))
+    da.aplicar_pre_processamento(pd.DataFrame({'Cod': [1]}), contexto)
+
+    assert valores == ['TI', 'RH', '?']
+    assert leituras == [['Codigo', 'Nome']]
+
+
+def test_busca_sem_arquivo_em_base_csv_e_recusada(config, tmp_path):
+    base = tmp_path / 'base.csv'
+    pd.DataFrame({'Cod': [1]}).to_csv(base, index=False)
+
+    assert da.verificar_etapas_pre(['Cod'], str(base)) == []
+    config['pre_pos_processamento'] = {'pre': [BUSCA]}
+    assert da.verificar_etapas_pre(['Cod'], str(base)) == [
+        "Etapa 'busca': informe \"arquivo\" (bases CSV e Parquet não têm outras abas)"]
+    with pytest.raises(ValueError, match='arquivo'):
+        buscar(config, BUSCA, str(base))
+
+
+def test_etapas_pos_copiam_e_coletam_falhas(config, tmp_path):
+    documento_gerado = tmp_path / 'Documento_1.docx'
+    documento_gerado.write_bytes(b'docx')
+    config['pre_pos_processamento'] = {'pos': [
+        {'tipo': 'copiar', 'destino': str(tmp_path / 'backup')},
+        {'tipo': 'comando', 'comando': [sys.executable, '-c', 'import sys; sys.exit(3)', '{arquivo}']},
+        {'tipo': 'assinar'},
+    ]}
+    falhas = da.aplicar_pos_processamento(str(documento_gerado), {})
+
+    assert (tmp_path / 'backup' / 'Documento_1.docx').read_bytes() == b'docx'
+    assert len(falhas) == 2
+    assert falhas[0].startswith('comando: ')
+    assert falhas[1] == "assinar: Etapa de pós-processamento desconhecida: 'assinar'"
+
+
+# ===============================
+# FONTES DE DADOS
+# ===============================
+
+def ler_fonte(fonte, colunas=None):
+    fonte.preparar(colunas)
+    return fonte.contar_registros(), pd.concat(list(fonte.ler_blocos(colunas)), ignore_index=True)
+
+
+def test_fonte_csv_le_texto_igual_em_todos_os_blocos(tmp_path):
+    caminho = tmp_path / 'base.csv'
+    caminho.write_text('Cod;Nome;Obs\n007;Ana;"linha 1\nlinha 2"\n123;Bia;x\n4.5;"Caio ""C""";\n',
+                       encoding='utf-8')
+    fonte = da.abrir_fonte_dados(str(caminho), {'tamanho_bloco': 2})
+
+    assert isinstance(fonte, da.FonteCSV)
+    assert fonte.cabecalhos() == ['Cod', 'Nome', 'Obs']
+    total, df = ler_fonte(fonte, ['Cod', 'Nome'])
+    assert total == 3
+    assert list(df['Cod']) == ['007', '123', '4.5']
+    assert list(df['Nome']) == ['Ana', 'Bia', 'Caio "C"']
+
+
+def test_fonte_csv_conta_sem_quebra_na_ultima_linha(tmp_path):
+    caminho = tmp_path / 'base.csv'
+    caminho.write_bytes(b'Cod,Nome\r\n1,Ana\r\n2,Bia')
+
+    assert da.abrir_fonte_dados(str(caminho), {}).contar_registros() == 2
+
+
+def test_fonte_parquet_em_blocos(tmp_path):
+    caminho = tmp_path / 'base.parquet'
+    pd.DataFrame({'Cod': [1, 2, 3], 'Nome': ['a', 'b', 'c']}).to_parquet(caminho)
+    fonte = da.abrir_fonte_dados(str(caminho), {'tamanho_bloco': 2})
+
+    assert fonte.cabecalhos() == ['Cod', 'Nome']
+    total, df = ler_fonte(fonte, ['Nome'])
+    assert total == 3
+    assert list(df.columns) == ['Nome']
+    assert list(df['Nome']) == ['a', 'b', 'c']
+
+
+def test_fonte_sqlite_com_mapeamento_de_colunas(tmp_path):
+    import sqlite3
+    caminho = tmp_path / 'base.db'
+    with sqlite3.connect(caminho) as conexao:
+        pd.DataFrame({'cod_func': [1, 2, 3], 'nm': ['a', 'b', 'c']}).to_sql('func', conexao, index=False)
+    fonte = da.abrir_fonte_dados(str(caminho), {'tamanho_bloco': 2}, mapeamento={'Nome': 'nm'})
+
+    assert fonte.cabecalhos() == ['cod_func', 'Nome']
+    total, df = ler_fonte(fonte, ['Nome'])
+    assert total == 3
+    assert list(df['Nome']) == ['a', 'b', 'c']
+
+
+def test_fonte_excel_e_formato_desconhecido(tmp_path):
+    caminho = tmp_path / 'base.xlsx'
+    pd.DataFrame({'Cod': [1, 2, 3], 'Nome': ['a', 'b', 'c']}).to_excel(caminho, index=False)
+    fonte = da.abrir_fonte_dados(str(caminho), {'tamanho_bloco': 2})
+
+    assert isinstance(fonte, da.FonteExcel)
+    total, df = ler_fonte(fonte, ['Cod'])
+    assert (total, list(df['Cod'])) == (3, [1, 2, 3])
+    with pytest.raises(ValueError, match='xml'):
+        da.abrir_fonte_dados(str(caminho), {'formato': 'xml'})
+
+
+def test_converter_datas_ignora_textos_na_deteccao_do_formato():
+    datas = da.converter_datas(pd.Series(['a definir', '2024-01-04', None]))
+
+    assert datas[1] == pd.Timestamp(2024, 1, 4)
+    assert datas[[0, 2]].isna().all()
+
+
+# ===============================
+# RENDERIZAÇÃO EM MEMÓRIA
+# ===============================
+
+@pytest.fixture
+def modelo_completo(tmp_path):
+    """Modelo com placeholder em negrito no corpo, em tabela, no cabeçalho e no rodapé"""
+    doc = Document()
+    paragrafo = doc.add_paragraph('Contrato de ')
+    paragrafo.add_run('[NOME]').bold = True
+    doc.add_table(rows=1, cols=1).cell(0, 0).text = 'Cargo: [CARGO]'
+    doc.sections[0].header.paragraphs[0].text = 'Empresa [EMPRESA]'
+    doc.sections[0].footer.paragraphs[0].text = 'Página de [NOME]'
+    caminho = tmp_path / 'Modelo.docx'
+    doc.save(caminho)
+    return caminho
+
+
+SUBSTITUICOES = {'[NOME]': 'Ana', '[CARGO]': 'Analista', '[EMPRESA]': 'ACME'}
+
+
+def verificar_documento_renderizado(conteudo):
+    doc = Document(io.BytesIO(conteudo))
+    assert doc.paragraphs[0].text == 'Contrato de Ana'
+    assert doc.paragraphs[0].runs[1].bold
+    assert doc.tables[0].cell(0, 0).text == 'Cargo: Analista'
+    assert doc.sections[0].header.paragraphs[0].text == 'Empresa ACME'
+    assert doc.sections[0].footer.paragraphs[0].text == 'Página de Ana'
+
+
+def test_renderizar_documento_retorna_bytes_sem_gravar_em_disco(modelo_completo, tmp_path):
+    modelo_bytes = modelo_completo.read_bytes()
+    for modelo in (str(modelo_completo), modelo_bytes, io.BytesIO(modelo_bytes)):
+        conteudo = da.renderizar_documento(modelo, SUBSTITUICOES)
+        assert isinstance(conteudo, bytes)
+        verificar_documento_renderizado(conteudo)
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['Modelo.docx']
+    # O modelo em cache não é alterado pelas renderizações
+    assert '[NOME]' in Document(modelo_completo).paragraphs[0].text
+
+
+def test_renderizar_documento_grava_no_destino(modelo_completo):
+    compactado = io.BytesIO()
+    with zipfile.ZipFile(compactado, 'w') as arquivo_zip:
+        with arquivo_zip.open('Ana.docx', 'w') as membro:
+            assert da.renderizar_documento(str(modelo_completo), SUBSTITUICOES, membro) is membro
+
+    with zipfile.ZipFile(compactado) as arquivo_zip:
+        verificar_documento_renderizado(arquivo_zip.read('Ana.docx'))
+
+
+def test_servidor_gera_bytes_sem_gravar_na_saida(servico, tmp_path):
+    conteudo = servico.gerar_bytes({}, {'Nome': 'Ana', 'Depto': 'RH'})
+
+    assert Document(io.BytesIO(conteudo)).paragraphs[0].text == 'Contrato de Ana'
+    assert list((tmp_path / 'saida').iterdir()) == []
+
+
+# ===============================
+# AUDITORIA
+# ===============================
+
+def test_auditoria_encontra_placeholders_quebrados_entre_runs(tmp_path):
+    doc = Document()
+    paragrafo = doc.add_paragraph('Olá [NO')
+    paragrafo.add_run('ME], cargo [CARGO] e [NOME]')
+    doc.sections[0].footer.paragraphs[0].text = 'Rodapé [CARGO]'
+    doc.add_paragraph('Nada a substituir: [OUTRO]')
+    doc.save(tmp_path / 'restantes.docx')
+    Document().save(tmp_path / 'limpo.docx')
+
+    resultado = da.auditar_arquivo(str(tmp_path / 'restantes.docx'), ('[NOME]', '[CARGO]'))
+    assert resultado['status'] == 'placeholders'
+    assert resultado['restantes'] == {'[NOME]': 2, '[CARGO]': 2}
+    assert da.auditar_arquivo(str(tmp_path / 'limpo.docx'), ('[NOME]',))['status'] == 'ok'
+
+
+def test_auditoria_detecta_arquivos_corrompidos(tmp_path):
+    Document().save(tmp_path / 'original.docx')
+    original = (tmp_path / 'original.docx').read_bytes()
+    (tmp_path / 'truncado.docx').write_bytes(original[:len(original) // 2])
+    (tmp_path / 'texto.docx').write_bytes(b'nao e um zip')
+    with zipfile.ZipFile(tmp_path / 'sem_documento.docx', 'w') as pacote:
+        pacote.writestr('[Content_Types].xml', '<Types/>')
+    # Conteúdo alterado sem atualizar o CRC da parte
+    with zipfile.ZipFile(tmp_path / 'crc.docx', 'w', zipfile.ZIP_STORED) as pacote:
+        pacote.writestr('word/document.xml', '<w:document xmlns:w="x"/>')
+    dados = (tmp_path / 'crc.docx').read_bytes()
+    (tmp_path / 'crc.docx').write_bytes(dados.replace(b'xmlns:w="x"', b'xmlns:w="y"'))
+
+    for nome in ('truncado', 'texto', 'sem_documento', 'crc'):
+        resultado = da.auditar_arquivo(str(tmp_path / f'{nome}.docx'), ('[NOME]',))
+        assert resultado['status'] == 'corrompido', nome
+        assert resultado['erro']
+
+
+def test_auditar_geracao_registra_problemas_no_diario(config, tmp_path):
+    config['placeholders'] = {'[NOME]': {'coluna': 'Nome'}}
+    doc = Document()
+    doc.add_paragraph('Contrato de [NOME]')
+    doc.save(tmp_path / 'Doc_1.docx')
+    Document().save(tmp_path / 'Doc_2.docx')
+    caminho_diario = tmp_path / 'diario_geracao.jsonl'
+    diario = da.DiarioExecucao(str(caminho_diario))
+    for indice in (1, 2, 2, 3):
+        diario.registrar_documento(indice, f'P{indice}', 'ok', arquivo=str(tmp_path / f'Doc_{indice}.docx'))
+    diario.fechar()
+
+    diario = da.DiarioExecucao(str(caminho_diario), continuar=True)
+    auditoria = da.auditar_geracao(diario, str(caminho_diario), processos=1)
+    diario.fechar()
+
+    assert (auditoria['arquivos'], auditoria['com_placeholders'], auditoria['faltantes']) == (2, 1, 1)
+    assert auditoria['placeholders'] == {'[NOME]': 1}
+    problemas = [(evento['status'], os.path.basename(evento['arquivo']))
+                 for evento in da.ler_diario(str(caminho_diario)) if evento['tipo'] == 'auditoria_problema']
+    assert problemas == [('placeholders', 'Doc_1.docx'), ('faltante', 'Doc_3.docx')]
+
+
+# ===============================
+# RENDERIZAÇÃO EM PROCESSOS
+# ===============================
+
+def test_tabela_de_textos_compartilhada_entre_processos():
+    formatados = {'[NOME]': ['Ana', 'José Ávila', ''], '[CARGO]': ['', 'Técnico', '日本']}
+    tabela = da.TabelaTextos.criar(formatados)
+    try:
+        anexada = da.TabelaTextos.anexar(tabela.descritor())
+        linhas = [anexada.linha(posicao) for posicao in range(3)]
+        anexada.fechar()
+    finally:
+        tabela.fechar()
+
+    assert linhas == [{'[NOME]': 'Ana', '[CARGO]': ''},
+                      {'[NOME]': 'José Ávila', '[CARGO]': 'Técnico'},
+                      {'[NOME]': '', '[CARGO]': '日本'}]
+    # O dono remove o bloco ao fechar
+    with pytest.raises(FileNotFoundError):
+        da.TabelaTextos.anexar(tabela.descritor())
+
+
+def test_renderizar_faixa_grava_devolve_bytes_e_erros(config, modelo_completo, tmp_path):
+    tabela = da.TabelaTextos.criar({ph: [valor, valor.upper()] for ph, valor in SUBSTITUICOES.items()})
+    modelos = [str(modelo_completo), str(tmp_path / 'inexistente.docx')]
+    try:
+        resultados = da.renderizar_faixa(tabela.descritor(), modelos,
+                                         [(0, 0, str(tmp_path / 'Ana.docx')), (1, 0, None), (0, 1, None)])
+    finally:
+        tabela.fechar()
+
+    assert resultados[0] is None
+    verificar_documento_renderizado((tmp_path / 'Ana.docx').read_bytes())
+    assert Document(io.BytesIO(resultados[1])).paragraphs[0].text == 'Contrato de ANA'
+    assert 'inexistente.docx' in resultados[2]
+
+
+def test_renderizador_gera_em_processos_na_ordem_de_envio(config, modelo_completo, tmp_path):
+    concluidos = []
+    renderizador = da.RenderizadorProcessos(2, [str(modelo_completo)],
+                                            lambda contexto, erro: concluidos.append((contexto, erro)))
+    try:
+        for inicio in (1, 4):
+            indices = list(range(inicio, inicio + 3))
+            renderizador.novo_bloco(indices, {ph: [f'{valor} {i}' for i in indices]
+                                              for ph, valor in SUBSTITUICOES.items()})
+            for idx in indices:
+                renderizador.enviar(idx, str(modelo_completo), str(tmp_path / f'Doc_{idx}.docx'), idx)
+    finally:
+        renderizador.finalizar()
+
+    assert concluidos == [(idx, None) for idx in range(1, 7)]
+    for idx in range(1, 7):
+        assert Document(tmp_path / f'Doc_{idx}.docx').paragraphs[0].text == f'Contrato de Ana {idx}'
+
+
+def test_renderizador_recria_o_pool_com_o_limite_entre_blocos(config):
+    renderizador = da.RenderizadorProcessos(3, [], lambda contexto, erro: None)
+    try:
+        renderizador.limite = 3
+        renderizador.novo_bloco([1, 2], {'[NOME]': ['a', 'b']})
+        assert (renderizador.trabalhadores, renderizador.recriacoes) == (3, 0)
+
+        renderizador.limite = 1
+        renderizador.novo_bloco([3, 4], {'[NOME]': ['c', 'd']})
+        assert renderizador.trabalhadores == renderizador.executor._max_workers == 1
+        assert renderizador.tamanho_lote == 1
+
+        renderizador.limite = 2
+        renderizador.novo_bloco([5, 6, 7, 8], {'[NOME]': ['e', 'f', 'g', 'h']})
+        assert renderizador.trabalhadores == renderizador.executor._max_workers == 2
+        assert renderizador.recriacoes == 2
+    finally:
+        renderizador.finalizar()
+
+
+# ===============================
+# TELEMETRIA
+# ===============================
+
+class SaidaTerminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def ler_eventos(caminho):
+    return [json.loads(linha) for linha in caminho.read_text(encoding='utf-8').splitlines()]
+
+
+def test_telemetria_limita_a_frequencia_e_grava_eventos(tmp_path):
+    saida = io.StringIO()
+    eventos = tmp_path / 'eventos.jsonl'
+    telemetria = da.Telemetria(4, {'intervalo_log': 3600}, str(eventos), saida=saida)
+    telemetria.pular()
+    telemetria.documento(2, 'Bia', 'ok', arquivo='Doc_2.docx')
+    telemetria.documento(3, 'Caio', 'erro', erro='falha')
+    assert saida.getvalue() == ''  # Nada na tela antes do intervalo
+    telemetria.finalizar()
+
+    linhas = saida.getvalue().splitlines()
+    assert len(linhas) == 1
+    assert '3/4 (75.0%)' in linhas[0] and 'erro 1 · ok 1' in linhas[0]
+    tipos = [evento['tipo'] for evento in ler_eventos(eventos)]
+    assert tipos == ['inicio', 'documento', 'documento', 'progresso', 'fim']
+    fim = ler_eventos(eventos)[-1]
+    assert (fim['concluidos'], fim['total'], fim['contagens']) == (3, 4, {'ok': 1, 'erro': 1})
+    assert telemetria.eventos is None
+
+
+def test_telemetria_no_terminal_reescreve_uma_unica_linha():
+    saida = SaidaTerminal()
+    telemetria = da.Telemetria(2, {'intervalo': 0}, saida=saida)
+    telemetria.documento(1, 'Ana', 'ok')
+    telemetria.documento(2, 'Bia', 'ok')
+    telemetria.finalizar()
+
+    texto = saida.getvalue()
+    assert texto.count('\r') == 3 and texto.count('\n') == 1
+    assert texto.endswith('\n') and '2/2 (100.0%)' in texto
+
+
+def test_telemetria_limita_os_avisos_no_console(capsys):
+    telemetria = da.Telemetria(0, saida=io.StringIO())
+    exibidos = [telemetria.aviso(f'falha {i}') for i in range(da.MAX_AVISOS_CONSOLE + 5)]
+
+    assert exibidos.count(True) == da.MAX_AVISOS_CONSOLE
+    saida = capsys.readouterr().out
+    assert f'falha {da.MAX_AVISOS_CONSOLE - 1}' in saida and f'falha {da.MAX_AVISOS_CONSOLE}' not in saida
+    assert 'Demais avisos apenas no diário' in saida
+
+
+def test_linha_de_comando_grava_eventos_da_geracao(config, tmp_path, monkeypatch, capsys):
+    pasta_modelos = tmp_path / 'modelos'
+    pasta_modelos.mkdir()
+    doc = Document()
+    doc.add_paragraph('Contrato de [NOME]')
+    doc.save(pasta_modelos / 'Contrato.docx')
+    pd.DataFrame({'Nome': ['Ana', 'Bia', 'Caio'], 'Modelo': ['Contrato', 'Faltando', 'Contrato']}).to_excel(
+        tmp_path / 'base.xlsx', index=False)
+    configuracao = tmp_path / 'config.json'
+    configuracao.write_text(json.dumps({
+        'diretorios': {'modelos': str(pasta_modelos), 'base_dados': str(tmp_path / 'base.xlsx'),
+                       'saida': str(tmp_path / 'saida')},
+        'placeholders': {'[NOME]': {'descricao': 'Nome', 'coluna': 'Nome'}},
+        'placeholder_log': '[NOME]',
+        'modelo_especifico': {'ativo': True, 'coluna': 'Modelo'},
+        'config_geral': {'padrao_nome_arquivo': 'Doc_[Nome].docx'},
+    }), encoding='utf-8')
+    monkeypatch.setattr(da, 'CONFIG_FILE', str(configuracao))
+    (tmp_path / 'saida').mkdir()
+    eventos = tmp_path / 'eventos.jsonl'
+
+    assert da.executar_linha_comando(['--processar', '--eventos', str(eventos)]) == 3
+
+    lidos = ler_eventos(eventos)
+    documentos = {evento['nome']: evento['status'] for evento in lidos if evento['tipo'] == 'documento'}
+    assert documentos == {'Ana': 'ok', 'Bia': 'modelo_faltante', 'Caio': 'ok'}
+    assert lidos[0]['tipo'] == 'inicio' and lidos[-1]['tipo'] == 'fim'
+    assert lidos[-1]['contagens'] == {'ok': 2, 'modelo_faltante': 1}
+    assert (tmp_path / 'saida' / 'Doc_Caio.docx').exists()